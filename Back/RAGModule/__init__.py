@@ -3,7 +3,11 @@ from langchain_core.output_parsers import JsonOutputParser
 
 from utils import *
     
-class Chain4RAG:
+class Chain4RAG(BaseChain):
+    # 句子过多时按句子拆分为多次调用（每份句子重新编号，合并时换算回原来的 id）
+    budget_policy = "split"
+    budget_field = "sentenceList"
+
     def __init__(self, model):
         ## 你将作为协助用户围绕调研场景Scenario进行信息调研的助手。请从SentenceList中为IntentsDict中的每一对Intent和Description各自筛选最多k个最相关的句子，并返回这些句子在SentenceList中的相应索性作为top-k。
         self.instruction = Prompts.RAG_INDEX
@@ -20,15 +24,22 @@ class Chain4RAG:
             },
         )
 
-        self.chain = self.prompt_template | self.model | self.parser
-
     async def invoke(self, scenario, intentsDict, sentenceList):
-        return self.chain.invoke(
+        return await self.run(
             # {"scenario": scenario, "intent": intent, "sentenceList": sentenceList, "recordList": recordList, "k": k, "description": description}
             {"scenario": scenario, "intentsDict": intentsDict, "sentenceList": sentenceList}
         )
 
-class Chain4Split:
+    def merge_results(self, results, index_maps=None):
+        return {
+            field: merge_grouped_indices(remap_indices(result[field], index_map) for result, index_map in zip(results, index_maps))
+            for field in ("top_all", "bottom_all")
+        }
+
+class Chain4Split(BaseChain):
+    budget_policy = "split"
+    budget_field = "webContent"
+
     def __init__(self, model):
         ## 你将作为协助用户围绕调研场景Scenario进行信息调研的助手。请将WebContent按上下文语义分句，过滤掉无意义的乱码内容，并以列表形式返回。
         self.instruction = """
@@ -63,10 +74,8 @@ Segment web content into meaningful sentences based on semantic context and retu
                 "format_instructions": self.parser.get_format_instructions()
             },
         )
-
-        self.chain = self.prompt_template | self.model | self.parser
     
     async def invoke(self, scenario, webContent):
-        return self.chain.invoke(
+        return await self.run(
             {"scenario": scenario, "webContent": webContent}
         )
\ No newline at end of file
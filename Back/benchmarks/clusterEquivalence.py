@@ -0,0 +1,60 @@
+"""
+检查大规模聚类路径与稠密路径的一致性：在略大于 DENSE_LIMIT 的合成记录上，
+分别用稠密的预计算距离矩阵和分块的 average_linkage_merges 聚类，两者在每个阈值上的划分必须完全相同；
+Dendrogram 在阈值与簇数上的截断同样比较。存在不一致时以非零状态退出。
+
+用法（在 Back 目录下）：
+    python -m benchmarks.clusterEquivalence --thresholds 0.3 0.5 0.7 0.9
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import clusterGenerator
+from benchmarks.clusterScaling import make_vectors
+
+
+def same_partition(a, b) -> bool:
+    """两组簇标签是否表示同一个划分（不要求编号相同）"""
+    pairs = set(zip(np.asarray(a).tolist(), np.asarray(b).tolist()))
+    return len(pairs) == len(set(a)) == len(set(b))
+
+
+def run(n, thresholds, n_clusters):
+    vectors = make_vectors(n)
+    failures = 0
+    print(f"n = {n} (DENSE_LIMIT = {clusterGenerator.DENSE_LIMIT})")
+    print(f"{'cut':>14}{'dense':>8}{'blocked':>9}{'seconds':>10}{'same':>6}")
+    for t in thresholds:
+        dense = clusterGenerator.cluster_vectors(vectors, t, dense_limit=n)
+        start = time.perf_counter()
+        blocked = clusterGenerator.cluster_vectors(vectors, t, dense_limit=n - 1)
+        elapsed = time.perf_counter() - start
+        same = same_partition(dense, blocked)
+        failures += not same
+        print(f"{'t=' + str(t):>14}{len(set(dense)):>8}{len(set(blocked)):>9}{elapsed:>10.2f}{str(same):>6}")
+
+    dense_tree = clusterGenerator.Dendrogram(vectors, dense_limit=n)
+    blocked_tree = clusterGenerator.Dendrogram(vectors, dense_limit=n - 1)
+    cuts = [{"distance_threshold": t} for t in thresholds] + [{"n_clusters": k} for k in n_clusters]
+    for cut in cuts:
+        dense, blocked = dense_tree.cut(**cut), blocked_tree.cut(**cut)
+        same = same_partition(dense, blocked)
+        failures += not same
+        name = "tree " + ("t=" + str(cut["distance_threshold"]) if "distance_threshold" in cut else "k=" + str(cut["n_clusters"]))
+        print(f"{name:>14}{len(set(dense)):>8}{len(set(blocked)):>9}{'':>10}{str(same):>6}")
+    return failures
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, default=clusterGenerator.DENSE_LIMIT + 500)
+    parser.add_argument("--thresholds", type=float, nargs="+", default=[0.3, 0.5, 0.7, 0.9, 1.0])
+    parser.add_argument("--clusters", type=int, nargs="+", default=[5, 50, 200])
+    args = parser.parse_args()
+    sys.exit(1 if run(args.records, args.thresholds, args.clusters) else 0)
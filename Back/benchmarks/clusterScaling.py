@@ -0,0 +1,55 @@
+"""
+聚类规模压测：在 100、1k、10k、50k 条合成记录上运行 clusterGenerator.cluster_vectors，
+报告耗时与簇数；n <= 1k 时同时运行旧的稠密实现作为对照。
+
+用法（在 Back 目录下）：
+    python -m benchmarks.clusterScaling --sizes 100 1000 10000 50000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+from sklearn.cluster import AgglomerativeClustering
+from sklearn.metrics.pairwise import cosine_similarity
+
+import clusterGenerator
+
+
+def make_vectors(n, dim=384, topics=50, seed=0):
+    """围绕 topics 个主题中心生成带噪声的单位向量，模拟 all-MiniLM-L6-v2 的嵌入分布"""
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((topics, dim))
+    vectors = centers[rng.integers(0, topics, n)] + 0.6 * rng.standard_normal((n, dim))
+    return (vectors / np.linalg.norm(vectors, axis=1, keepdims=True)).astype(np.float32)
+
+
+def legacy(vectors, distance_threshold):
+    distance_matrix = 1 - cosine_similarity(vectors)
+    return AgglomerativeClustering(distance_threshold=distance_threshold, n_clusters=None).fit_predict(distance_matrix)
+
+
+def run(sizes, distance_threshold):
+    print(f"{'n':>8}{'engine':>10}{'seconds':>10}{'clusters':>10}")
+    for n in sizes:
+        vectors = make_vectors(n)
+        start = time.perf_counter()
+        labels = clusterGenerator.cluster_vectors(vectors, distance_threshold)
+        elapsed = time.perf_counter() - start
+        engine = "dense" if n <= clusterGenerator.DENSE_LIMIT else "blocked"
+        print(f"{n:>8}{engine:>10}{elapsed:>10.2f}{len(np.unique(labels)):>10}")
+        if n <= 1000:
+            start = time.perf_counter()
+            labels = legacy(vectors, distance_threshold)
+            print(f"{n:>8}{'legacy':>10}{time.perf_counter() - start:>10.2f}{len(np.unique(labels)):>10}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    parser.add_argument("--threshold", type=float, default=0.5)
+    args = parser.parse_args()
+    run(args.sizes, args.threshold)
@@ -0,0 +1,58 @@
+"""
+嵌入吞吐压测：逐条 embedding（旧的调用方式）与批量 embedding_batch 的 records/s 对比，
+以及缓存命中（记录未变化）时的批量吞吐。
+
+用法（在 Back 目录下）：
+    python -m benchmarks.embedThroughput --n 200
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import embedModule
+
+KEYS = ["context", "content", "comment"]
+
+
+def make_records(n):
+    return [
+        {
+            "id": i,
+            "comment": f"note {i % 7} about the highlight",
+            "content": f"Highlighted passage number {i} describing a concept in some detail.",
+            "context": f"Section {i % 13}: the surrounding paragraph of the highlighted passage {i}.",
+        }
+        for i in range(n)
+    ]
+
+
+def timed(fn):
+    start = time.perf_counter()
+    fn()
+    return time.perf_counter() - start
+
+
+def run(n):
+    model = embedModule.EmbedModel()
+    records = make_records(n)
+    model.embeddingList(["warm up"])
+
+    model.cache.clear()
+    single = timed(lambda: [model.embedding(record, KEYS, vector_operation_mode="add") for record in records])
+    model.cache.clear()
+    bulk = timed(lambda: model.embedding_batch(records, KEYS, vector_operation_mode="add"))
+    cached = timed(lambda: model.embedding_batch(records, KEYS, vector_operation_mode="add"))
+
+    print(f"{'mode':<18}{'records':>10}{'seconds':>10}{'records/s':>12}")
+    for mode, seconds in (("single", single), ("bulk", bulk), ("bulk (cached)", cached)):
+        print(f"{mode:<18}{n:>10}{seconds:>10.3f}{n / seconds:>12.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=200)
+    args = parser.parse_args()
+    run(args.n)
@@ -0,0 +1,58 @@
+"""
+压测用的假 LLM：按固定延迟返回合法的 JSON，用来隔离网络波动，只测服务端的并发行为。
+同步路径用 time.sleep（会阻塞事件循环），异步路径用 asyncio.sleep。
+token_latency > 0 时每个 prompt token 额外增加相应的延迟，模拟长 prompt 更慢。
+"""
+import asyncio
+import json
+import re
+import time
+
+from langchain_core.language_models.chat_models import BaseChatModel
+from langchain_core.messages import AIMessage
+from langchain_core.outputs import ChatGeneration, ChatResult
+
+from utils import count_tokens
+
+
+class SlowFakeChatModel(BaseChatModel):
+    latency: float = 0.5
+    token_latency: float = 0.0
+    model_name: str = "slow-fake"
+    temperature: float = 0.0
+
+    @property
+    def _llm_type(self) -> str:
+        return "slow-fake"
+
+    def _respond(self, messages) -> str:
+        prompt = messages[-1].content
+        if "List of highlighted text" in prompt:
+            # Chain4Grouping: 把输入的 id 对半分成两组
+            highlight = prompt.split("List of highlighted text:", 1)[1]
+            n = len(re.findall(r"'id': \d+", highlight)) or len(re.findall(r'"id": \d+', highlight))
+            half = max(1, n // 2)
+            groups = {"group_a": list(range(half))}
+            if n > half:
+                groups["group_b"] = list(range(half, n))
+            return json.dumps({"groups": groups})
+        if "SentenceList" in prompt:
+            return json.dumps({"top_all": {}, "bottom_all": {}})
+        if "Json file:" in prompt:
+            return json.dumps([
+                {"intent_id": 1, "intent_name": "Intent 1", "intent_description": "", "level": "1", "parent": None}
+            ])
+        return json.dumps({"familiarity": "neutral", "specificity": "moderate"})
+
+    def _delay(self, messages) -> float:
+        if not self.token_latency:
+            return self.latency
+        return self.latency + self.token_latency * count_tokens(messages[-1].content)
+
+    def _generate(self, messages, stop=None, run_manager=None, **kwargs):
+        time.sleep(self._delay(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
+
+    async def _agenerate(self, messages, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self._delay(messages))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self._respond(messages)))])
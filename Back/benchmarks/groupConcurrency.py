@@ -0,0 +1,70 @@
+"""
+并发压测：同时发起 N 个 /group/ 请求，比较同步 invoke（阻塞事件循环）与异步 ainvoke 的总耗时。
+异步路径下 N 个请求的总耗时应接近单个请求的耗时。
+压测时关闭 LLM 缓存，并且每一轮使用不同的 scenario，粒度备忘录与缓存都不会命中，每个请求都真正调用模型。
+
+用法（在 Back 目录下）：
+    python -m benchmarks.groupConcurrency --n 20 --latency 0.5
+"""
+import argparse
+import asyncio
+import logging
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import httpx
+
+import extractModule
+import main
+from benchmarks.fakeModel import SlowFakeChatModel
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+RECORDS = {
+    "data": [
+        {"id": i, "comment": f"comment {i}", "content": f"highlighted text {i}", "context": f"context {i}"}
+        for i in range(4)
+    ]
+}
+
+
+async def fire(n, tag):
+    transport = httpx.ASGITransport(app=main.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        responses = await asyncio.gather(*[
+            client.post("/group/", params={"scenario": f"{tag} scenario {i}"}, json=RECORDS) for i in range(n)
+        ])
+        elapsed = time.perf_counter() - start
+    assert all(r.status_code == 200 for r in responses), [r.text for r in responses if r.status_code != 200]
+    return elapsed
+
+
+def run(n, latency):
+    fake = SlowFakeChatModel(latency=latency)
+    # 只测并发：相同 prompt 命中缓存会让后一轮的耗时接近 0
+    main.BaseChain.cache = None
+    main.chain4Granularity = extractModule.Chain4InferringGranularity(fake)
+    main.chain4Grouping = extractModule.Chain4Grouping(fake)
+
+    print(f"{'mode':<10}{'requests':>10}{'total (s)':>12}{'per request (s)':>18}")
+    for blocking in (True, False):
+        main.chain4Granularity.blocking = blocking
+        main.chain4Grouping.blocking = blocking
+        mode = "blocking" if blocking else "async"
+        single = asyncio.run(fire(1, f"{mode} single"))
+        total = asyncio.run(fire(n, mode))
+        print(f"{mode:<10}{1:>10}{single:>12.2f}{single:>18.2f}")
+        print(f"{mode:<10}{n:>10}{total:>12.2f}{total / n:>18.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.5)
+    args = parser.parse_args()
+    run(args.n, args.latency)
@@ -0,0 +1,72 @@
+"""
+merge_dicts 微基准：10k 个句子、50 个意图，按块切分后合并，对比旧的 list(set(...)) 实现。
+
+用法（在 Back 目录下）：
+    python -m benchmarks.mergeDicts --sentences 10000 --intents 50 --chunks 50
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import merge_dicts
+
+
+def legacy_merge_dicts(data):
+    merged_dict = {"top_k": {}, "bottom_k": {}}
+    for item in data:
+        for key, value in item["top_k"].items():
+            if key not in merged_dict["top_k"]:
+                merged_dict["top_k"][key] = []
+            merged_dict["top_k"][key].extend(value)
+            merged_dict["top_k"][key] = list(set(merged_dict["top_k"][key]))
+        for key, value in item["bottom_k"].items():
+            if key not in merged_dict["bottom_k"]:
+                merged_dict["bottom_k"][key] = []
+            merged_dict["bottom_k"][key].extend(value)
+            merged_dict["bottom_k"][key] = list(set(merged_dict["bottom_k"][key]))
+    return merged_dict
+
+
+def make_chunks(n_sentences, n_intents, n_chunks, per_intent=0.2, seed=0):
+    rng = random.Random(seed)
+    bounds = [round(i * n_sentences / n_chunks) for i in range(n_chunks + 1)]
+    chunks = []
+    for start, end in zip(bounds, bounds[1:]):
+        indices = list(range(start, end))
+        k = max(1, int(len(indices) * per_intent))
+        chunks.append({
+            "top_k": {f"intent {i}": rng.sample(indices, k) for i in range(n_intents)},
+            "bottom_k": {f"intent {i}": rng.sample(indices, k) for i in range(n_intents)},
+        })
+    return chunks
+
+
+def timed(fn, data, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(data)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def run(n_sentences, n_intents, n_chunks):
+    data = make_chunks(n_sentences, n_intents, n_chunks)
+    assert merge_dicts(data) == merge_dicts(data)
+    print(f"{n_sentences} sentences x {n_intents} intents, {n_chunks} chunks")
+    print(f"{'implementation':<16}{'seconds':>10}")
+    print(f"{'legacy':<16}{timed(legacy_merge_dicts, data):>10.4f}")
+    print(f"{'ordered':<16}{timed(merge_dicts, data):>10.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sentences", type=int, default=10000)
+    parser.add_argument("--intents", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=50)
+    args = parser.parse_args()
+    run(args.sentences, args.intents, args.chunks)
@@ -0,0 +1,114 @@
+"""
+重复记录合并基准：模拟用户反复划选相同或重叠段落的会话，对比开启/关闭 RecordDeduplicator 时
+/group/ 与 /extract/ 的 prompt token 数和耗时。假 LLM 的延迟随 prompt token 数增长。
+
+用法（在 Back 目录下）：
+    python -m benchmarks.recordDedup --passages 40 --repeats 3 --token-latency 0.0002
+"""
+import argparse
+import asyncio
+import logging
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+
+import httpx
+
+import extractModule
+import main
+from benchmarks.fakeModel import SlowFakeChatModel
+from utils import BaseChain, TokenMetrics
+
+logging.getLogger("httpx").setLevel(logging.WARNING)
+
+WORDS = "intent record highlight context travel budget hotel museum prompt model paper summary review price".split()
+
+
+def make_session(passages, repeats, seed=0):
+    """
+    每个段落被划选 1..repeats 次：原文、大小写/空白不同的副本，或首尾少几个词的重叠划选。
+    同一网页上的记录共享 context。
+    """
+    rng = random.Random(seed)
+    records = []
+    for passage in range(passages):
+        words = [rng.choice(WORDS) + str(rng.randint(0, 999)) for _ in range(rng.randint(30, 60))]
+        context = f"page {passage % 5}: " + " ".join(rng.choice(WORDS) for _ in range(80))
+        for copy in range(rng.randint(1, repeats)):
+            variant = list(words)
+            if copy % 3 == 1:
+                variant = [word.upper() if i == 0 else word for i, word in enumerate(variant)] + [""]
+            elif copy % 3 == 2:
+                variant = variant[1:-1]
+            records.append({
+                "id": len(records),
+                "comment": f"note {passage}",
+                "content": " ".join(variant),
+                "context": context,
+            })
+    rng.shuffle(records)
+    return records
+
+
+async def run_once(records):
+    BaseChain.metrics = TokenMetrics()
+    main.granularityMemo.clear()
+    async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://bench", timeout=None) as client:
+        start = time.perf_counter()
+        grouped = await client.post("/group/", params={"scenario": "bench"}, json={"data": records})
+        group_seconds = time.perf_counter() - start
+        assert grouped.status_code == 200, grouped.text
+
+        start = time.perf_counter()
+        extracted = await client.post("/extract/", json={"scenario": "bench", "groupsOfNodes": grouped.json()["groupsOfNodes"]})
+        extract_seconds = time.perf_counter() - start
+        assert extracted.status_code == 200, extracted.text
+
+    # 合并只影响 prompt：所有记录都应出现在一级分组中
+    first_level = [group for group in grouped.json()["groupsOfNodes"] if group["level"] == "1"]
+    covered = sorted(record["id"] for group in first_level for record in group["records"])
+    assert covered == sorted(record["id"] for record in records), "records lost by deduplication"
+
+    chains = BaseChain.metrics.stats()["chains"]
+    prompt_tokens = {name: stats["prompt_tokens"] for name, stats in chains.items()}
+    return {
+        "group_seconds": group_seconds,
+        "extract_seconds": extract_seconds,
+        "grouping_tokens": prompt_tokens.get("Chain4Grouping", 0),
+        "extract_tokens": prompt_tokens.get("Chain4ExtractIntent", 0),
+        "dedup": grouped.headers.get("X-Dedup-Records", "-"),
+    }
+
+
+def run(passages, repeats, latency, token_latency):
+    fake = SlowFakeChatModel(latency=latency, token_latency=token_latency)
+    main.chain4Granularity = extractModule.Chain4InferringGranularity(fake)
+    main.chain4Grouping = extractModule.Chain4Grouping(fake)
+    main.chain4ExtractIntent = extractModule.Chain4ExtractIntent(fake)
+    BaseChain.cache = None
+
+    records = make_session(passages, repeats)
+    print(f"{len(records)} records from {passages} passages")
+    print(f"{'dedup':<8}{'records':>10}{'group tok':>12}{'extract tok':>13}{'/group/ (s)':>13}{'/extract/ (s)':>15}")
+    for enabled in (False, True):
+        main.recordDeduplicator.enabled = enabled
+        result = asyncio.run(run_once(records))
+        print(
+            f"{'on' if enabled else 'off':<8}{result['dedup']:>10}{result['grouping_tokens']:>12}{result['extract_tokens']:>13}"
+            f"{result['group_seconds']:>13.2f}{result['extract_seconds']:>15.2f}"
+        )
+    print(main.recordDeduplicator.stats())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--passages", type=int, default=40)
+    parser.add_argument("--repeats", type=int, default=3)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--token-latency", type=float, default=0.0002)
+    args = parser.parse_args()
+    run(args.passages, args.repeats, args.latency, args.token_latency)
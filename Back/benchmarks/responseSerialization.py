@@ -0,0 +1,83 @@
+"""
+大响应序列化基准：对比 FastAPI 默认路径（jsonable_encoder + JSONResponse）与 FastJSONResponse，
+并给出 gzip 压缩（与 GZipMiddleware 相同的压缩级别）后的传输字节数。
+
+用法（在 Back 目录下）：
+    python -m benchmarks.responseSerialization --records 50 500 5000
+"""
+import argparse
+import gzip
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse
+
+from benchmarks.treeProjection import make_request
+from utils import FastJSONResponse
+
+
+WORDS = "intent record highlight context travel budget hotel museum prompt model paper summary review price".split()
+
+
+def randomize_text(tree, content_chars, seed=0):
+    """用随机单词替换记录正文，使 gzip 压缩率接近真实网页文本"""
+    rng = random.Random(seed)
+
+    def text():
+        words = []
+        while sum(len(word) + 1 for word in words) < content_chars:
+            words.append(rng.choice(WORDS) + str(rng.randint(0, 999)))
+        return " ".join(words)
+
+    seen = set()
+    for node in tree["item"].values():
+        for child in node["child"]:
+            for record in child["group"]:
+                if id(record) not in seen:
+                    seen.add(id(record))
+                    record["content"], record["context"] = text(), text()
+    return tree
+
+
+def default_render(content):
+    return JSONResponse(jsonable_encoder(content)).body
+
+
+def fast_render(content):
+    return FastJSONResponse(content).body
+
+
+def measure(fn, content, repeat=5):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn(content)
+        best = min(best, time.perf_counter() - start)
+    return best, body
+
+
+def run(record_counts, content_chars):
+    print(f"{'records':>8}{'default ms':>12}{'fast ms':>10}{'speedup':>9}{'raw KB':>10}{'gzip KB':>10}")
+    for n_records in record_counts:
+        tree = randomize_text(make_request(n_records, content_chars), content_chars)
+        default_seconds, default_body = measure(default_render, tree)
+        fast_seconds, fast_body = measure(fast_render, tree)
+        assert len(default_body) == len(fast_body)
+        print(
+            f"{n_records:>8}{default_seconds * 1000:>12.2f}{fast_seconds * 1000:>10.2f}"
+            f"{default_seconds / fast_seconds:>8.1f}x{len(fast_body) / 1024:>10.1f}"
+            f"{len(gzip.compress(fast_body, compresslevel=9)) / 1024:>10.1f}"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--content-chars", type=int, default=500)
+    args = parser.parse_args()
+    run(args.records, args.content_chars)
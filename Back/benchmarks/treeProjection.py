@@ -0,0 +1,97 @@
+"""
+/recommend/ 过滤 records 的微基准：对比旧的 copy.deepcopy + 清空 records/group 与 project_tree。
+
+用法（在 Back 目录下）：
+    python -m benchmarks.treeProjection --records 50 500 5000 --content-chars 2000
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from utils import project_tree
+
+
+def legacy_filter(request):
+    filtered_request = copy.deepcopy(request)
+
+    def remove_records_from_tree(tree_node):
+        if isinstance(tree_node, dict):
+            if "records" in tree_node:
+                tree_node["records"] = []
+            if "child" in tree_node and isinstance(tree_node["child"], list):
+                for child in tree_node["child"]:
+                    remove_records_from_tree(child)
+            if "group" in tree_node:
+                tree_node["group"] = []
+
+    if "item" in filtered_request:
+        for node_data in filtered_request["item"].values():
+            remove_records_from_tree(node_data)
+    if "groupsOfNodes" in filtered_request:
+        for group in filtered_request["groupsOfNodes"]:
+            if "records" in group:
+                group["records"] = []
+    return filtered_request
+
+
+def make_request(n_records, content_chars, n_intents=10, n_children=4):
+    records = [
+        {"id": i, "content": f"record {i} " + "x" * content_chars, "context": "y" * content_chars, "comment": f"comment {i}"}
+        for i in range(n_records)
+    ]
+    per_leaf = max(1, n_records // (n_intents * n_children))
+    item = {}
+    leaf = 0
+    for i in range(n_intents):
+        children = []
+        for j in range(n_children):
+            group = records[leaf * per_leaf:(leaf + 1) * per_leaf]
+            leaf += 1
+            children.append({
+                "id": i * 100 + j, "intent": f"intent {i}.{j}", "description": "desc", "priority": 5,
+                "child_num": 0, "group": group, "level": "2", "parent": i, "immutable": False, "child": [],
+            })
+        item[f"intent {i}"] = {
+            "id": i, "intent": f"intent {i}", "description": "desc", "priority": 5, "child_num": n_children,
+            "group": [], "level": "1", "parent": None, "immutable": True, "child": children,
+        }
+    return {"scenario": "benchmark", "item": item, "groupsOfNodes": [{"intent_id": 1, "records": records[:per_leaf]}]}
+
+
+def measure(fn, request, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(request)
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn(request)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return best, peak
+
+
+def run(record_counts, content_chars):
+    print(f"{'records':>8}{'deepcopy s':>14}{'deepcopy KB':>14}{'project s':>12}{'project KB':>13}{'speedup':>10}")
+    for n_records in record_counts:
+        request = make_request(n_records, content_chars)
+        assert str(legacy_filter(request)) == str(project_tree(request))
+        legacy_seconds, legacy_peak = measure(legacy_filter, request)
+        project_seconds, project_peak = measure(project_tree, request)
+        print(
+            f"{n_records:>8}{legacy_seconds:>14.5f}{legacy_peak / 1024:>14.1f}"
+            f"{project_seconds:>12.5f}{project_peak / 1024:>13.1f}{legacy_seconds / project_seconds:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, nargs="+", default=[50, 500, 5000])
+    parser.add_argument("--content-chars", type=int, default=2000)
+    args = parser.parse_args()
+    run(args.records, args.content_chars)
@@ -0,0 +1,66 @@
+"""
+向量索引基准：逐批增量加入 N 条记录向量，测量 k 近邻检索延迟，以及快照保存/内存映射恢复的耗时。
+使用随机向量，不加载嵌入模型。
+
+用法（在 Back 目录下）：
+    python -m benchmarks.vectorIndex --records 1000 10000 50000
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import numpy as np
+
+import vectorIndex
+
+
+def measure(n, dim, batch, k, queries=200):
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(n, dim)).astype(np.float32)
+    index = vectorIndex.VectorIndex()
+
+    start = time.perf_counter()
+    for offset in range(0, n, batch):
+        index.add([(i, f"record {i}") for i in range(offset, min(offset + batch, n))], vectors[offset:offset + batch])
+    add_seconds = time.perf_counter() - start
+
+    index.search(vectors[:1], k)
+    start = time.perf_counter()
+    for i in range(queries):
+        index.search(vectors[i:i + 1], k)
+    search_ms = (time.perf_counter() - start) / queries * 1000
+
+    with tempfile.TemporaryDirectory() as directory:
+        start = time.perf_counter()
+        index.snapshot(directory)
+        snapshot_seconds = time.perf_counter() - start
+
+        start = time.perf_counter()
+        restored = vectorIndex.VectorIndex.restore(directory)
+        restore_seconds = time.perf_counter() - start
+        assert restored.search(vectors[:1], 1)[0][0][0] == 0
+        del restored
+    return add_seconds, search_ms, snapshot_seconds, restore_seconds
+
+
+def run(sizes, dim, batch, k):
+    backend = "faiss" if vectorIndex.faiss is not None else "numpy"
+    print(f"backend: {backend}, dim: {dim}, batch: {batch}, k: {k}")
+    print(f"{'records':>10}{'add (s)':>10}{'search (ms)':>14}{'snapshot (s)':>15}{'restore (s)':>14}")
+    for n in sizes:
+        add_seconds, search_ms, snapshot_seconds, restore_seconds = measure(n, dim, batch, k)
+        print(f"{n:>10}{add_seconds:>10.3f}{search_ms:>14.3f}{snapshot_seconds:>15.3f}{restore_seconds:>14.4f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--records", type=int, nargs="+", default=[1000, 10000, 50000])
+    parser.add_argument("--dim", type=int, default=384)
+    parser.add_argument("--batch", type=int, default=20)
+    parser.add_argument("--k", type=int, default=5)
+    args = parser.parse_args()
+    run(args.records, args.dim, args.batch, args.k)
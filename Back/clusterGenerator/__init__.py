@@ -1,24 +1,176 @@
 from sklearn.cluster import AgglomerativeClustering
-from sklearn.metrics.pairwise import cosine_similarity
+from sklearn.metrics.pairwise import cosine_distances
+
 import numpy as np
-from scipy.cluster.hierarchy import linkage
+from scipy.cluster.hierarchy import fcluster, linkage
 from scipy.spatial.distance import pdist, squareform
+import hashlib
+import threading
+from collections import OrderedDict
 
+# 超过该数量时不再构建 N×N 距离矩阵，改用分块计算的精确 average linkage
+DENSE_LIMIT = 2000
 
-def hierarcy_clustering(dataList, distance_threshold: float):
-    # 提取vectors
-    vectors = np.array([data['vector'] for data in dataList])
+# 分块计算簇间相似度时，每块最多包含的元素数（float32，约 16MB）
+_BLOCK_ELEMENTS = 4_000_000
+
+
+def _nearest_clusters(sums, counts, rows):
+    """
+    rows 中各簇在所有簇（单位向量之和为 sums、大小为 counts）中的最近邻。
+    两簇的平均余弦距离 = 1 - sums[i]·sums[j] / (counts[i]·counts[j])，按行分块计算，不保存整个矩阵。
+
+    :return: (最近邻的下标, 到最近邻的平均余弦距离)
+    """
+    m = len(sums)
+    matrix = sums.astype(np.float32)
+    nearest = np.empty(len(rows), dtype=int)
+    distance = np.empty(len(rows))
+    block = max(1, _BLOCK_ELEMENTS // m)
+    for start in range(0, len(rows), block):
+        chunk = rows[start:start + block]
+        similarity = (matrix[chunk] @ matrix.T) / np.outer(counts[chunk], counts)
+        similarity[np.arange(len(chunk)), chunk] = -np.inf
+        nearest[start:start + len(chunk)] = similarity.argmax(axis=1)
+        distance[start:start + len(chunk)] = 1 - similarity[np.arange(len(chunk)), nearest[start:start + len(chunk)]]
+    return nearest, distance
+
+
+def average_linkage_merges(vectors, distance_threshold: float | None = None) -> list:
+    """
+    不构建 N×N 距离矩阵的精确 average linkage（余弦距离），内存为 O(n·d)。
+
+    每个簇只保存单位向量之和与大小，簇间平均余弦距离可以由两者精确算出。每一轮同时合并所有互为最近邻的簇对；
+    average linkage 满足可约性，这样得到的合并与逐次合并最近的两簇完全相同。
+    合并后的簇到其他簇的距离不小于原来两簇中较近的那个，因此只有新簇和最近邻被合并的簇需要重新分块查找最近邻。
+    给定 distance_threshold 时，最近邻距离已经不小于阈值的簇以后也不会再以小于阈值的距离合并，直接退出计算。
+
+    :return: 合并列表 [(a, b, 距离)]，0..n-1 为原始向量，第 k 次合并产生的簇编号为 n + k；
+             未给定阈值时合并到只剩一个簇
+    """
+    vectors = np.asarray(vectors, dtype=np.float64)
+    n = len(vectors)
+    sums = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-12)
+    counts = np.ones(n)
+    ids = np.arange(n)
+    # 最近邻的簇编号、距离，以及是否需要重新查找
+    nearest_ids = np.zeros(n, dtype=int)
+    distance = np.zeros(n)
+    stale = np.ones(n, dtype=bool)
+    row_of = np.zeros(2 * n, dtype=int)
+    merges = []
+    while len(ids) > 1:
+        rows = np.flatnonzero(stale)
+        if len(rows):
+            nearest_rows, distance[rows] = _nearest_clusters(sums, counts, rows)
+            nearest_ids[rows] = ids[nearest_rows]
+        if distance_threshold is not None:
+            alive = distance < distance_threshold
+            if not alive.any():
+                break
+            # 留下的簇的最近邻一定也留下
+            sums, counts, ids, nearest_ids, distance = sums[alive], counts[alive], ids[alive], nearest_ids[alive], distance[alive]
+            if len(ids) < 2:
+                break
+
+        row_of[ids] = np.arange(len(ids))
+        nearest = row_of[nearest_ids]
+        candidates = np.arange(len(ids))
+        pairs = candidates[(nearest[nearest] == candidates) & (candidates < nearest)]
+        if len(pairs) == 0:
+            # 距离相等时可能不存在互为最近邻的簇对，此时合并全局最近的一对
+            pairs = np.array([int(np.argmin(distance))])
+        pairs = pairs[np.argsort(distance[pairs], kind="stable")]
+        partners = nearest[pairs]
+        for a, b in zip(pairs, partners):
+            merges.append((int(ids[a]), int(ids[b]), float(distance[a])))
 
-    # 计算余弦相似度
-    cosine_sim = cosine_similarity(vectors)
+        merged = np.zeros(len(ids), dtype=bool)
+        merged[pairs] = merged[partners] = True
+        keep = ~merged
+        new_ids = np.arange(n + len(merges) - len(pairs), n + len(merges))
+        sums = np.vstack([sums[keep], sums[pairs] + sums[partners]])
+        counts = np.concatenate([counts[keep], counts[pairs] + counts[partners]])
+        ids = np.concatenate([ids[keep], new_ids])
+        nearest_ids = np.concatenate([nearest_ids[keep], new_ids])
+        distance = np.concatenate([distance[keep], np.zeros(len(pairs))])
+        stale = np.concatenate([merged[nearest][keep], np.ones(len(pairs), dtype=bool)])
+    return merges
 
-    # 转换为距离矩阵
-    distance_matrix = 1 - cosine_sim
 
-    # 使用层次聚类
-    model = AgglomerativeClustering(distance_threshold=distance_threshold, n_clusters=None)
+def merges_to_labels(merges, n):
+    """average_linkage_merges 的结果 -> 长度为 n 的簇标签（从 0 开始，按首次出现的顺序编号）"""
+    labels = np.arange(n + len(merges))
+    for k in range(len(merges) - 1, -1, -1):
+        a, b, _ = merges[k]
+        labels[a] = labels[b] = labels[n + k]
+    _, first, inverse = np.unique(labels[:n], return_index=True, return_inverse=True)
+    return np.argsort(np.argsort(first))[inverse]
+
+
+def merges_to_linkage(merges, n):
+    """把完整的 average_linkage_merges 结果转换为 scipy 的 linkage 格式（按合并距离排序）"""
+    heights = np.zeros(n + len(merges))
+    sizes = np.ones(n + len(merges))
+    for k, (a, b, distance) in enumerate(merges):
+        # 浮点误差可能让父节点略低于子节点，取最大值保证单调
+        heights[n + k] = max(distance, heights[a], heights[b])
+        sizes[n + k] = sizes[a] + sizes[b]
+    # 父节点一定在子节点之后产生，稳定排序后子节点仍排在父节点之前
+    order = np.argsort(heights[n:], kind="stable")
+    position = np.arange(n + len(merges))
+    position[n + order] = n + np.arange(len(merges))
+    return np.array(
+        [
+            [min(position[a], position[b]), max(position[a], position[b]), heights[n + k], sizes[n + k]]
+            for k, (a, b, _) in ((k, merges[k]) for k in order)
+        ],
+        dtype=np.float64,
+    )
+
+
+def cluster_vectors(vectors, distance_threshold: float, dense_limit: int = DENSE_LIMIT):
+    """
+    对向量做基于余弦距离的 average-linkage 层次聚类，在 distance_threshold 处截断。
+
+    - n <= dense_limit：直接在预计算的余弦距离矩阵上聚类（O(n²) 内存）；
+    - n > dense_limit：average_linkage_merges 分块计算，内存为 O(n·d)。
+    两种方式都是精确的 average linkage，同一个 distance_threshold 得到相同的划分。
+
+    :param vectors: (n, d) 向量数组
+    :param distance_threshold: 余弦距离阈值，簇间平均距离大于该值时不再合并
+    :return: 长度为 n 的簇标签数组
+    """
+    vectors = np.asarray(vectors, dtype=np.float32)
+    n = len(vectors)
+    if n < 2:
+        return np.zeros(n, dtype=int)
+
+    if n <= dense_limit:
+        distance_matrix = np.clip(cosine_distances(vectors), 0, None)
+        model = AgglomerativeClustering(
+            metric="precomputed",
+            linkage="average",
+            distance_threshold=distance_threshold,
+            n_clusters=None,
+        )
+        return model.fit_predict(distance_matrix)
+
+    return merges_to_labels(average_linkage_merges(vectors, distance_threshold), n)
+
+
+def hierarcy_clustering(dataList, distance_threshold: float, dense_limit: int = DENSE_LIMIT):
+    """
+    :param distance_threshold: 余弦距离（0~2）下 average linkage 的簇间平均距离阈值。
+        旧实现把 1 - 余弦相似度矩阵的每一行当作欧氏空间中的点做 ward 聚类，同一个数值截出的簇数完全不同
+        （例如阈值 0.5、1000 条记录时旧实现约为 1000 个簇，现在约为 50 个），沿用旧阈值的调用方需要重新选取阈值。
+    :return: {label: [index, ...]}
+    """
+    # 提取vectors
+    vectors = np.array([data['vector'] for data in dataList])
 
-    labels = model.fit_predict(distance_matrix)
+    # 层次聚类（余弦距离，average linkage）
+    labels = cluster_vectors(vectors, distance_threshold, dense_limit=dense_limit)
 
     # 获取所有唯一标签
     unique_labels = np.unique(labels)
@@ -35,6 +187,109 @@ def hierarcy_clustering(dataList, distance_threshold: float):
 
 
 
+class Dendrogram:
+    """
+    对一组向量只构建一次 linkage 树（余弦距离，average linkage），之后可以在任意阈值或簇数处截断，
+    每次截断为 O(n)，不需要重新聚类。
+    """
+
+    def __init__(self, vectors, dense_limit: int = DENSE_LIMIT):
+        vectors = np.asarray(vectors, dtype=np.float64)
+        self.n = len(vectors)
+        if self.n < 2:
+            self.Z = None
+        elif self.n <= dense_limit:
+            self.Z = linkage(pdist(vectors, metric="cosine"), method="average")
+        else:
+            # 大规模时与 cluster_vectors 一致：分块计算的精确 average linkage
+            self.Z = merges_to_linkage(average_linkage_merges(vectors), self.n)
+
+    def cut(self, distance_threshold: float | None = None, n_clusters: int | None = None):
+        """
+        在给定的距离阈值或目标簇数处截断，返回长度为 n 的簇标签（从 0 开始，按首次出现的顺序编号）。
+        """
+        if self.Z is None:
+            return np.zeros(self.n, dtype=int)
+        if n_clusters is not None:
+            labels = fcluster(self.Z, t=max(1, min(n_clusters, self.n)), criterion="maxclust")
+        else:
+            # AgglomerativeClustering 只合并距离严格小于阈值的簇，fcluster 的 distance 准则包含等号
+            labels = fcluster(self.Z, t=np.nextafter(distance_threshold, -np.inf), criterion="distance")
+        _, first, inverse = np.unique(labels, return_index=True, return_inverse=True)
+        order = np.argsort(np.argsort(first))
+        return order[inverse]
+
+    def cut_levels(self, distance_thresholds: list | None = None, n_clusters: list | None = None):
+        """
+        对每个阈值/簇数各截断一次，返回与 hierarcy_clustering 相同格式的 {label: [index, ...]} 列表，
+        阈值在前，簇数在后。
+        """
+        cuts = [self.cut(distance_threshold=t) for t in distance_thresholds or []]
+        cuts += [self.cut(n_clusters=k) for k in n_clusters or []]
+        return [labels_to_indices(labels) for labels in cuts]
+
+
+def labels_to_indices(labels):
+    label_indices = {}
+    for index, label in enumerate(labels):
+        label_indices.setdefault(int(label), []).append(int(index))
+    return label_indices
+
+
+# 按向量内容缓存 Dendrogram，同一组记录在不同层级/阈值上截断时不会重复构建
+_dendrogramCache = OrderedDict()
+_dendrogramLock = threading.Lock()
+DENDROGRAM_CACHE_SIZE = 32
+
+
+def get_dendrogram(vectors) -> Dendrogram:
+    vectors = np.ascontiguousarray(vectors, dtype=np.float64)
+    key = hashlib.sha1(vectors.tobytes()).hexdigest() + str(vectors.shape)
+    with _dendrogramLock:
+        dendrogram = _dendrogramCache.get(key)
+        if dendrogram is not None:
+            _dendrogramCache.move_to_end(key)
+            return dendrogram
+
+    dendrogram = Dendrogram(vectors)
+    with _dendrogramLock:
+        _dendrogramCache[key] = dendrogram
+        while len(_dendrogramCache) > DENDROGRAM_CACHE_SIZE:
+            _dendrogramCache.popitem(last=False)
+    return dendrogram
+
+
+def partition_by_locality(vectors, partition_size: int) -> list:
+    """
+    把向量划分为若干个不超过 partition_size 的分区，相近的向量尽量落在同一个分区，
+    用于 map-reduce 分组：在 Dendrogram 上截出 ceil(n / partition_size) 个簇，
+    超出 partition_size 的簇切开，再按簇的顺序依次装入分区。
+
+    :return: 每个分区包含的向量索引列表
+    """
+    n = len(vectors)
+    if n <= partition_size:
+        return [list(range(n))]
+
+    labels = get_dendrogram(np.asarray(vectors)).cut(n_clusters=-(-n // partition_size))
+    pieces = []
+    for indices in labels_to_indices(labels).values():
+        pieces.extend(indices[start:start + partition_size] for start in range(0, len(indices), partition_size))
+
+    partitions = []
+    for piece in pieces:
+        if partitions and len(partitions[-1]) + len(piece) <= partition_size:
+            partitions[-1].extend(piece)
+        else:
+            partitions.append(list(piece))
+    return partitions
+
+
+def multi_level_clustering(dataList, distance_thresholds: list | None = None, n_clusters: list | None = None):
+    """hierarcy_clustering 的多层版本：一次 linkage，多次截断"""
+    vectors = np.array([data['vector'] for data in dataList])
+    return get_dendrogram(vectors).cut_levels(distance_thresholds, n_clusters)
+
 if __name__ == "__main__":
     recordsList = {
         "data": [
@@ -0,0 +1,142 @@
+import asyncio
+import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Literal
+
+# 每个 worker 线程（进程模式下即每个子进程）各自持有一个嵌入模型，首次使用时加载。
+# EmbedModel 不是线程安全的：它的 LRU 缓存是普通的 OrderedDict，HuggingFace 的 fast tokenizer
+# 被多个线程同时使用时会抛出 "Already borrowed"。每个线程一个模型，嵌入计算可以在 worker 之间并行，
+# 代价是每个 worker 多一份模型（all-MiniLM-L6-v2 约 90MB）和各自独立的文本缓存。
+_embedLocal = threading.local()
+
+
+def _get_embed_model():
+    model = getattr(_embedLocal, "model", None)
+    if model is None:
+        import embedModule
+
+        model = _embedLocal.model = embedModule.EmbedModel()
+    return model
+
+
+def _embed_texts(texts):
+    return _get_embed_model().embeddingList(texts)
+
+
+def _embed_records(records, keyList, vector_operation_mode):
+    return _get_embed_model().embedding_batch(records, keyList, vector_operation_mode)
+
+
+def _cluster(dataList, distance_threshold):
+    import clusterGenerator
+
+    return clusterGenerator.hierarcy_clustering(dataList, distance_threshold)
+
+
+def _cluster_levels(dataList, distance_thresholds, n_clusters):
+    import clusterGenerator
+
+    return clusterGenerator.multi_level_clustering(dataList, distance_thresholds, n_clusters)
+
+
+def _partition(vectors, partition_size):
+    import clusterGenerator
+
+    return clusterGenerator.partition_by_locality(vectors, partition_size)
+
+
+def _timed_call(fn, args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return result, time.perf_counter() - start
+
+
+class ExecutorBusyError(RuntimeError):
+    pass
+
+
+class ComputeExecutor:
+    """
+    承载 CPU 密集型任务（嵌入模型前向计算、聚类）的线程池/进程池，避免它们阻塞事件循环。
+
+    - 所有接口都是可 await 的；
+    - 排队的任务数超过 max_queue 时立即抛出 ExecutorBusyError，而不是无限堆积；
+    - stats() 返回队列深度、在途任务数与 worker 利用率。
+    """
+
+    def __init__(self, mode: Literal["thread", "process"] = "thread", workers: int = 2, max_queue: int = 64):
+        self.mode = mode
+        self.workers = workers
+        self.max_queue = max_queue
+        if mode == "process":
+            self._pool = ProcessPoolExecutor(max_workers=workers)
+        else:
+            self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="compute")
+
+        self._pending = 0
+        self._completed = 0
+        self._failed = 0
+        self._rejected = 0
+        self._busy_seconds = 0.0
+        self._started_at = time.perf_counter()
+
+    async def submit(self, fn, *args):
+        if self._pending >= self.workers + self.max_queue:
+            self._rejected += 1
+            raise ExecutorBusyError(
+                f"Compute executor is busy ({self._pending} tasks pending, queue limit {self.max_queue})."
+            )
+
+        self._pending += 1
+        try:
+            result, busy = await asyncio.get_running_loop().run_in_executor(self._pool, _timed_call, fn, args)
+        except Exception:
+            self._failed += 1
+            raise
+        finally:
+            self._pending -= 1
+        self._completed += 1
+        self._busy_seconds += busy
+        return result
+
+    async def embed_texts(self, texts: list) -> list:
+        return await self.submit(_embed_texts, list(texts))
+
+    async def embed_records(self, records: list, keyList: list, vector_operation_mode=None) -> list:
+        return await self.submit(_embed_records, list(records), list(keyList), vector_operation_mode)
+
+    async def cluster(self, dataList: list, distance_threshold: float) -> dict:
+        return await self.submit(_cluster, dataList, distance_threshold)
+
+    async def cluster_levels(self, dataList: list, distance_thresholds: list | None = None, n_clusters: list | None = None) -> list:
+        return await self.submit(_cluster_levels, dataList, distance_thresholds, n_clusters)
+
+    async def partition(self, vectors: list, partition_size: int) -> list:
+        return await self.submit(_partition, vectors, partition_size)
+
+    def stats(self) -> dict:
+        uptime = time.perf_counter() - self._started_at
+        return {
+            "mode": self.mode,
+            "workers": self.workers,
+            "running": min(self._pending, self.workers),
+            "queue_depth": max(0, self._pending - self.workers),
+            "max_queue": self.max_queue,
+            "completed": self._completed,
+            "failed": self._failed,
+            "rejected": self._rejected,
+            "utilization": self._busy_seconds / (uptime * self.workers) if uptime > 0 else 0.0,
+        }
+
+    def shutdown(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def from_env() -> ComputeExecutor:
+    return ComputeExecutor(
+        mode=os.getenv("COMPUTE_EXECUTOR_MODE", "thread"),
+        workers=int(os.getenv("COMPUTE_WORKERS", "2")),
+        max_queue=int(os.getenv("COMPUTE_MAX_QUEUE", "64")),
+    )
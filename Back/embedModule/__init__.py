@@ -1,54 +1,95 @@
-from langchain_community.vectorstores import FAISS
-from langchain.schema import Document
 from langchain_huggingface import HuggingFaceEmbeddings
+import hashlib
+from collections import OrderedDict
+
 import numpy as np
 from typing import Literal, Optional
 
 class EmbedModel:
-    def __init__(self):
-        self.index = None
+    def __init__(self, cache_size: int = 50000, batch_size: int = 256):
         # 创建 Hugging Face 嵌入模型实例
         self.embeddingsModel = HuggingFaceEmbeddings(
             model_name="sentence-transformers/all-MiniLM-L6-v2"
         )
+        # 文本哈希 -> 向量 的 LRU 缓存，未变化的文本不会被重复嵌入
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.batch_size = batch_size
 
     def embedding(self, content: dict, keyList: list, vector_operation_mode: Optional[Literal["add", "minus"]] = None):
+        if len(keyList) == 1 and not content[keyList[0]]:
+            raise ValueError(f"Invalid key value - {keyList[0]}.")
+        return self.embedding_batch([content], keyList, vector_operation_mode)[0]
+
+    def embedding_batch(self, contents: list, keyList: list, vector_operation_mode: Optional[Literal["add", "minus"]] = None):
+        """
+        批量版本的 embedding：收集所有 record 所有 key 的文本，一次 embed_documents 完成，
+        再用一次向量化运算组合各 key 的向量。空文本按零向量处理。
+
+        :param contents: record 字典列表
+        :param keyList: 参与嵌入的字段
+        :param vector_operation_mode: 多个字段时向量的组合方式
+        :return: 与 contents 顺序一致的向量列表
+        """
+        if not contents:
+            return []
+        texts = [[content[key] or "" for key in keyList] for content in contents]
+        vectors = self.embed_texts([text for row in texts for text in row])
+        vectors = vectors.reshape(len(contents), len(keyList), -1)
 
         if len(keyList) == 1:
-            if not content[keyList[0]]:
-                 raise ValueError(f"Invalid key value - {key}.")
-            return np.array(self.embeddingsModel.embed_query(content[keyList[0]])).tolist()
-        
-        v_list = []
-        for key in keyList:
-            if content[key]:
-                content_v = np.array(self.embeddingsModel.embed_query(content[key]))
-            v_list.append(content_v)
-        return self.vector_operation(v_list, vector_operation_mode)
-    
+            return vectors[:, 0].tolist()
+        return self.vector_operation(vectors, vector_operation_mode).tolist()
+
     def vector_operation(self, v_list, vector_operation_mode: Literal["add", "minus"]):
-        return np.sum(v_list, axis=0).tolist() if vector_operation_mode == "add" else (v_list[0] - np.sum(v_list[1:], axis=0)).tolist()
+        """v_list 形状为 (n, key 数, 维度)，沿 key 维度组合"""
+        v_list = np.asarray(v_list)
+        return np.sum(v_list, axis=1) if vector_operation_mode == "add" else (v_list[:, 0] - np.sum(v_list[:, 1:], axis=1))
 
     def embeddingList(self, sentences: list):
-        return self.embeddingsModel.embed_documents(sentences)
-
-    # # 获取索引中所有嵌入的向量
-    # def get_all_vectors(self):
-    #     n_vectors = self.index.index.ntotal  # 获取索引中向量的总数
-    #     vectors = self.index.index.reconstruct_n(0, n_vectors)  # 获取所有嵌入向量
-    #     return vectors
+        return self.embed_texts(sentences).tolist()
 
-    # def RAG(self, query: str, k: int = 3):
-    #     # 定义查询文本
+    def embed_texts(self, texts: list) -> np.ndarray:
+        """
+        嵌入文本列表，返回 (len(texts), 维度) 的数组。
+        相同文本只计算一次，缓存未命中的文本按 batch_size 分批调用 embed_documents。
+        """
+        keys = [hashlib.sha1(text.encode("utf-8")).digest() if text else None for text in texts]
 
-    #     # 执行相似性搜索，返回最相似的前 k 个结果
-    #     results = self.index.similarity_search(query, k=k)
+        resolved = {}
+        missing = {}
+        for key, text in zip(keys, texts):
+            if key is None or key in resolved or key in missing:
+                continue
+            if key in self.cache:
+                self.cache.move_to_end(key)
+                resolved[key] = self.cache[key]
+            else:
+                missing[key] = text
+        if missing:
+            missing_keys = list(missing)
+            missing_texts = list(missing.values())
+            for start in range(0, len(missing_texts), self.batch_size):
+                batch = self.embeddingsModel.embed_documents(missing_texts[start:start + self.batch_size])
+                for key, vector in zip(missing_keys[start:start + self.batch_size], batch):
+                    resolved[key] = np.asarray(vector, dtype=np.float32)
+                    self._cache_put(key, resolved[key])
 
-    #     # 输出结果
-    #     for result in results:
-    #         print("相似文本：", result.page_content)
+        if resolved:
+            dim = next(iter(resolved.values())).shape[0]
+        else:
+            dim = len(self.embeddingsModel.embed_query(" "))
+        result = np.zeros((len(texts), dim), dtype=np.float32)
+        for i, key in enumerate(keys):
+            if key is not None:
+                result[i] = resolved[key]
+        return result
 
-    #     return results
+    def _cache_put(self, key, vector):
+        self.cache[key] = vector
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
 
 class EmbedGPTModel:
     def __init__(self, model) -> None:
@@ -1,11 +1,12 @@
 from langchain_core.prompts import PromptTemplate
 from langchain_core.output_parsers import JsonOutputParser, PydanticOutputParser
+from langchain_core.utils.json import parse_json_markdown
 
 from utils import *
 
 
 # direct
-class ExtractModelDirect:
+class ExtractModelDirect(BaseChain):
     def __init__(self, model):
         self.instruction = """
 ## System:
@@ -55,10 +56,8 @@ List: {list}
             },
         )
 
-        self.chain_direct = self.prompt_template | self.model | self.parser
-
     async def invoke(self, scenario, list):
-        return self.chain_direct.invoke({"scenario": scenario, "list": list})
+        return await self.run({"scenario": scenario, "list": list})
 
 
 # class UpdateModelDirect:
@@ -85,7 +84,7 @@ List: {list}
 
 
 # cluster-based
-class ExtractModelCluster:
+class ExtractModelCluster(BaseChain):
     def __init__(self, model):
         # self.instruction_low_intent_extraction_cn = '从用户提供的多条记录中提取一个简明的意图，将其限制在7个词以内。每条记录包括选中的文本、对应的上下文和注释。基于这些信息，提取出最能反映意图的短语。\n\n# Steps\n\n1. 阅读并理解每条记录的选中的文本、上下文和注释。\n2. 将所有记录的主要意图归纳整理。\n3. 从归纳的结果中提取出一个简明的意图，限制在不超过7个词。\n\n# Output Format\n\n生成的意图应以不超过7个词的短语形式呈现，仅输出意图文本。\n\n# Examples\n\n**记录 1**\n- 选中文本: "请在下周五前提交报告"\n- 上下文: "公司正在收集今年的年度资料..."\n- 注释: "疑问：报告的截止日期是否可以延期？"\n\n**提取的意图**\n- "询问报告延期可能性"\n\n# Notes\n\n- 确保意图清晰明了，并能充分反映记录的核心信息。\n- 对于模棱两可的信息，请根据上下文和注释中的线索进行推测。'
         # self.instruction_high_intent_extraction_cn = '从提供的多个低级意图中提炼出一个高级意图，限制在7个词以内。\n\n# Steps\n\n1. 理解和分析所有提供的低级意图。\n2. 识别这些低级意图之间的共同主题或目的。\n3. 将这些共有的主题或目的浓缩成一个高级意图。\n4. 确保高级意图不超过7个词。\n\n# Output Format\n\n  生成的意图应以不超过7个词的短语形式呈现，仅输出高级意图文本\n\n# Examples\n\n- 低级意图: ["购买书籍", "在线订购", "寻找最佳价格"]\n  - 高级意图: "在线购买书籍"\n\n- 低级意图: ["预约医生", "查找最近诊所", "拨打医生电话"]\n  - 高级意图: "安排医生预约"\n\n# Notes\n\n- 高级意图应尽可能涵盖所有提供的低级意图。\n- 语言应简练且易于理解。'
@@ -144,18 +143,21 @@ class ExtractModelCluster:
         # self.chain_high_intent = (
         #     self.prompt_template_high_intent | self.model | self.parser
         # )
-        self.chain = self.prompt_template | self.model | self.parser
 
     async def invoke(self, records):
         return (
             # self.chain_low_intent.invoke({"records": records})
             # if mode != "h"
             # else self.chain_high_intent.invoke({"records": records})
-            self.chain.invoke({"records": records})
+            await self.run({"records": records})
         )
 
 
-class Chain4Grouping:
+class Chain4Grouping(BaseChain):
+    # 记录过多时按记录拆分为多次调用（每份记录重新编号，合并时换算回原来的 id），同名分组合并
+    budget_policy = "split"
+    budget_field = "highlight"
+
     def __init__(self, model):
         self.instruction = Prompts.GROUP_INDEX
 
@@ -170,10 +172,8 @@ class Chain4Grouping:
             },
         )
 
-        self.chain = self.prompt_template | self.model | self.parser
-
     async def invoke(self, content, scenario, familiarity, specificity):
-        return self.chain.invoke(
+        return await self.run(
             {
                 "highlight": content,
                 "scenario": scenario,
@@ -182,8 +182,15 @@ class Chain4Grouping:
             }
         )
 
+    def merge_results(self, results, index_maps=None):
+        return {
+            "groups": merge_grouped_indices(
+                remap_indices(result["groups"], index_map) for result, index_map in zip(results, index_maps)
+            )
+        }
+
 
-class Chain4Construct:
+class Chain4Construct(BaseChain):
     def __init__(self, model):
         ## 对Groups中的每一组提炼一个符合Scenario语境下的意图，以字典形式返回，key为意图，value为group的索引。务必确保生成的intents维持逻辑上的差异性，没有重复或重叠。每个Intent的描述必须简短清晰，最多不超过7个词。
         ## 比较所有生成的意图与IntentsList中的意图，用IntentsList中的意图替换字典中最相似的意图，如果不够相似则不需要替换。如果IntentsList中还有未替换的Intent，则对每个剩余的Intent在字典中创建以该Intent为key，None为value的键值对。
@@ -199,15 +206,17 @@ class Chain4Construct:
             },
         )
 
-        self.chain = self.prompt_template | self.model | self.parser
-
     async def invoke(self, scenario, groups, intentsList):
-        return self.chain.invoke(
+        return await self.run(
             {"scenario": scenario, "groups": groups, "intentsList": intentsList}
         )
 
 
-class Chain4InferringGranularity:
+class Chain4InferringGranularity(BaseChain):
+    # 只需要一部分评论即可判断粒度，超出预算时丢弃末尾的评论
+    budget_policy = "truncate"
+    budget_field = "comments"
+
     def __init__(self, model):
         self.instruction = Prompts.GRANULARITY
 
@@ -220,13 +229,12 @@ class Chain4InferringGranularity:
                 "format_instructions": self.parser.get_format_instructions()
             },
         )
-        self.chain = self.prompt_template | self.model | self.parser
 
     async def invoke(self, scenario, comments):
-        return self.chain.invoke({"scenario": scenario, "comments": comments})
+        return await self.run({"scenario": scenario, "comments": comments})
 
 
-class Chain4ExtractIntent:
+class Chain4ExtractIntent(BaseChain):
     def __init__(self, model):
         self.instruction = Prompts.EXTRACT_INTENT
 
@@ -243,7 +251,6 @@ class Chain4ExtractIntent:
             ],
             template=self.instruction,
         )
-        self.chain = self.prompt_template | self.model | self.parser
 
     async def invoke(
         self, familiarity, specificity, scenario, groupsOfNodes, confirmedIntents=None
@@ -253,7 +260,7 @@ class Chain4ExtractIntent:
             if confirmedIntents is None:
                 confirmedIntents = []
 
-            result = self.chain.invoke(
+            result = await self.run(
                 {
                     "familiarity": familiarity,
                     "specificity": specificity,
@@ -306,7 +313,49 @@ class Chain4ExtractIntent:
             raise e
 
 
-class Chain4RecommendIntent:
+    async def astream_nodes(
+        self, familiarity, specificity, scenario, groupsOfNodes, confirmedIntents=None
+    ):
+        """
+        流式版本的 invoke：增量解析模型输出的 JSON 数组，每当一个 IntentNode 完整生成就立即产出。
+        数组中后一个元素开始出现时，前一个元素即视为完整。
+        """
+        if confirmedIntents is None:
+            confirmedIntents = []
+
+        text = ""
+        emitted = 0
+        async for delta in self.stream_text(
+            {
+                "familiarity": familiarity,
+                "specificity": specificity,
+                "scenario": scenario,
+                "groupsOfNodes": groupsOfNodes,
+                "confirmedIntents": confirmedIntents,
+            }
+        ):
+            text += delta
+            items = self._partial_items(text)
+            while emitted < len(items) - 1:
+                yield IntentNode.model_validate(items[emitted])
+                emitted += 1
+
+        # 输出结束，最后一个元素也已完整
+        for item in self.parser.parse(text).root[emitted:]:
+            yield item
+
+    @staticmethod
+    def _partial_items(text):
+        try:
+            parsed = parse_json_markdown(text)
+        except Exception:
+            return []
+        if isinstance(parsed, dict):
+            parsed = parsed.get("root", [])
+        return parsed if isinstance(parsed, list) else []
+
+
+class Chain4RecommendIntent(BaseChain):
     def __init__(self, model):
         self.instruction = Prompts.RECOMMEND_INTENT
 
@@ -319,11 +368,10 @@ class Chain4RecommendIntent:
                 "format_instructions": self.parser.get_format_instructions()
             },
         )
-        self.chain = self.prompt_template | self.model | self.parser
 
     async def invoke(self, user_input):
         try:
-            result = self.chain.invoke({"user_input": user_input})
+            result = await self.run({"user_input": user_input})
             return result
         except Exception as e:
             print(f"Error processing recommend intent: {str(e)}")
@@ -35,10 +35,14 @@
     ]
 }
 """
+import asyncio
 import time
-from typing import Annotated
+from typing import Annotated, Literal, get_args
 from fastapi import FastAPI, Query
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from langchain_openai import ChatOpenAI, OpenAIEmbeddings
 import os
 from utils import *
@@ -74,6 +78,15 @@ modelName = "gpt-4o"
 temperature = 0.2
 model = ChatOpenAI(model=modelName, temperature=temperature)
 
+# LLM 响应缓存：内存 LRU（按字节限制）+ 可选的 SQLite 磁盘层，所有 Chain4* 共用
+# LLM_CACHE=0 关闭；LLM_CACHE_DB 为空时只使用内存层；LLM_CACHE_TTL 单位为秒，0 表示不过期
+if os.getenv("LLM_CACHE", "1") == "1":
+    BaseChain.cache = LLMCache(
+        max_bytes=int(os.getenv("LLM_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+        ttl=float(os.getenv("LLM_CACHE_TTL", "86400")) or None,
+        db_path=os.getenv("LLM_CACHE_DB") or None,
+    )
+
 # Add CORS middleware
 app.add_middleware(
     CORSMiddleware,
@@ -83,55 +96,266 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+# 超过 GZIP_MIN_SIZE 字节的响应使用 gzip 压缩（SSE 流不会被压缩）；0 表示关闭
+if int(os.getenv("GZIP_MIN_SIZE", "1024")) > 0:
+    app.add_middleware(GZipMiddleware, minimum_size=int(os.getenv("GZIP_MIN_SIZE", "1024")))
+
+# FAST_JSON=1 时 /group/、/extract/、/recommend/、/rag/ 等返回大对象的接口使用 FastJSONResponse（orjson）序列化
+fastJSON = os.getenv("FAST_JSON", "0") == "1"
+
+def json_response(content, headers=None):
+    if fastJSON:
+        return FastJSONResponse(content, headers=headers)
+    if headers:
+        return JSONResponse(jsonable_encoder(content), headers=headers)
+    return content
+
+# 记录进入 prompt 前的压缩，会改变 prompt 内容，默认关闭（PROMPT_COMPACTION=1 时启用）：单条记录/上下文的 token 上限、重复 context 去重、可选的抽取式摘要
+promptCompactor = PromptCompactor(
+    enabled=os.getenv("PROMPT_COMPACTION", "0") == "1",
+    max_record_tokens=int(os.getenv("PROMPT_RECORD_TOKENS", "200")) or None,
+    max_context_tokens=int(os.getenv("PROMPT_CONTEXT_TOKENS", "300")) or None,
+    summarize=os.getenv("PROMPT_SUMMARIZE", "0") == "1",
+    model_name=modelName,
+)
+
+def tokens_saved_header(tokens_saved):
+    return {"X-Prompt-Tokens-Saved": str(tokens_saved)}
+
+# 合并完全相同和近似重复（MinHash 估计的 Jaccard 相似度 >= RECORD_DEDUP_THRESHOLD）的记录，prompt 中只放每个簇的代表。
+# 会改变 prompt 与分组结果（内容相近的短记录会被合并），默认关闭（RECORD_DEDUP=1 时启用）
+recordDeduplicator = RecordDeduplicator(
+    enabled=os.getenv("RECORD_DEDUP", "0") == "1",
+    threshold=float(os.getenv("RECORD_DEDUP_THRESHOLD", "0.8")),
+)
+
+def dedup_contents(contents):
+    """
+    合并 Chain4Grouping 的 contents。
+
+    :return: (代表组成的 contents, 簇列表, 节省的 token 数)；模型输出的索引用 expand_clusters 展开
+    """
+    deduped, clusters = recordDeduplicator.dedup_contents(contents)
+    if not recordDeduplicator.enabled or len(deduped) == len(contents):
+        return deduped, clusters, 0
+    return deduped, clusters, count_tokens(contents, modelName) - count_tokens(deduped, modelName)
+
+def dedup_header(records_in, records_out):
+    return {
+        "X-Dedup-Records": f"{records_out}/{records_in}",
+        "X-Dedup-Ratio": f"{records_in / records_out:.2f}" if records_out else "1.00",
+    }
+
 @app.get("/")
 async def root():
     return "Hello World!"
 
+@app.get("/prompt/stats/")
+async def prompt_stats():
+    return promptCompactor.stats()
+
+@app.get("/dedup/stats/")
+async def dedup_stats():
+    return recordDeduplicator.stats()
+
+@app.get("/tokens/stats/")
+async def token_stats():
+    """每个 chain 的 prompt/completion token 统计，以及最近的调用记录"""
+    return {"max_prompt_tokens": BaseChain.max_prompt_tokens, **BaseChain.metrics.stats()}
+
+@app.get("/cache/stats/")
+async def cache_stats():
+    """LLM 响应缓存的命中/未命中计数与容量"""
+    return BaseChain.cache.stats() if BaseChain.cache is not None else {"enabled": False}
+
 
 import embedModule
+import computeExecutor
 
-# 初始化嵌入模型
-# embedModel = embedModule.EmbedModel()
-
-# @app.post("/embed_single/", response_model=RecordwithVector)
-# async def embed_single_record(record: Record):
-#     # 对记录数据生成嵌入，并获取生成的嵌入向量
-#     vector = embedModel.embedding(
-#         record.model_dump(),
-#         ["context", "content", "comment"],
-#         vector_operation_mode="add",
-#     )
-
-#     # 返回带有向量的记录列表
-#     return RecordwithVector(
-#         id=record.id,
-#         comment=record.comment,
-#         content=record.content,
-#         context=record.context,
-#         vector=vector,
-#     )
-
-# @app.post("/embed_all/", response_model=RecordsListWithVector)
-# async def embed_all_records(recordsList: NodesList):
-#     recordsListWithVector = RecordsListWithVector(data=[])
-#     for record in recordsList.data:
-#         # 对记录数据生成嵌入，并获取生成的嵌入向量
-#         vector = embedModel.embedding(
-#             record.model_dump(),
-#             ["context", "content", "comment"],
-#             vector_operation_mode="add",
-#         )
-#         recordWithVector = RecordwithVector(
-#             id=record.id,
-#             comment=record.comment,
-#             context=record.context,
-#             content=record.content,
-#             vector=vector,
-#         )
-#         recordsListWithVector.data.append(recordWithVector)
+# 嵌入模型与聚类运行在独立的线程池/进程池中，不占用事件循环
+# COMPUTE_EXECUTOR_MODE=thread|process, COMPUTE_WORKERS, COMPUTE_MAX_QUEUE
+executor = computeExecutor.from_env()
+
+@app.on_event("shutdown")
+async def shutdown_executor():
+    executor.shutdown()
+
+import vectorIndex
+
+# 每个 scenario 的记录/意图向量索引，随请求增量更新；设置 VECTOR_INDEX_DIR 时快照保存在磁盘上，重启后以内存映射方式恢复
+vectorIndexes = vectorIndex.VectorIndexStore(
+    directory=os.getenv("VECTOR_INDEX_DIR") or None,
+    max_indexes=int(os.getenv("VECTOR_INDEX_MAX", "256")),
+)
+
+@app.on_event("shutdown")
+async def snapshot_vector_indexes():
+    vectorIndexes.snapshot()
+
+# 向量索引的种类：记录以记录 id 为键，意图以意图节点 id 为键
+IndexKind = Literal["record", "intent"]
 
-#     # 返回带有向量的记录列表
-#     return recordsListWithVector
+async def indexed_vectors(scenario, kind, items):
+    """
+    返回 [(key, text)] 对应的单位向量：只嵌入 scenario 索引中没有（或文本已变化）的条目，并把它们加入索引。
+    """
+    index = vectorIndexes.get(scenario, kind)
+    missing = index.missing(items)
+    if missing:
+        index.add(missing, await executor.embed_texts([text for _, text in missing]))
+    return index.vectors([key for key, _ in items])
+
+def intent_text(intent):
+    return f"{intent['intent']} - {intent['description']}"
+
+@app.get("/index/stats/")
+async def vector_index_stats():
+    return vectorIndexes.stats()
+
+@app.post("/index/{scenario}/")
+async def add_to_vector_index(scenario: str, request: dict):
+    """
+    把记录（records）和意图（intents: [{"id", "intent", "description"}]）加入 scenario 的向量索引，
+    已入库且文本未变化的条目不会被重新嵌入。
+    """
+    try:
+        records = [(record["id"], record.get("content") or "") for record in request.get("records", [])]
+        intents = [(intent["id"], intent_text(intent)) for intent in request.get("intents", [])]
+        added = {}
+        for kind, items in (("record", records), ("intent", intents)):
+            added[kind] = len(vectorIndexes.get(scenario, kind).missing(items))
+            if items:
+                await indexed_vectors(scenario, kind, items)
+        return {"added": added, "size": {kind: len(vectorIndexes.get(scenario, kind)) for kind in added}}
+    except computeExecutor.ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Error updating vector index: {str(e)}")
+
+@app.post("/index/{scenario}/remove/")
+async def remove_from_vector_index(scenario: str, request: dict):
+    """从 scenario 的向量索引中删除 keys（记录 id 或意图 id）；索引不存在时不会新建"""
+    kind = request.get("kind", "record")
+    if kind not in get_args(IndexKind):
+        raise HTTPException(status_code=422, detail=f"kind must be one of {list(get_args(IndexKind))}.")
+    index = vectorIndexes.find(scenario, kind)
+    if index is None:
+        return {"kind": kind, "size": 0}
+    index.remove(request.get("keys", []))
+    return {"kind": kind, "size": len(index)}
+
+@app.get("/index/{scenario}/search/")
+async def search_vector_index(scenario: str, query: str, kind: IndexKind = "record", k: int = 5):
+    """k 近邻检索：返回与 query 最相近的记录 id（或意图 id）及余弦相似度"""
+    index = vectorIndexes.find(scenario, kind)
+    if index is None:
+        return {"results": []}
+    try:
+        [vector] = await executor.embed_texts([query])
+    except computeExecutor.ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    [hits] = index.search([vector], k)
+    return {"results": [{"key": key, "score": score} for key, score in hits]}
+
+@app.post("/index/{scenario}/snapshot/")
+async def snapshot_vector_index(scenario: str):
+    """把 scenario 的向量索引写入 VECTOR_INDEX_DIR"""
+    if not vectorIndexes.directory:
+        raise HTTPException(status_code=422, detail="VECTOR_INDEX_DIR is not configured.")
+    return {"scenario": scenario, "snapshots": vectorIndexes.snapshot(scenario)}
+
+@app.delete("/index/{scenario}")
+async def delete_vector_index(scenario: str):
+    vectorIndexes.delete(scenario)
+    return {"scenario": scenario, "deleted": True}
+
+@app.get("/executor/stats/")
+async def executor_stats():
+    """计算线程池/进程池的队列深度与利用率"""
+    return executor.stats()
+
+@app.post("/embed_single/", response_model=RecordwithVector)
+async def embed_single_record(record: Record, scenario: str | None = None):
+    try:
+        # 对记录数据生成嵌入，并获取生成的嵌入向量
+        [vector] = await executor.embed_records(
+            [record.model_dump()],
+            ["context", "content", "comment"],
+            vector_operation_mode="add",
+        )
+        if scenario is not None:
+            # 同时把记录正文加入 scenario 的向量索引
+            await indexed_vectors(scenario, "record", [(record.id, record.content)])
+    except computeExecutor.ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    # 返回带有向量的记录列表
+    return RecordwithVector(
+        id=record.id,
+        comment=record.comment,
+        content=record.content,
+        context=record.context,
+        vector=vector,
+    )
+
+@app.post("/embed_all/", response_model=RecordsListWithVector)
+async def embed_all_records(recordsList: NodesList, scenario: str | None = None):
+    try:
+        # 所有记录一次批量嵌入
+        vectors = await executor.embed_records(
+            [record.model_dump() for record in recordsList.data],
+            ["context", "content", "comment"],
+            vector_operation_mode="add",
+        )
+        if scenario is not None:
+            await indexed_vectors(scenario, "record", [(record.id, record.content) for record in recordsList.data])
+    except computeExecutor.ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    recordsListWithVector = RecordsListWithVector(data=[])
+    for record, vector in zip(recordsList.data, vectors):
+        recordWithVector = RecordwithVector(
+            id=record.id,
+            comment=record.comment,
+            context=record.context,
+            content=record.content,
+            vector=vector,
+        )
+        recordsListWithVector.data.append(recordWithVector)
+
+    # 返回带有向量的记录列表
+    return recordsListWithVector
+
+
+@app.post("/cluster/levels/")
+async def cluster_levels(
+    recordsList: RecordsListWithVector,
+    distance_thresholds: Annotated[list[float] | None, Query()] = None,
+    n_clusters: Annotated[list[int] | None, Query()] = None,
+):
+    """
+    对同一组带向量的记录只构建一次层次聚类树，并在每个 distance_threshold / n_clusters 处截断。
+    返回的每一层都是 {簇标签: [记录索引]}，阈值在前，簇数在后。
+    """
+    if not distance_thresholds and not n_clusters:
+        raise HTTPException(status_code=422, detail="Provide at least one distance_threshold or n_clusters.")
+    try:
+        levels = await executor.cluster_levels(
+            [{"vector": record.vector} for record in recordsList.data],
+            distance_thresholds,
+            n_clusters,
+        )
+    except computeExecutor.ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    return {
+        "levels": [
+            {"distance_threshold": t, "groups": groups}
+            for t, groups in zip(distance_thresholds or [], levels)
+        ] + [
+            {"n_clusters": k, "groups": groups}
+            for k, groups in zip(n_clusters or [], levels[len(distance_thresholds or []):])
+        ]
+    }
 
 
 # import clusterGenerator
@@ -267,6 +491,27 @@ import extractModule
 #     return output
 
 chain4Granularity = extractModule.Chain4InferringGranularity(model)
+# 服务端的粒度推断备忘录，键为 scenario + comments 集合（与顺序无关），/granularity/ 与 /group/ 共用
+granularityMemo = LLMCache(max_bytes=1024 * 1024, ttl=float(os.getenv("GRANULARITY_MEMO_TTL", "3600")) or None)
+
+async def resolve_granularity(scenario, comments, familiarity=None, specificity=None, infer=True):
+    """
+    返回 scenario 与 comments 对应的 GranularityOutput。
+    优先使用调用方传入的结果，其次查找备忘录，都没有时才调用 LLM 推断并写入备忘录（infer=False 时返回 None）。
+    """
+    if familiarity and specificity:
+        return GranularityOutput(familiarity=familiarity, specificity=specificity)
+
+    key = LLMCache.make_key("granularity", scenario, sorted(comment or "" for comment in comments))
+    cached = granularityMemo.get(key)
+    if cached is not None:
+        return GranularityOutput.model_validate_json(cached)
+    if not infer:
+        return None
+
+    granularity_result = await chain4Granularity.invoke(scenario=scenario, comments=comments)
+    granularityMemo.set(key, granularity_result.model_dump_json())
+    return granularity_result
 
 @app.post("/granularity/")
 async def infer_granularity(scenario: str, nodesList:NodesList):
@@ -282,7 +527,7 @@ async def infer_granularity(scenario: str, nodesList:NodesList):
         
         # Step 1, Infer the Granularity
         start_time = time.time()
-        granularity_result = await chain4Granularity.invoke(scenario=scenario, comments=comments)
+        granularity_result = await resolve_granularity(scenario, comments)
         print(f"Finished inferring granularity, spent {time.time() - start_time:.2f} seconds.")
         return granularity_result
     except Exception as e:
@@ -290,23 +535,232 @@ async def infer_granularity(scenario: str, nodesList:NodesList):
 
 
 chain4Grouping = extractModule.Chain4Grouping(model)
+# 第二层分组的最大并发 LLM 请求数
+groupingConcurrency = int(os.getenv("GROUPING_CONCURRENCY", "8"))
+
+# 去重后进入 prompt 的记录数超过 GROUP_MAP_REDUCE_THRESHOLD 时，一级分组改为 map-reduce：每个分区最多 GROUP_PARTITION_SIZE 条记录
+# （按去重后的条数判断，因为决定 prompt 大小的是它；RECORD_DEDUP=0 时与输入记录数相同）
+GROUP_MAP_REDUCE_THRESHOLD = int(os.getenv("GROUP_MAP_REDUCE_THRESHOLD", "120"))
+GROUP_PARTITION_SIZE = int(os.getenv("GROUP_PARTITION_SIZE", "60"))
+
+async def partition_records(scenario, items, partition_size=GROUP_PARTITION_SIZE):
+    """按嵌入相近程度把记录 [(id, content)] 分区；计算资源繁忙时退回到按顺序切分"""
+    try:
+        vectors = await indexed_vectors(scenario, "record", items)
+        return await executor.partition(vectors, partition_size)
+    except computeExecutor.ExecutorBusyError as e:
+        print(f"Skip embedding-based partition: {str(e)}")
+        return [list(range(start, min(start + partition_size, len(items)))) for start in range(0, len(items), partition_size)]
+
+async def map_reduce_grouping(scenario, contents, partitions, familiarity, specificity):
+    """
+    map：各分区并发调用 Chain4Grouping（分区内使用局部 id）；
+    reduce：把所有分区得到的组名交给 Chain4Grouping 再分组，合并跨分区的相似组。
+    返回与 Chain4Grouping 相同格式的 {"groups": {组名: [contents 中的索引]}}。
+    """
+    results = await gather_with_concurrency(
+        groupingConcurrency,
+        *[
+            chain4Grouping.invoke(
+                scenario=scenario,
+                content=[{"id": idx, "content": contents[i]["content"]} for idx, i in enumerate(partition)],
+                familiarity=familiarity,
+                specificity=specificity,
+            )
+            for partition in partitions
+        ]
+    )
+
+    # 各分区的组，索引换算回全局（忽略 LLM 返回的越界 id）
+    partial_groups = []
+    for partition, result in zip(partitions, results):
+        for label, indices in result["groups"].items():
+            members = [partition[i] for i in indices if 0 <= i < len(partition)]
+            if members:
+                partial_groups.append((label, members))
+    print(f"Map step: {len(partitions)} partitions, {len(partial_groups)} groups.")
+    if len(partitions) == 1:
+        return {"groups": {label: members for label, members in partial_groups}}
+
+    reduced = await chain4Grouping.invoke(
+        scenario=scenario,
+        content=[{"id": idx, "content": label} for idx, (label, _) in enumerate(partial_groups)],
+        familiarity=familiarity,
+        specificity=specificity,
+    )
+    groups = {}
+    merged = set()
+    for label, indices in reduced["groups"].items():
+        members = []
+        for i in indices:
+            if 0 <= i < len(partial_groups) and i not in merged:
+                merged.add(i)
+                members.extend(partial_groups[i][1])
+        if members:
+            groups.setdefault(label, []).extend(members)
+    # reduce 步骤遗漏的组原样保留
+    for i, (label, members) in enumerate(partial_groups):
+        if i not in merged:
+            groups.setdefault(label, []).extend(members)
+    return {"groups": groups}
+
+def build_groups_of_nodes(store, first_level_groups, second_level_groups):
+    """
+    组装 /group/ 返回的 groupsOfNodes。
+
+    :param store: 记录所在的 RecordStore
+    :param first_level_groups: 一级分组，每组为记录 id 列表
+    :param second_level_groups: {一级分组下标: [二级分组的记录 id 列表]}，只包含被再次分组的一级分组
+    """
+    groupsOfNodes = []
+    for index, group in enumerate(first_level_groups):
+        groupsOfNodes.append({
+            "records": store.expand(group),
+            "intent_id": index + 1,
+            "intent_name": "____",
+            "intent_description": "____",
+            "level": "1",
+            "parent": None
+        })
+
+    for index, keys in enumerate(second_level_groups.keys()):
+        groupsOfNodes.append({
+            "records": store.expand(second_level_groups[keys]),
+            "intent_id": len(first_level_groups) + index + 1,
+            "intent_name": "____",
+            "intent_description": "____",
+            "level": "2",
+            "parent": keys + 1  # keys are 0-indexes
+        })
+    return groupsOfNodes
+
+# mode=local 时由 familiarity/specificity 推导两级聚类的余弦距离阈值：越熟悉、越具体，分组越细
+FAMILIARITY_LEVELS = {"very unfamiliar": -2, "unfamiliar": -1, "neutral": 0, "familiar": 1, "very familiar": 2}
+SPECIFICITY_LEVELS = {"very general": -2, "general": -1, "moderate": 0, "specific": 1, "very specific": 2}
+LOCAL_GROUP_THRESHOLD = float(os.getenv("LOCAL_GROUP_THRESHOLD", "0.75"))
+LOCAL_GROUP_STEP = float(os.getenv("LOCAL_GROUP_STEP", "0.05"))
+LOCAL_GROUP_SECOND_RATIO = float(os.getenv("LOCAL_GROUP_SECOND_RATIO", "0.6"))
+
+def local_grouping_thresholds(familiarity, specificity):
+    """返回 (一级阈值, 二级阈值)"""
+    shift = FAMILIARITY_LEVELS.get(familiarity, 0) + SPECIFICITY_LEVELS.get(specificity, 0)
+    first = min(1.5, max(0.05, LOCAL_GROUP_THRESHOLD - LOCAL_GROUP_STEP * shift))
+    # 二级阈值不大于一级阈值，两级截断才是嵌套的
+    return first, min(first, first * LOCAL_GROUP_SECOND_RATIO)
+
+# 后台 refine 任务，保留引用避免被回收
+backgroundTasks = set()
+
+async def refine_grouping(nodesList, scenario, familiarity, specificity):
+    """在后台走一遍 LLM 分组，写入粒度备忘录和 LLM 缓存；之后同样输入的 LLM 模式请求直接命中缓存"""
+    try:
+        await group_nodes(nodesList, scenario, familiarity, specificity)
+        print(f"Finished background refine for scenario: {scenario}")
+    except Exception as e:
+        print(f"Background refine failed: {str(e)}")
+
+async def local_group_nodes(nodesList: NodesList, scenario: str, familiarity: str | None = None, specificity: str | None = None, refine: bool = False):
+    """
+    mode=local：用嵌入向量与层次聚类在本地构建两级 groupsOfNodes，不调用 LLM，返回格式与 LLM 模式相同。
+    粒度优先使用传入值或备忘录中的推断结果，都没有时使用 neutral/moderate。
+    """
+    start_time = time.time()
+    comments = [node.comment for node in nodesList.data]
+    granularity_result = await resolve_granularity(scenario, comments, familiarity, specificity, infer=False)
+    if granularity_result is None:
+        granularity_result = GranularityOutput(familiarity="neutral", specificity="moderate")
+    first_threshold, second_threshold = local_grouping_thresholds(granularity_result.familiarity, granularity_result.specificity)
+
+    store = RecordStore()
+    root = [store.add(node) for node in nodesList.data]
+    if len(root) > 1:
+        vectors = await indexed_vectors(scenario, "record", [(record_id, store.get(record_id).content) for record_id in root])
+        # 一次构建层次树，分别在两个阈值处截断
+        first_level, second_level = await executor.cluster_levels([{"vector": vector} for vector in vectors], [first_threshold, second_threshold])
+    else:
+        first_level, second_level = {0: list(range(len(root)))}, {0: list(range(len(root)))}
+
+    first_level_groups = [[root[i] for i in indices] for indices in first_level.values()]
+    position = {i: index for index, indices in enumerate(first_level.values()) for i in indices}
+    second_level_groups = {}
+    for indices in second_level.values():
+        # 两个阈值截断的是同一棵树，二级阈值更小，每个二级簇都完整地落在一个一级分组内
+        second_level_groups.setdefault(position[indices[0]], []).append([root[i] for i in indices])
+    # 与 LLM 模式一致，只有多于一条记录的一级分组才有二级分组
+    second_level_groups = {
+        index: second_level_groups[index]
+        for index in sorted(second_level_groups)
+        if len(first_level_groups[index]) > 1
+    }
+
+    groupsOfNodes = build_groups_of_nodes(store, first_level_groups, second_level_groups)
+    print(f"Finished local grouping (thresholds {first_threshold:.2f}/{second_threshold:.2f}), spent {time.time() - start_time:.2f} seconds.")
+
+    if refine:
+        task = asyncio.create_task(refine_grouping(nodesList, scenario, familiarity, specificity))
+        backgroundTasks.add(task)
+        task.add_done_callback(backgroundTasks.discard)
+
+    return json_response({"groupsOfNodes": groupsOfNodes, "granularity": granularity_result}, headers={"X-Grouping-Mode": "local"})
 
 @app.post("/group/")
-async def group_nodes(nodesList: NodesList, scenario: str):
-    """对nodes进行分组"""
+async def group_nodes(
+    nodesList: NodesList,
+    scenario: str,
+    familiarity: str | None = None,
+    specificity: str | None = None,
+    map_reduce: bool | None = None,
+    mode: Literal["llm", "local"] = "llm",
+    refine: bool = False,
+):
+    """
+    对nodes进行分组
+
+    familiarity/specificity 可传入 /granularity/ 已经返回的结果；未传入时先查找服务端备忘录，
+    仍未命中才重新推断；使用 map-reduce 时与嵌入分区同时进行。
+    map_reduce 未指定时，去重后的记录数超过 GROUP_MAP_REDUCE_THRESHOLD 才使用 map-reduce 分组。
+    mode=local 时只用嵌入与层次聚类分组（毫秒级，结果近似）；refine=true 时再在后台运行 LLM 分组以预热缓存。
+    记录按 id 保存，nodesList 中 id 重复时返回 422。
+    """
+    seen, duplicates = set(), set()
+    for node in nodesList.data:
+        (duplicates if node.id in seen else seen).add(node.id)
+    if duplicates:
+        raise HTTPException(status_code=422, detail=f"Duplicate record ids in nodesList: {sorted(duplicates)}")
+    if mode == "local":
+        try:
+            return await local_group_nodes(nodesList, scenario, familiarity, specificity, refine)
+        except computeExecutor.ExecutorBusyError as e:
+            raise HTTPException(status_code=503, detail=str(e))
+        except Exception as e:
+            raise HTTPException(status_code=422, detail=f"Error processing nodes: {str(e)}")
     try:
-        # 转换输入数据
-        root = [node.model_dump() for node in nodesList.data]
+        # 转换输入数据：记录只在 RecordStore 中保存一份，分组中只引用记录 id，返回前再展开
+        store = RecordStore()
+        root = [store.add(node) for node in nodesList.data]
 
         # Unpack the payload
-        contents = [{"id": idx, "content": item["content"]} for idx, item in enumerate(root)]
-        comments = [i["comment"] for i in root]
-        contexts = [i["context"] for i in root]
-        assert len(contents) == len(comments) == len(contexts), "Contents, comments, and contexts must have the same length."
-        
+        comments = [node.comment for node in nodesList.data]
+        contents = [{"id": idx, "content": store.get(record_id).content} for idx, record_id in enumerate(root)]
+        # 重复的记录只把代表放进 prompt，分组结果再展开回 root 中的所有成员
+        contents, clusters, tokens_saved = dedup_contents(contents)
+        # prompt 中只放压缩后的内容，id 不变
+        contents, compaction_tokens_saved = promptCompactor.compact_contents(contents)
+        tokens_saved += compaction_tokens_saved
+        contexts = [store.get(record_id).context for record_id in root]
+        assert len(root) == len(comments) == len(contexts), "Contents, comments, and contexts must have the same length."
+
         # Step 1, Infer the Granularity
         start_time = time.time()
-        granularity_result = await chain4Granularity.invoke(scenario=scenario, comments=comments)
+        use_map_reduce = map_reduce if map_reduce is not None else len(contents) > GROUP_MAP_REDUCE_THRESHOLD
+        if use_map_reduce:
+            # map-reduce 模式下的嵌入分区不依赖粒度，与粒度推断同时进行
+            granularity_result, partitions = await asyncio.gather(
+                resolve_granularity(scenario, comments, familiarity, specificity),
+                partition_records(scenario, [(root[cluster[0]], store.get(root[cluster[0]]).content) for cluster in clusters]),
+            )
+        else:
+            granularity_result = await resolve_granularity(scenario, comments, familiarity, specificity)
         print("granularity_result", granularity_result)
         print(f"Finished inferring granularity, spent {time.time() - start_time:.2f} seconds.")
         
@@ -314,55 +768,67 @@ async def group_nodes(nodesList: NodesList, scenario: str):
         start_time = time.time()
 
         # 2.1 Group once
-        grouped = await chain4Grouping.invoke(scenario=scenario, content=contents, familiarity=granularity_result.familiarity, specificity=granularity_result.specificity)
+        if use_map_reduce:
+            grouped = await map_reduce_grouping(scenario, contents, partitions, granularity_result.familiarity, granularity_result.specificity)
+        else:
+            grouped = await chain4Grouping.invoke(scenario=scenario, content=contents, familiarity=granularity_result.familiarity, specificity=granularity_result.specificity)
         print("grouped", grouped)
         # 将grouped中每个列表中的index替换成root对应的真实数据
         grouped_with_data = {}
         for group_key, indices in grouped['groups'].items():
-            grouped_with_data[group_key] = [root[idx] for idx in indices]
+            grouped_with_data[group_key] = [root[idx] for idx in expand_clusters(indices, clusters)]
         grouped['groups'] = grouped_with_data
 
         first_level_groups = list(grouped['groups'].values())
         second_level_groups = {}
-        # 2.2 Group again
-        for index, group in enumerate(first_level_groups):
-            if len(group) > 1:
-                contents = [{"id": idx, "content": item["content"]} for idx, item in enumerate(group)]
-                second_level_groups[index] = await chain4Grouping.invoke(scenario=scenario, content=contents, familiarity=granularity_result.familiarity, specificity=granularity_result.specificity)
-                grouped_with_data = {}
-                print("second_level_groups", second_level_groups)
-                for group_key, indices in second_level_groups[index]['groups'].items():
-                    grouped_with_data[group_key] = [group[idx] for idx in indices]
-                second_level_groups[index]['groups'] = grouped_with_data
+        # 2.2 Group again，各组之间互不依赖，并发调用（最多 groupingConcurrency 个同时在途）
+        multi_record_indices = [index for index, group in enumerate(first_level_groups) if len(group) > 1]
+        second_level_contents, second_level_clusters = [], []
+        for index in multi_record_indices:
+            group_contents, group_clusters, group_tokens_saved = dedup_contents(
+                [{"id": idx, "content": store.get(record_id).content} for idx, record_id in enumerate(first_level_groups[index])]
+            )
+            tokens_saved += group_tokens_saved
+            group_contents, group_tokens_saved = promptCompactor.compact_contents(group_contents)
+            second_level_contents.append(group_contents)
+            second_level_clusters.append(group_clusters)
+            tokens_saved += group_tokens_saved
+        second_level_results = await gather_with_concurrency(
+            groupingConcurrency,
+            *[
+                chain4Grouping.invoke(
+                    scenario=scenario,
+                    content=group_contents,
+                    familiarity=granularity_result.familiarity,
+                    specificity=granularity_result.specificity,
+                )
+                for group_contents in second_level_contents
+            ]
+        )
+        # 按 first_level_groups 的顺序回填，保证 intent_id 编号与串行时一致
+        for index, group_clusters, result in zip(multi_record_indices, second_level_clusters, second_level_results):
+            group = first_level_groups[index]
+            second_level_groups[index] = result
+            grouped_with_data = {}
+            print("second_level_groups", second_level_groups)
+            for group_key, indices in second_level_groups[index]['groups'].items():
+                grouped_with_data[group_key] = [group[idx] for idx in expand_clusters(indices, group_clusters)]
+            second_level_groups[index]['groups'] = grouped_with_data
 
         
-        groupsOfNodes = []
-        for index, group in enumerate(first_level_groups):
-            groupsOfNodes.append({
-                "records": group,
-                "intent_id": index + 1,
-                "intent_name": "____",
-                "intent_description": "____",
-                "level": "1",
-                "parent": None
-            })
-
-        for index, keys in enumerate(second_level_groups.keys()):
-            group = list(second_level_groups[keys]['groups'].values())
-            
-            groupsOfNodes.append({
-                "records": group,
-                "intent_id": len(first_level_groups) + index + 1,
-                "intent_name": "____",
-                "intent_description": "____",
-                "level": "2",
-                "parent": keys + 1  # keys are 0-indexes
-            })
+        groupsOfNodes = build_groups_of_nodes(
+            store,
+            first_level_groups,
+            {index: list(result['groups'].values()) for index, result in second_level_groups.items()},
+        )
 
-        
         print(f"Finished grouping and constructing tree, spent {time.time() - start_time:.2f} seconds.")
+        print(f"Deduplication kept {len(clusters)}/{len(root)} records; prompt compaction saved {tokens_saved} tokens.")
 
-        return {"groupsOfNodes": groupsOfNodes, "granularity": granularity_result}
+        return json_response(
+            {"groupsOfNodes": groupsOfNodes, "granularity": granularity_result},
+            headers={**tokens_saved_header(tokens_saved), **dedup_header(len(root), len(clusters))},
+        )
 
 
     except Exception as e:
@@ -372,6 +838,306 @@ chain4ExtractIntent = extractModule.Chain4ExtractIntent(model)
 
 chain4RecommendIntent = extractModule.Chain4RecommendIntent(model)
 
+import sessionStore
+
+# 服务端保存的意图树：客户端只需发送 session_id 与增量，服务端返回节点级的增量
+sessions = sessionStore.SessionStore(
+    max_sessions=int(os.getenv("SESSION_MAX", "256")),
+    ttl=float(os.getenv("SESSION_TTL", str(24 * 3600))) or None,
+)
+
+def get_session(session_id):
+    try:
+        return sessions.get(session_id)
+    except sessionStore.SessionNotFoundError:
+        raise HTTPException(status_code=404, detail=f"Session not found: {session_id}")
+
+def session_delta(session, before):
+    """before 为修改前的 session.snapshot()，返回 {"session_id", "version", "upserted", "removed"}"""
+    return {
+        "session_id": session.session_id,
+        "version": session.version,
+        **sessionStore.diff_snapshots(before, session.snapshot()),
+    }
+
+@app.put("/session/{session_id}")
+async def create_session(session_id: str, request: dict):
+    """
+    创建（或覆盖）一个会话。
+
+    :param scenario: 场景
+    :param intentTree: 可选，已有的意图树（/extract/ 的返回格式）
+    :param records: 可选，记录列表
+    """
+    try:
+        session = sessions.create(session_id, request.get("scenario", session_id), request.get("intentTree"), request.get("records"))
+        return {"session_id": session_id, "version": session.version, "records": len(session.records)}
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Error creating session: {str(e)}")
+
+@app.get("/session/{session_id}")
+async def read_session(session_id: str):
+    """返回会话中完整的意图树（group 中为完整记录），用于客户端全量同步"""
+    session = get_session(session_id)
+    return json_response({"session_id": session_id, "version": session.version, "intentTree": session.expanded_tree()})
+
+@app.patch("/session/{session_id}")
+async def update_session(session_id: str, delta: dict):
+    """
+    应用客户端增量（records / removed_records / flags / renames），返回变化的节点。
+    """
+    session = get_session(session_id)
+    try:
+        before = session.snapshot()
+        # 记录向量索引按 scenario 共享，其他会话可能仍在使用这些记录，因此 removed_records 不从索引中删除
+        session.apply_delta(delta)
+        return session_delta(session, before)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Error updating session: {str(e)}")
+
+@app.delete("/session/{session_id}")
+async def delete_session(session_id: str):
+    sessions.delete(session_id)
+    return {"session_id": session_id, "deleted": True}
+
+@app.get("/session/")
+async def session_stats():
+    return sessions.stats()
+
+# 增量分组：新记录按与已有分组质心的余弦相似度直接归组，只在以下情况才调用 LLM：
+# - 与所有一级分组的相似度都低于 INCREMENTAL_ASSIGN_THRESHOLD 的记录（一起交给 Chain4Grouping 组成新的一级分组）；
+# - 加入新记录后大小跨过 INCREMENTAL_SPLIT_SIZE 整数倍的一级分组（只对该组重新做二级分组）。
+INCREMENTAL_ASSIGN_THRESHOLD = float(os.getenv("INCREMENTAL_ASSIGN_THRESHOLD", "0.35"))
+INCREMENTAL_SECOND_THRESHOLD = float(os.getenv("INCREMENTAL_SECOND_THRESHOLD", "0.5"))
+INCREMENTAL_SPLIT_SIZE = int(os.getenv("INCREMENTAL_SPLIT_SIZE", "30"))
+# 按 scenario / session 缓存记录向量与分组质心，已有记录不会被重新嵌入
+centroidCache = CentroidCache(max_entries=int(os.getenv("CENTROID_CACHE_MAX", "64")))
+
+async def embed_missing(centroids, store, record_ids, scenario):
+    """把 centroids 中还没有的记录向量（从 scenario 的向量索引中取，索引中也没有时才嵌入）加入 centroids，返回加入的记录数"""
+    missing = centroids.missing([(record_id, store.get(record_id).content) for record_id in dict.fromkeys(record_ids)])
+    if missing:
+        centroids.add_vectors(missing, await indexed_vectors(scenario, "record", missing))
+    return len(missing)
+
+def parse_groups_of_nodes(store, groupsOfNodes):
+    """build_groups_of_nodes 的逆过程，返回 (一级分组, {一级分组下标: [二级分组]})，分组均为记录 id 列表"""
+    first_level_groups, second_level_groups, position = [], {}, {}
+    for group in groupsOfNodes:
+        if str(group.get("level", "1")) == "1":
+            position[group.get("intent_id")] = len(first_level_groups)
+            first_level_groups.append(store.ref(flatten_records(group.get("records", []))))
+    for group in groupsOfNodes:
+        if str(group.get("level")) == "2" and group.get("parent") in position:
+            second_level_groups[position[group["parent"]]] = [
+                store.ref(flatten_records(records if isinstance(records, list) else [records]))
+                for records in group.get("records", [])
+            ]
+    return first_level_groups, second_level_groups
+
+async def regroup_second_level(scenario, store, group, granularity_result):
+    """对一个一级分组重新调用 Chain4Grouping，返回二级分组（记录 id 列表）与节省的 token 数"""
+    contents, clusters, tokens_saved = dedup_contents(
+        [{"id": idx, "content": store.get(record_id).content} for idx, record_id in enumerate(group)]
+    )
+    contents, compaction_tokens_saved = promptCompactor.compact_contents(contents)
+    tokens_saved += compaction_tokens_saved
+    result = await chain4Grouping.invoke(
+        scenario=scenario,
+        content=contents,
+        familiarity=granularity_result.familiarity,
+        specificity=granularity_result.specificity,
+    )
+    subgroups = [[group[idx] for idx in expand_clusters(indices, clusters)] for indices in result["groups"].values()]
+    return [subgroup for subgroup in subgroups if subgroup], tokens_saved
+
+async def group_incrementally(scenario, store, groupsOfNodes, new_ids, familiarity, specificity):
+    start_time = time.time()
+    first_level_groups, second_level_groups = parse_groups_of_nodes(store, groupsOfNodes)
+    # 已经在分组中的记录不再重复加入
+    existing = {record_id for group in first_level_groups for record_id in group}
+    new_ids = [record_id for record_id in dict.fromkeys(new_ids) if record_id not in existing]
+    centroids = centroidCache.get(("scenario", scenario))
+    embedded = await embed_missing(centroids, store, [record_id for group in first_level_groups for record_id in group] + new_ids, scenario)
+
+    # 1. 逐条归入最相近的一级分组，再归入其下最相近的二级分组（不够相近时单独成为新的二级分组）
+    assigned, unassigned, grown = [], [], {}
+    for record_id in new_ids:
+        index, similarity = centroids.nearest(record_id, [(("1", i), group) for i, group in enumerate(first_level_groups)])
+        if index is None or similarity < INCREMENTAL_ASSIGN_THRESHOLD:
+            unassigned.append(record_id)
+            continue
+        group = first_level_groups[index]
+        # 原先只有一条记录的一级分组没有二级分组
+        subgroups = second_level_groups.setdefault(index, [list(group)])
+        sub_index, sub_similarity = centroids.nearest(record_id, [(("2", index, j), subgroup) for j, subgroup in enumerate(subgroups)])
+        if sub_index is None or sub_similarity < INCREMENTAL_SECOND_THRESHOLD:
+            subgroups.append([record_id])
+        else:
+            subgroups[sub_index].append(record_id)
+        grown.setdefault(index, len(group))
+        group.append(record_id)
+        assigned.append({"id": record_id, "intent_id": index + 1, "similarity": round(similarity, 4)})
+
+    # 2. 只有需要调用 LLM 时才推断粒度
+    # 分组大小每跨过一个 INCREMENTAL_SPLIT_SIZE 的整数倍才重新分组一次，避免大组每次加入记录都调用 LLM
+    oversized = sorted(
+        index for index, size in grown.items()
+        if len(first_level_groups[index]) // INCREMENTAL_SPLIT_SIZE > size // INCREMENTAL_SPLIT_SIZE
+    )
+    comments = [store.get(record_id).comment for record_id in store]
+    granularity_result = await resolve_granularity(scenario, comments, familiarity, specificity, infer=len(unassigned) > 1 or bool(oversized))
+
+    llm_calls, tokens_saved = 0, 0
+    # 2.1 不属于任何已有分组的记录组成新的一级分组
+    if len(unassigned) > 1:
+        contents, clusters, tokens_saved = dedup_contents(
+            [{"id": idx, "content": store.get(record_id).content} for idx, record_id in enumerate(unassigned)]
+        )
+        contents, compaction_tokens_saved = promptCompactor.compact_contents(contents)
+        tokens_saved += compaction_tokens_saved
+        grouped = await chain4Grouping.invoke(
+            scenario=scenario,
+            content=contents,
+            familiarity=granularity_result.familiarity,
+            specificity=granularity_result.specificity,
+        )
+        llm_calls += 1
+        new_groups = [[unassigned[idx] for idx in expand_clusters(indices, clusters)] for indices in grouped["groups"].values()]
+        # LLM 遗漏的记录各自成组
+        covered = {record_id for group in new_groups for record_id in group}
+        new_groups = [group for group in new_groups if group] + [[record_id] for record_id in unassigned if record_id not in covered]
+    else:
+        new_groups = [[record_id] for record_id in unassigned]
+    for group in new_groups:
+        if len(group) > 1:
+            second_level_groups[len(first_level_groups)] = [list(group)]
+        first_level_groups.append(group)
+
+    # 2.2 超过 INCREMENTAL_SPLIT_SIZE 的一级分组重新做二级分组
+    results = await gather_with_concurrency(
+        groupingConcurrency,
+        *[regroup_second_level(scenario, store, first_level_groups[index], granularity_result) for index in oversized]
+    )
+    for index, (subgroups, group_tokens_saved) in zip(oversized, results):
+        second_level_groups[index] = subgroups
+        tokens_saved += group_tokens_saved
+    llm_calls += len(oversized)
+
+    centroids.retain(
+        [("1", i) for i in range(len(first_level_groups))]
+        + [("2", i, j) for i, subgroups in second_level_groups.items() for j in range(len(subgroups))]
+    )
+    groupsOfNodes = build_groups_of_nodes(store, first_level_groups, dict(sorted(second_level_groups.items())))
+    print(f"Finished incremental grouping: {len(assigned)} assigned, {len(new_groups)} new groups, {len(oversized)} regrouped, {embedded} embedded, spent {time.time() - start_time:.2f} seconds.")
+    return json_response(
+        {
+            "groupsOfNodes": groupsOfNodes,
+            "granularity": granularity_result,
+            "assigned": assigned,
+            "new_groups": [len(first_level_groups) - len(new_groups) + i + 1 for i in range(len(new_groups))],
+            "regrouped": [index + 1 for index in oversized],
+            "llm_calls": llm_calls,
+        },
+        headers=tokens_saved_header(tokens_saved),
+    )
+
+async def group_session_incrementally(session, new_ids):
+    """
+    把新记录归入会话意图树中最相近的顶层意图，再沿子意图下降到最相近的叶节点。
+    不够相近的记录不会调用 LLM（新意图需要命名），原样返回在 unassigned 中，由客户端交给 /extract/。
+    """
+    before = session.snapshot()
+    tree_index = IndexedIntentTree(session.tree)
+    centroids = centroidCache.get(("session", session.session_id))
+
+    def members(node):
+        return [record_id for record_id in tree_index.leaf_records(node["id"]) if record_id in session.records]
+
+    def candidates(nodes):
+        return [(("node", node["id"]), members(node)) for node in nodes]
+
+    roots = tree_index.roots()
+    existing = [record_id for node in roots for record_id in members(node)]
+    existing_ids = set(existing)
+    new_ids = [record_id for record_id in dict.fromkeys(new_ids) if record_id not in existing_ids]
+    embedded = await embed_missing(centroids, session.records, existing + new_ids, session.scenario)
+
+    assigned, unassigned = [], []
+    for record_id in new_ids:
+        index, similarity = centroids.nearest(record_id, candidates(roots))
+        if index is None or similarity < INCREMENTAL_ASSIGN_THRESHOLD:
+            unassigned.append(record_id)
+            continue
+        node = roots[index]
+        while True:
+            children = [child for child in node.get("child") or [] if "intent" in child]
+            child_index, _ = centroids.nearest(record_id, candidates(children))
+            if child_index is None:
+                break
+            node = children[child_index]
+        tree_index.add_record(node["id"], record_id)
+        assigned.append({"id": record_id, "intent_id": node["id"], "similarity": round(similarity, 4)})
+
+    session.touch()
+    print(f"Finished incremental grouping for session {session.session_id}: {len(assigned)} assigned, {len(unassigned)} unassigned, {embedded} embedded.")
+    return {**session_delta(session, before), "assigned": assigned, "unassigned": session.expand_records(unassigned)}
+
+@app.post("/group/incremental/")
+async def group_incremental(request: dict):
+    """
+    把新记录加入已有的分组，而不是对全部记录重新分组。每条新记录的开销与已有记录数基本无关。
+
+    :param scenario: 场景
+    :param records: 新记录列表
+    :param groupsOfNodes: 已有的分组（/group/ 的返回格式），返回更新后的 groupsOfNodes
+    :param session_id: 或者使用服务端会话中的意图树，返回节点级增量
+    :param familiarity / specificity: 可选，需要调用 LLM 时使用
+    """
+    try:
+        records = request.get("records", [])
+        if request.get("session_id"):
+            session = get_session(request["session_id"])
+            new_ids = [session.records.add(record) for record in records]
+            return await group_session_incrementally(session, new_ids)
+
+        store = RecordStore()
+        new_ids = [store.add(record) for record in records]
+        return await group_incrementally(
+            request.get("scenario", ""),
+            store,
+            request.get("groupsOfNodes", []),
+            new_ids,
+            request.get("familiarity"),
+            request.get("specificity"),
+        )
+    except HTTPException:
+        raise
+    except computeExecutor.ExecutorBusyError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=422, detail=f"Error processing incremental grouping: {str(e)}")
+
+def collect_confirmed_intents(intentTree):
+    """
+    过滤出用户确认的节点
+    提取 intentTree 中所有 immutable 或 confirmed 的节点，构建 confirmedIntents
+    """
+    # 与原来的遍历一致：只提取 {"child": [...]} 中的节点，只有 item 的树不提取
+    if not intentTree or not intentTree.get("child"):
+        return []
+    return IndexedIntentTree({"child": intentTree["child"]}).confirmed_intents()
+
+def fallback_intent(group, i):
+    """Chain4ExtractIntent 失败时，根据 groupsOfNodes 生成基础的意图节点"""
+    return {
+        "intent_id": group.get("intent_id", i + 1),
+        "intent_name": f"Intent {i + 1}",
+        "intent_description": f"Basic intent for group {i + 1}",
+        "level": group.get("level", "1"),
+        "parent": group.get("parent")
+    }
+
 @app.post("/extract/")
 async def extract_intent(request: dict):
     try:
@@ -383,34 +1149,43 @@ async def extract_intent(request: dict):
         specificity = request.get("specificity")
         intentTree = request.get("intentTree")
 
-        # 过滤出用户确认的节点
-        # 根据 intentTree 的结构递归提取所有 immutable 或 confirmed 的节点，构建 confirmedIntents
-        confirmedIntents = []
-
-        def extract_confirmed_intents(children, parent_level="1", parent_id=None):
-            for child in children:
-                # 只处理有 intent 字段的节点（非叶子节点）
-                if "intent" in child and (child.get("immutable") or child.get("confirmed")):
-                    confirmedIntents.append({
-                        "intent_id": child.get("id"),
-                        "intent_name": child.get("intent"),
-                        "intent_description": child.get("description", ""),
-                        "level": child.get("level", parent_level),
-                        "parent": child.get("parent", parent_id)
-                    })
-                # 递归处理子节点
-                if "child" in child and isinstance(child["child"], list) and child["child"]:
-                    # 传递当前节点的 level+1 作为子节点的 level，parent 传当前节点 id
-                    next_level = str(int(child.get("level", parent_level)) + 1) if child.get("level", parent_level).isdigit() else parent_level
-                    extract_confirmed_intents(child["child"], parent_level=next_level, parent_id=child.get("id"))
-
-        if intentTree and intentTree.get("child"):
-            extract_confirmed_intents(intentTree["child"])
+        session = None
+        if request.get("session_id") is not None:
+            # 会话模式：已确认的意图来自服务端保存的树，groupsOfNodes 中的记录可以只传 id
+            session = get_session(request["session_id"])
+            scenario = scenario or session.scenario
+            intentTree = {"child": list(session.tree["item"].values())}
+            groupsOfNodes = [{**group, "records": session.expand_records(group.get("records", []))} for group in groupsOfNodes]
 
+        confirmedIntents = collect_confirmed_intents(intentTree)
         print("Confirmed intents:", confirmedIntents)
 
+        # 同一条记录会同时出现在一级和二级分组中：只保存一份，构建时引用 id，输出时再展开
+        # 在调用模型之前引用全部分组，id 相同但内容不同的记录直接返回 422
+        store = RecordStore()
+        groupRecordIds = [store.ref(group.get("records", [])) for group in groupsOfNodes]
+
+        # prompt 中只放去重、压缩后的记录；结果仍按 groupsOfNodes 的顺序映射回原始记录
+        dedupedGroups, records_in, records_out = recordDeduplicator.dedup_groups(groupsOfNodes)
+        tokens_saved = 0
+        if recordDeduplicator.enabled and records_out != records_in:
+            # 只在去重启用且确实合并了记录时才统计节省的 token（需要对整个 groupsOfNodes 计数）
+            tokens_saved = count_tokens(groupsOfNodes, modelName) - count_tokens(dedupedGroups, modelName)
+        compactedGroups, compaction_tokens_saved = promptCompactor.compact_groups(dedupedGroups)
+        tokens_saved += compaction_tokens_saved
+        prompt_headers = {**tokens_saved_header(tokens_saved), **dedup_header(records_in, records_out)}
+        print(f"Deduplication kept {records_out}/{records_in} records; prompt compaction saved {tokens_saved} tokens.")
+
+        if request.get("stream"):
+            # 流式模式：每生成一个 IntentNode 就推送一个 node-added 事件
+            return StreamingResponse(
+                extract_event_stream(scenario, groupsOfNodes, familiarity, specificity, confirmedIntents, session, compactedGroups, store, groupRecordIds),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no", **prompt_headers},
+            )
+
         try:
-            result = await chain4ExtractIntent.invoke(scenario=scenario, groupsOfNodes=groupsOfNodes, familiarity=familiarity, specificity=specificity, confirmedIntents=confirmedIntents)
+            result = await chain4ExtractIntent.invoke(scenario=scenario, groupsOfNodes=compactedGroups, familiarity=familiarity, specificity=specificity, confirmedIntents=confirmedIntents)
             # 兼容 Pydantic RootModel、list、tuple 等多种返回类型，并确保 result_list 可 item assignment
             if hasattr(result, 'root'):
                 # Pydantic RootModel
@@ -424,159 +1199,126 @@ async def extract_intent(request: dict):
         except Exception as e:
             print(f"Error in Chain4ExtractIntent: {str(e)}")
             # Fallback: create basic intent structure from groupsOfNodes
-            result_list = []
-            for i, group in enumerate(groupsOfNodes):
-                result_list.append({
-                    "intent_id": group.get("intent_id", i + 1),
-                    "intent_name": f"Intent {i + 1}",
-                    "intent_description": f"Basic intent for group {i + 1}",
-                    "level": group.get("level", "1"),
-                    "parent": group.get("parent")
-                })
+            result_list = [fallback_intent(group, i) for i, group in enumerate(groupsOfNodes)]
             print(f"Using fallback result_list: {result_list}")
 
         # 确保 result_list 是 list of dicts
         result_list = [item.model_dump() if hasattr(item, 'model_dump') else dict(item) if not isinstance(item, dict) else item for item in result_list]
 
         for i, item in enumerate(result_list):
-            if i < len(groupsOfNodes):
-                item["records"] = groupsOfNodes[i]["records"]
+            if i < len(groupRecordIds):
+                item["records"] = groupRecordIds[i]
         
         # 转换为嵌套的 intentTree 格式
-        intentTree = {
-            "scenario": scenario,
-            "item": {}
-        }
-        
-        # 首先创建所有节点的映射
-        nodes_map = {}
-        for item in result_list:
-            intent_name = item.get("intent_name", f"Intent_{item.get('intent_id', 'unknown')}")
-            # 处理嵌套的记录数组
-            def flatten_records(records):
-                flattened = []
-                for record in records:
-                    if isinstance(record, list):
-                        flattened.extend(flatten_records(record))
-                    else:
-                        flattened.append(record)
-                return flattened
-            
-            nodes_map[item.get("intent_id")] = {
-                "name": intent_name,
-                "id": item.get("intent_id"),
-                "intent": item.get("intent_name", ""),
-                "description": item.get("intent_description", ""),
-                "priority": 5,  # 默认优先级
-                "child_num": 0,
-                "group": flatten_records(item.get("records", [])),
-                "level": item.get("level", "1"),
-                "parent": item.get("parent"),
-                "immutable": True,  # 默认是不可变的
-                "child": []  # 初始化子节点列表
-            }
-        
-        # 构建嵌套结构
-        root_nodes = []
+        builder = IntentTreeBuilder(scenario, store)
         for item in result_list:
-            intent_id = item.get("intent_id")
-            parent_id = item.get("parent")
-            
-            if parent_id is None:
-                # 这是根节点
-                root_nodes.append(intent_id)
-            else:
-                # 这是子节点，添加到父节点的child中
-                if parent_id in nodes_map:
-                    nodes_map[parent_id]["child"].append(intent_id)
-        
-        # 将根节点添加到intentTree中
-        for root_id in root_nodes:
-            node_data = nodes_map[root_id]
-            intentTree["item"][node_data["name"]] = {
-                "id": node_data["id"],
-                "intent": node_data["intent"],
-                "description": node_data["description"],
-                "priority": node_data["priority"],
-                "child_num": node_data["child_num"],
-                "group": node_data["group"],
-                "level": node_data["level"],
-                "parent": node_data["parent"],
-                "immutable": node_data["immutable"],
-                "child": []  # 初始化子节点列表
-            }
-            
-            # 递归添加子节点
-            def add_children(parent_node, child_ids):
-                for child_id in child_ids:
-                    if child_id in nodes_map:
-                        child_data = nodes_map[child_id]
-                        child_node = {
-                            "id": child_data["id"],
-                            "intent": child_data["intent"],
-                            "description": child_data["description"],
-                            "priority": child_data["priority"],
-                            "child_num": child_data["child_num"],
-                            "group": child_data["group"],
-                            "level": child_data["level"],
-                            "parent": child_data["parent"],
-                            "immutable": child_data["immutable"],
-                            "child": []
-                        }
-                        parent_node["child"].append(child_node)
-                        parent_node["child_num"] += 1
-                        parent_node["group"] = []  # 父节点有子节点时，清空group
-                        
-                        # 递归添加子节点的子节点
-                        if child_data["child"]:
-                            add_children(child_node, child_data["child"])
-            
-            # 添加子节点到根节点
-            add_children(intentTree["item"][node_data["name"]], nodes_map[root_id]["child"])
+            builder.add(item)
+        intentTree = builder.build()
         
         print(f"Finished extracting intents, spent {time.time() - start_time:.2f} seconds.")
-        return intentTree
-
+        if session is not None:
+            # 会话模式：保存新树，只返回变化的节点
+            before = session.snapshot()
+            session.replace_tree(intentTree)
+            return json_response(session_delta(session, before), headers=prompt_headers)
+        return json_response(intentTree, headers=prompt_headers)
+
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=422, detail=f"Error processing extract intent: {str(e)}")
 
+async def extract_event_stream(scenario, groupsOfNodes, familiarity, specificity, confirmedIntents, session, compactedGroups, store, groupRecordIds):
+    """
+    /extract/ 的 SSE 流：
+    - node-added：一个意图节点已生成 {"node": 节点（不含子节点）, "parent": 父节点 id}
+    - done：完整的 intentTree，与非流式响应相同（会话模式下为增量）
+    - error：处理失败
+    """
+    start_time = time.time()
+    builder = IntentTreeBuilder(scenario, store)
+    emitted = 0
+
+    def add(item):
+        nonlocal emitted
+        item = item.model_dump() if hasattr(item, 'model_dump') else dict(item)
+        if emitted < len(groupRecordIds):
+            item["records"] = groupRecordIds[emitted]
+        emitted += 1
+        return sse_event("node-added", {"node": builder.add(item), "parent": item.get("parent")})
+
+    try:
+        try:
+            async for item in chain4ExtractIntent.astream_nodes(scenario=scenario, groupsOfNodes=compactedGroups, familiarity=familiarity, specificity=specificity, confirmedIntents=confirmedIntents):
+                yield add(item)
+        except Exception as e:
+            print(f"Error in Chain4ExtractIntent: {str(e)}")
+            # Fallback: 为尚未生成的分组补上基础的意图节点
+            for i, group in enumerate(groupsOfNodes[emitted:], start=emitted):
+                yield add(fallback_intent(group, i))
+
+        print(f"Finished extracting intents, spent {time.time() - start_time:.2f} seconds.")
+        intentTree = builder.build()
+        if session is not None:
+            before = session.snapshot()
+            session.replace_tree(intentTree)
+            intentTree = session_delta(session, before)
+        yield sse_event("done", intentTree)
+    except Exception as e:
+        yield sse_event("error", {"detail": f"Error processing extract intent: {str(e)}"})
+
+# 与意图树中已有意图的余弦相似度不低于该值的推荐意图会被丢弃
+RECOMMEND_DUPLICATE_THRESHOLD = float(os.getenv("RECOMMEND_DUPLICATE_THRESHOLD", "0.92"))
+
+async def drop_duplicate_recommendations(scenario, tree, recommended_intents):
+    """
+    把每个推荐意图与树中已有的意图直接比较（一次矩阵乘法），丢弃与已有意图几乎相同的推荐。
+    已有意图的向量来自 scenario 的意图索引，只在新增或改动时才嵌入；计算资源繁忙时不做过滤。
+    """
+    existing = [
+        {"id": node_id, "intent": node.get("intent", ""), "description": node.get("description", "")}
+        for node_id, node in IndexedIntentTree(tree).nodes.items()
+    ]
+    if not existing or not recommended_intents:
+        return recommended_intents
+    intents = [item.model_dump() if hasattr(item, "model_dump") else dict(item) for item in recommended_intents]
+    try:
+        existing_vectors = await indexed_vectors(scenario, "intent", [(intent["id"], intent_text(intent)) for intent in existing])
+        vectors = await executor.embed_texts([
+            intent_text({"intent": intent.get("intent_name", ""), "description": intent.get("intent_description", "")})
+            for intent in intents
+        ])
+    except computeExecutor.ExecutorBusyError as e:
+        print(f"Skip duplicate recommendation check: {str(e)}")
+        return recommended_intents
+
+    kept = []
+    for item, intent, nearest in zip(recommended_intents, intents, top_m_by_similarity(vectors, existing_vectors, 1, RECOMMEND_DUPLICATE_THRESHOLD)):
+        if nearest:
+            print(f"Drop recommended intent '{intent.get('intent_name')}': duplicate of '{existing[nearest[0]]['intent']}'.")
+            continue
+        kept.append(item)
+    return kept
+
 @app.post("/recommend/")
 async def recommend_intent(request: dict):
     '''
     根据意图树和用户输入的Desire，推荐意图。
     '''
     try:
-        # 创建request的副本，过滤掉所有records节点以节省token
-        import copy
-        filtered_request = copy.deepcopy(request)
-        
-        # 递归函数：从intentTree中移除所有records节点
-        def remove_records_from_tree(tree_node):
-            if isinstance(tree_node, dict):
-                # 如果是叶子节点且有records字段，清空records
-                if "records" in tree_node:
-                    tree_node["records"] = []
-                
-                # 如果有child字段，递归处理子节点
-                if "child" in tree_node and isinstance(tree_node["child"], list):
-                    for child in tree_node["child"]:
-                        remove_records_from_tree(child)
-                
-                # 如果有group字段，清空group
-                if "group" in tree_node:
-                    tree_node["group"] = []
-        
-        # 处理intentTree中的records
-        if "item" in filtered_request:
-            intent_tree = filtered_request["item"]
-            for node_name, node_data in intent_tree.items():
-                remove_records_from_tree(node_data)
-        
-        # 处理groupsOfNodes中的records
-        if "groupsOfNodes" in filtered_request:
-            for group in filtered_request["groupsOfNodes"]:
-                if "records" in group:
-                    group["records"] = []
+        session = None
+        if request.get("session_id") is not None:
+            # 会话模式：直接在服务端保存的树上添加推荐的意图，返回增量
+            session = get_session(request["session_id"])
+            before = session.snapshot()
+            request = {
+                **{key: value for key, value in request.items() if key != "session_id"},
+                "scenario": session.tree["scenario"],
+                "item": session.tree["item"],
+            }
+
+        # 只投影意图字段、清空 records/group 以节省 token，不复制任何记录正文
+        filtered_request = project_tree(request)
 
         print("filtered_request", filtered_request)
         print("request", request)
@@ -598,10 +1340,13 @@ async def recommend_intent(request: dict):
         if not isinstance(recommended_intents, list):
             recommended_intents = [recommended_intents] if recommended_intents else []
 
+        if "item" in request:
+            recommended_intents = await drop_duplicate_recommendations(request.get("scenario", ""), request, recommended_intents)
         print("recommended_intents", recommended_intents)
         
         # 将推荐的意图节点添加到原始request的intentTree中
         if recommended_intents and ("item" in request):
+            tree_index = IndexedIntentTree(request)
             for intent_data in recommended_intents:
                     if hasattr(intent_data, 'model_dump'):
                         intent_dict = intent_data.model_dump()
@@ -626,18 +1371,20 @@ async def recommend_intent(request: dict):
                     if intent_dict.get("level") == "1" or intent_dict.get("parent") is None:
                         # 顶级意图，添加到item中
                         intent_name = intent_dict.get("intent_name", f"Intent_{new_intent_node['id']}")
-                        request["item"][intent_name] = new_intent_node
+                        tree_index.add(new_intent_node, name=intent_name)
                     else:
-                        # 子级意图，需要找到父节点并添加到其child中
-                        parent_id = intent_dict.get("parent")
-                        for node_name, node_data in request["item"].items():
-                            if node_data.get("id") == parent_id:
-                                node_data["child"].append(new_intent_node)
-                                node_data["child_num"] += 1
-                                break
+                        # 子级意图，通过索引在顶层节点中找到父节点并添加到其child中
+                        parent_node = tree_index.add(new_intent_node, parent_id=intent_dict.get("parent"))
+                        if parent_node is not None:
+                            parent_node["child_num"] = parent_node.get("child_num", 0) + 1
+        if session is not None:
+            session.touch()
+            return json_response(session_delta(session, before))
         # 返回更新后的完整request
-        return request
+        return json_response(request)
         
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=422, detail=f"Error processing recommend intent: {str(e)}")
 
@@ -795,6 +1542,97 @@ async def recommend_intent(request: dict):
 import RAGModule
 model4RAG = RAGModule.Chain4RAG(model)
 model4Split = RAGModule.Chain4Split(model)
+
+# 嵌入预筛选：每个意图只把最相似的 top_m 个句子交给 LLM 排序
+RAG_PREFILTER_TOP_M = int(os.getenv("RAG_PREFILTER_TOP_M", "15"))
+RAG_PREFILTER_THRESHOLD = float(os.getenv("RAG_PREFILTER_THRESHOLD", "0.2"))
+
+async def prefilter_sentences(intentsDict, sentences, top_m=RAG_PREFILTER_TOP_M, threshold=RAG_PREFILTER_THRESHOLD, scenario=None, intent_ids=None):
+    """
+    批量嵌入意图与句子，按 intent×sentence 相似度为每个意图保留 top_m 个候选句，
+    返回所有意图候选句索引的并集（按原文顺序）。
+    传入 scenario 和每个意图的节点 id（intent_ids）时，意图向量取自该 scenario 的向量索引，只有新的或改过的意图才需要嵌入。
+    """
+    if scenario is not None and intent_ids is not None and None not in intent_ids:
+        intent_vectors = await indexed_vectors(scenario, "intent", [(intent_id, intent_text(intent)) for intent_id, intent in zip(intent_ids, intentsDict)])
+        sentence_vectors = await executor.embed_texts(list(sentences))
+    else:
+        intent_texts = [intent_text(intent) for intent in intentsDict]
+        vectors = await executor.embed_texts(intent_texts + list(sentences))
+        intent_vectors, sentence_vectors = vectors[:len(intent_texts)], vectors[len(intent_texts):]
+    candidates = top_m_by_similarity(intent_vectors, sentence_vectors, top_m, threshold)
+    return sorted({index for indices in candidates for index in indices})
+
+# 每块句子的 token 预算与同时在途的块数
+RAG_CHUNK_TOKENS = int(os.getenv("RAG_CHUNK_TOKENS", "3000"))
+RAG_CHUNK_CONCURRENCY = int(os.getenv("RAG_CHUNK_CONCURRENCY", "4"))
+
+async def rag_chunk(scenario, intentsDict, chunk, sentences):
+    """
+    对一个块调用 Chain4RAG。块内以局部 id 0..len(chunk)-1 提交给 LLM，
+    返回时换算回全局句子索引：{"top_k": {intent: [index]}, "bottom_k": {intent: [index]}}
+    """
+    # 将chunk转换为字典格式
+    chunk_dict = [{"id": idx, "content": sentences[i]} for idx, i in enumerate(chunk)]
+
+    # 调用LLM
+    response = await model4RAG.invoke(
+            scenario,
+            intentsDict=intentsDict,
+            sentenceList=chunk_dict
+        )
+    print("response", response)
+
+    # 重构响应，替换索引（忽略 LLM 返回的越界 id）
+    result = {"top_k": {}, "bottom_k": {}}
+    for intent in response['top_all'].keys():
+        result["top_k"][intent] = [int(chunk[i]) for i in response["top_all"][intent] if 0 <= i < len(chunk)]
+        result["bottom_k"][intent] = [int(chunk[i]) for i in response["bottom_all"].get(intent, []) if 0 <= i < len(chunk)]
+    return result
+
+def resolve_rag_sentences(chunk_result, sentences):
+    """把 rag_chunk 结果中的全局句子索引替换为句子文本（同一文本只保留一次）"""
+    return {
+        "top_k": {intent: list(dict.fromkeys(sentences[i] for i in indices)) for intent, indices in chunk_result["top_k"].items()},
+        "bottom_k": {intent: list(dict.fromkeys(sentences[i] for i in indices)) for intent, indices in chunk_result["bottom_k"].items()},
+    }
+
+async def rag_event_stream(scenario, intentsDict, sentences, contentChunks):
+    """
+    /rag/ 的 SSE 流：
+    - intent：某个块中某个意图的结果 {"chunk", "intent", "top_k", "bottom_k"}
+    - chunk：某个块全部完成 {"chunk", "completed", "total"}
+    - done：与非流式响应相同的 merge_dicts 结果（按块顺序合并）
+    - error：处理失败
+    """
+    semaphore = asyncio.Semaphore(max(1, RAG_CHUNK_CONCURRENCY))
+
+    async def run(index, chunk):
+        async with semaphore:
+            return index, await rag_chunk(scenario, intentsDict, chunk, sentences)
+
+    tasks = [asyncio.create_task(run(index, chunk)) for index, chunk in enumerate(contentChunks)]
+    results = [None] * len(contentChunks)
+    try:
+        for completed, task in enumerate(asyncio.as_completed(tasks), start=1):
+            index, chunk_result = await task
+            results[index] = chunk_result
+            resolved = resolve_rag_sentences(chunk_result, sentences)
+            for intent in resolved["top_k"]:
+                yield sse_event("intent", {
+                    "chunk": index,
+                    "intent": intent,
+                    "top_k": resolved["top_k"][intent],
+                    "bottom_k": resolved["bottom_k"].get(intent, []),
+                })
+            yield sse_event("chunk", {"chunk": index, "completed": completed, "total": len(contentChunks)})
+        yield sse_event("done", resolve_rag_sentences(merge_dicts(results), sentences))
+    except Exception as e:
+        yield sse_event("error", {"detail": f"Error RAG: {str(e)}"})
+    finally:
+        for task in tasks:
+            task.cancel()
+
 @app.post("/rag/")
 async def retrieve_top_k_relevant_sentence_based_on_intent(request_dict: dict):
     """
@@ -808,7 +1646,6 @@ async def retrieve_top_k_relevant_sentence_based_on_intent(request_dict: dict):
     :return: 每个意图对应的 top-k 和 bottom-k 最相关句子的结果。
     """
     try:
-        chunk_num=1
         # 先验证并转换请求数据为RAGRequest对象
         # try:
         #     ragRequest = RAGRequest(**request_dict)
@@ -822,7 +1659,10 @@ async def retrieve_top_k_relevant_sentence_based_on_intent(request_dict: dict):
         ragRequest = request_dict
 
         # 以下是原有逻辑
-        intentTree = ragRequest['intentTree']
+        if ragRequest.get("session_id") is not None:
+            intentTree = get_session(ragRequest["session_id"]).tree
+        else:
+            intentTree = ragRequest['intentTree']
 
         webContent = ragRequest['webContent']
         # k = ragRequest.k
@@ -842,92 +1682,55 @@ async def retrieve_top_k_relevant_sentence_based_on_intent(request_dict: dict):
         sentences = split2Sentences(webContent)
         print("该网页句子数量：", len(sentences))
 
-        contentChunks = np.array_split(sentences, chunk_num)
-
-        result = []
-
-        for chunk in contentChunks:
-            print("chunk len:", len(chunk))
-            # # Step 2: 向量化 webContent 的句子
-            # sentences_embeddings = await embedModel.embeddingList(chunk)
-
-            # Step 3: 筛选意图并向量化它们
-            intentsDict = getIntentsByLevel(
-                intentTree['item'],  # 转换 IntentTree 为字典
-                level_control="second"
+        # Step 2: 筛选意图
+        intentsDict = IndexedIntentTree(intentTree).intents_by_level(level_control="second", with_id=True)
+        # 节点 id 只用作向量索引的键，不放进 prompt
+        intent_ids = [intent.pop("id") for intent in intentsDict]
+        print("intentsDict", intentsDict)
+
+        # Step 3（可选）: 嵌入预筛选，只把每个意图的 top-m 候选句交给 LLM
+        candidate_indices = list(range(len(sentences)))
+        if ragRequest.get("prefilter") and intentsDict and sentences:
+            try:
+                candidate_indices = await prefilter_sentences(
+                    intentsDict,
+                    sentences,
+                    top_m=ragRequest.get("top_m", RAG_PREFILTER_TOP_M),
+                    threshold=ragRequest.get("top_threshold", RAG_PREFILTER_THRESHOLD),
+                    scenario=scenario,
+                    intent_ids=intent_ids,
+                )
+                print("预筛选后句子数量：", len(candidate_indices))
+            except computeExecutor.ExecutorBusyError as e:
+                print(f"Skip prefilter: {str(e)}")
+
+        # Step 4: 按 token 预算把候选句装箱成块，各块并发调用 LLM
+        chunk_tokens = ragRequest.get("chunk_tokens", RAG_CHUNK_TOKENS)
+        # 每个句子在 prompt 中以 {'id': n, 'content': '...'} 的形式出现，额外计入约 10 个 token
+        token_counts = [count_tokens(sentences[i]) + 10 for i in candidate_indices]
+        contentChunks = [
+            [candidate_indices[j] for j in chunk]
+            for chunk in pack_by_token_budget(token_counts, chunk_tokens)
+        ]
+        print("chunk num:", len(contentChunks))
+
+        if ragRequest.get("stream"):
+            # 流式模式：每个块（以及块内每个意图）完成后立即推送
+            return StreamingResponse(
+                rag_event_stream(scenario, intentsDict, sentences, contentChunks),
+                media_type="text/event-stream",
+                headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
             )
 
-            print("intentsDict", intentsDict)
-            # combinedIntents_embeddings = await embedModel.embeddingList(combinedIntents)
-
-            # Step 4: 计算每个意图的 top-k 相关句子
-            intent_to_top_k_sentences = {}
-            intent_to_bottom_k_sentences = {}
-
-            print("call LLM")
-            
-            # 将chunk转换为字典格式
-            chunk_dict = [{"id": idx, "content": sentence} for idx, sentence in enumerate(chunk)]
-            
-            # 调用LLM
-            response = await model4RAG.invoke(
-                    scenario,
-                    intentsDict=intentsDict,
-                    sentenceList=chunk_dict
-                )
-            # 重构响应，替换索引
-            print("response", response)
-            for intent in response['top_all'].keys():
-                if intent not in intent_to_top_k_sentences:
-                    intent_to_top_k_sentences[intent] = []
-                if intent not in intent_to_bottom_k_sentences:
-                    intent_to_bottom_k_sentences[intent] = []
-                # 从chunk_dict中根据id获取对应的content
-                intent_to_top_k_sentences[intent].extend([chunk_dict[i]["content"] for i in response["top_all"][intent]])
-                intent_to_bottom_k_sentences[intent].extend([chunk_dict[i]["content"] for i in response["bottom_all"][intent]])
-            # for item in response["data"]:
-            #     intent = item["intent"]
-            #     intent_to_top_k_sentences[intent] = [chunk[i] for i in item["topKIndices"]]
-
-            #     intent_records = get_intent_records(intentTree, intent)  # 获取当前意图的记录
-
-            #     # 如果intent没有records，直接返回top-k
-            #     if len(intent_records) == 0:
-            #         intent_to_bottom_k_sentences[intent] = intent_to_top_k_sentences[intent][:k]
-            #         intent_to_top_k_sentences[intent]= []
-            #     else:
-            #         intent_records_embeddings = await embedModel.embeddingList(intent_records)
-            #         # 对超过top_threshold的每个句子计算与每个 record 的最小相似度
-            #         record_max_similarities = []
-            #         top_sentences_embeddings = [sentences_embeddings[i] for i in item["topKIndices"]]
-            #         if top_sentences_embeddings:
-            #             for sentence_e in top_sentences_embeddings:
-            #                 max_sim = max(
-            #                     cosine_similarity(record_e, sentence_e)
-            #                     for record_e in intent_records_embeddings
-            #                 )
-            #                 record_max_similarities.append(max_sim)
-
-            #             # 筛选低于 bottom_k_threshold 的句子及其索引
-            #             bottom_filtered_indices = [
-            #                 i for i, sim in enumerate(record_max_similarities) if sim <= bottom_threshold
-            #             ]
-            #             bottom_filtered_similarities = [
-            #                 (i, record_max_similarities[i]) for i in bottom_filtered_indices
-            #             ]
-            #             bottom_k_indices = sorted(bottom_filtered_similarities, key=lambda x: x[1])[:k]
-            #             bottom_k_sentences = [chunk[i[0]] for i in bottom_k_indices]
-
-            #             intent_to_bottom_k_sentences[intent] = bottom_k_sentences
-            #         else:
-            #             intent_to_bottom_k_sentences[intent] = []
-            result.append({
-                "top_k": intent_to_top_k_sentences,
-                "bottom_k": intent_to_bottom_k_sentences
-            })
-                        
+        print("call LLM")
+        chunk_results = await gather_with_concurrency(
+            RAG_CHUNK_CONCURRENCY,
+            *[rag_chunk(scenario, intentsDict, chunk, sentences) for chunk in contentChunks]
+        )
+
+        # Step 5: 按全局句子索引合并各块结果（有序去重），再替换为句子
         # Step 6: 返回每个意图的 top-k 和 bottom-k 最相关句子
-        return merge_dicts(result)
+        return json_response(resolve_rag_sentences(merge_dicts(chunk_results), sentences))
         # for combinedIntent, conbinedIntent_e in zip(combinedIntents, combinedIntents_embeddings):
         #     [intent, description] = combinedIntent.split("-")
         #     # 计算意图向量和所有句子向量之间的余弦相似度
@@ -1011,6 +1814,8 @@ async def retrieve_top_k_relevant_sentence_based_on_intent(request_dict: dict):
             #    intent_to_top_k_sentences[intent]= top_k_sentences
             #    intent_to_bottom_k_sentences[intent] = bottom_k_sentences
     
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(
             status_code=422,
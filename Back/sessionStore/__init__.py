@@ -0,0 +1,202 @@
+import threading
+import time
+from collections import OrderedDict
+
+from utils import IndexedIntentTree, RecordStore
+
+
+class SessionNotFoundError(KeyError):
+    pass
+
+
+class Session:
+    """
+    服务端保存的一棵意图树及其全部记录。
+
+    tree 与 /extract/ 返回的 intentTree 结构相同（{"scenario", "item": {name: node}}），
+    但节点的 group 中只保存记录 id，记录正文统一保存在 records（RecordStore）中。
+    """
+
+    def __init__(self, session_id, scenario, tree=None, records=None):
+        self.session_id = session_id
+        self.scenario = scenario
+        self.records = RecordStore(records)
+        self.tree = {"scenario": scenario, "item": {}}
+        self.version = 0
+        self.updated_at = time.time()
+        if tree:
+            self.replace_tree(tree)
+
+    def replace_tree(self, tree):
+        """用完整的 intentTree（group 中可以是完整记录或记录 id）替换当前树"""
+        # 树中的记录覆盖会话中 id 相同的旧记录；同一棵树中 id 相同但内容不同的记录抛出 ValueError
+        seen = set()
+        item = {name: self._store_node(node, seen) for name, node in (tree.get("item") or {}).items()}
+        self.tree = {"scenario": tree.get("scenario", self.scenario), "item": item}
+        self.touch()
+
+    def _store_node(self, node, seen=None):
+        stored = {key: value for key, value in node.items() if key not in ("group", "child")}
+        stored["group"] = [self.ref_record(record, seen) for record in node.get("group", [])]
+        stored["child"] = [self._store_node(child, seen) for child in node.get("child", [])]
+        return stored
+
+    def ref_record(self, record, seen=None):
+        """
+        保存记录正文并返回其 id；传入的已经是 id 时原样返回。
+        seen 为本次已保存的 id 集合，其中的 id 再次出现时必须与已保存的记录相同。
+        """
+        if isinstance(record, dict):
+            if seen is not None and record.get("id") in seen:
+                return self.records.ref(record)
+            record_id = self.records.add(record)
+            if seen is not None:
+                seen.add(record_id)
+            return record_id
+        return record
+
+    def expand_records(self, records):
+        """记录 id -> 记录正文（支持嵌套列表），未知的 id 抛出 KeyError"""
+        return self.records.expand(records)
+
+    def expanded_tree(self):
+        """返回 group 中为完整记录的意图树（只用于全量同步）"""
+
+        def expand(node):
+            expanded = {key: value for key, value in node.items() if key not in ("group", "child")}
+            expanded["group"] = self.expand_records(node.get("group", []))
+            expanded["child"] = [expand(child) for child in node.get("child", [])]
+            return expanded
+
+        return {"scenario": self.tree["scenario"], "item": {name: expand(node) for name, node in self.tree["item"].items()}}
+
+    def nodes(self):
+        """id -> 节点（树中的原对象）"""
+        return IndexedIntentTree(self.tree).nodes
+
+    def snapshot(self):
+        """
+        扁平化的树：id -> 节点字段（不含子节点），子节点以 children id 列表表示，group 为记录 id 列表。
+        用于计算增量。
+        """
+        flat = {}
+
+        def walk(node, name=None):
+            flat[node.get("id")] = {
+                **{key: value for key, value in node.items() if key != "child"},
+                "group": list(node.get("group", [])),
+                "name": name,
+                "children": [child.get("id") for child in node.get("child", [])],
+            }
+            for child in node.get("child", []):
+                walk(child)
+
+        for name, node in self.tree["item"].items():
+            walk(node, name)
+        return flat
+
+    def apply_delta(self, delta):
+        """
+        应用客户端发来的增量：
+        - records: 新增或更新的记录
+        - removed_records: 删除的记录 id（同时从所有 group 中移除）
+        - flags: [{"id", "confirmed"?, "immutable"?}]
+        - renames: [{"id", "intent"?, "description"?}]
+        """
+        for record in delta.get("records", []):
+            self.records.add(record)
+
+        removed = set(delta.get("removed_records", []))
+        nodes = self.nodes()
+        if removed:
+            for record_id in removed:
+                self.records.remove(record_id)
+            for node in nodes.values():
+                if any(record_id in removed for record_id in node.get("group", [])):
+                    node["group"] = [record_id for record_id in node["group"] if record_id not in removed]
+
+        for flag in delta.get("flags", []):
+            node = nodes.get(flag.get("id"))
+            if node is None:
+                continue
+            for key in ("confirmed", "immutable"):
+                if key in flag:
+                    node[key] = flag[key]
+
+        for rename in delta.get("renames", []):
+            node = nodes.get(rename.get("id"))
+            if node is None:
+                continue
+            if "description" in rename:
+                node["description"] = rename["description"]
+            if "intent" in rename and rename["intent"] != node.get("intent"):
+                node["intent"] = rename["intent"]
+                # 顶层意图在 item 中以名称为键
+                for name, top_node in list(self.tree["item"].items()):
+                    if top_node is node:
+                        self.tree["item"] = {
+                            (rename["intent"] if key == name else key): value
+                            for key, value in self.tree["item"].items()
+                        }
+                        break
+        self.touch()
+
+    def touch(self):
+        self.version += 1
+        self.updated_at = time.time()
+
+
+def diff_snapshots(before, after):
+    """两个 snapshot 之间的增量：upserted 为新增或变化的节点，removed 为被删除的节点 id"""
+    return {
+        "upserted": [node for node_id, node in after.items() if before.get(node_id) != node],
+        "removed": [node_id for node_id in before if node_id not in after],
+    }
+
+
+class SessionStore:
+    """按 session id（默认使用 scenario）保存 Session，超过容量或 TTL 时淘汰最久未使用的会话"""
+
+    def __init__(self, max_sessions: int = 256, ttl: float | None = 24 * 3600):
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+
+    def create(self, session_id, scenario, tree=None, records=None) -> Session:
+        session = Session(session_id, scenario, tree, records)
+        with self._lock:
+            self._sessions[session_id] = session
+            self._sessions.move_to_end(session_id)
+            self._evict()
+        return session
+
+    def get(self, session_id) -> Session:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or self._expired(session):
+                self._sessions.pop(session_id, None)
+                raise SessionNotFoundError(f"Unknown session: {session_id}")
+            self._sessions.move_to_end(session_id)
+            return session
+
+    def delete(self, session_id):
+        with self._lock:
+            self._sessions.pop(session_id, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "sessions": len(self._sessions),
+                "max_sessions": self.max_sessions,
+                "records": sum(len(session.records) for session in self._sessions.values()),
+            }
+
+    def _expired(self, session):
+        return self.ttl is not None and time.time() - session.updated_at > self.ttl
+
+    def _evict(self):
+        for session_id in [key for key, session in self._sessions.items() if self._expired(session)]:
+            del self._sessions[session_id]
+        while len(self._sessions) > self.max_sessions:
+            self._sessions.popitem(last=False)
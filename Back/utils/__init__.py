@@ -3,6 +3,18 @@ from pydantic import BaseModel, Field, RootModel, field_validator
 from typing import Literal, Union
 from .utils import *
 from .Prompts import Prompts
+from .baseChain import BaseChain
+from .llmCache import LLMCache
+from .intentTreeBuilder import IntentTreeBuilder, flatten_records
+from .tokenCounter import count_tokens, truncate_tokens, split_tokens, pack_by_token_budget
+from .tokenBudget import PromptBudgetError, TokenMetrics
+from .treeProjection import project_node, project_tree
+from .indexedIntentTree import IndexedIntentTree
+from .recordStore import CompactRecord, RecordStore
+from .fastResponse import FastJSONResponse
+from .promptCompaction import PromptCompactor, extractive_summary
+from .groupCentroids import CentroidCache, GroupCentroids
+from .recordDedup import RecordDeduplicator, expand_clusters
 
 # Define a Pydantic model for individual intents
 class RecordRef(BaseModel):
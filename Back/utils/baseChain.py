@@ -0,0 +1,222 @@
+import asyncio
+import os
+import time
+
+from .tokenBudget import PromptBudgetError, TokenMetrics
+from .tokenCounter import DEFAULT_MODEL, count_tokens, pack_by_token_budget, split_tokens
+
+# 拆分/截断时为列表分隔符、编码边界等留出的余量
+_BUDGET_MARGIN = 32
+
+
+def _merge_parsed(values):
+    """按结构合并多份解析结果：列表拼接，dict 逐键合并，Pydantic 模型合并字段后重新校验，其余取第一份"""
+    first = values[0]
+    if isinstance(first, list):
+        return [item for value in values for item in value]
+    if isinstance(first, dict):
+        merged = {}
+        for value in values:
+            for key, item in value.items():
+                merged.setdefault(key, []).append(item)
+        return {key: _merge_parsed(items) for key, items in merged.items()}
+    if hasattr(first, "model_dump"):
+        return type(first).model_validate(_merge_parsed([value.model_dump() for value in values]))
+    return first
+
+
+def _item_id(item, position):
+    return item["id"] if isinstance(item, dict) and "id" in item else position
+
+
+def _renumber(item, local):
+    return {**item, "id": local} if isinstance(item, dict) and "id" in item else item
+
+
+class BaseChain:
+    """
+    所有 Chain4* 共用的执行入口：渲染 prompt -> 调用模型 -> 解析输出。
+
+    默认通过 ``model.ainvoke`` 走异步路径，LLM 请求期间不会阻塞 uvicorn 的事件循环；
+    设置 ``blocking = True``（或环境变量 ``LLM_BLOCKING_INVOKE=1``）时回退到同步的 ``model.invoke``。
+
+    设置 ``BaseChain.cache`` (LLMCache) 后，相同 prompt 模板、模型、温度和输入的请求直接返回缓存的模型输出；
+    同一时刻相同的请求只会向模型发起一次调用。
+
+    调用模型前先在本地统计渲染后 prompt 的 token 数，超过 ``max_prompt_tokens`` 时按 ``budget_policy`` 处理：
+    - ``raise``：立即抛出 PromptBudgetError，不再发起注定会被模型服务拒绝的请求；
+    - ``truncate``：截断 ``budget_field``（字符串按 token 截断，列表丢弃末尾的元素）；
+    - ``split``：把 ``budget_field`` 拆成若干份分别调用，再由 ``merge_results`` 合并；
+      列表的每一份单独编号，元素的 id（没有 id 时为位置）换成份内的局部索引 0..k-1。
+    每次调用的 prompt/completion token 数记录在 ``BaseChain.metrics`` 中。
+
+    子类需要在 ``__init__`` 中设置 ``self.prompt_template``、``self.model`` 和 ``self.parser``。
+    """
+
+    blocking = os.getenv("LLM_BLOCKING_INVOKE", "0") == "1"
+    cache = None
+    metrics = TokenMetrics()
+
+    max_prompt_tokens = int(os.getenv("PROMPT_TOKEN_BUDGET", "120000")) or None
+    budget_policy = "raise"
+    budget_field = None
+
+    _inflight = {}
+
+    @property
+    def chain_name(self):
+        return type(self).__name__
+
+    def count_prompt_tokens(self, prompt) -> int:
+        return count_tokens(prompt.to_string(), getattr(self.model, "model_name", None) or DEFAULT_MODEL)
+
+    def cache_key(self, prompt):
+        return self.cache.make_key(
+            type(self).__name__,
+            self.prompt_template.template,
+            getattr(self.model, "model_name", None),
+            getattr(self.model, "temperature", None),
+            prompt.to_string(),
+        )
+
+    def merge_results(self, results: list, index_maps: list | None = None):
+        """
+        budget_policy 为 split 时合并各部分的解析结果，默认按结构合并（列表拼接、dict 逐键合并）。
+        结果中引用 budget_field 元素索引的子类需要覆盖：第 i 份结果中的局部索引 j 对应原来的 index_maps[i][j]。
+
+        :param index_maps: budget_field 为列表时每一份的局部索引 -> 原 id 列表，为字符串时是 None
+        """
+        return _merge_parsed(results)
+
+    async def run(self, inputs: dict):
+        prompt = self.prompt_template.format_prompt(**inputs)
+        prompt_tokens = self.count_prompt_tokens(prompt)
+        if self.max_prompt_tokens and prompt_tokens > self.max_prompt_tokens:
+            return await self._run_over_budget(inputs, prompt_tokens)
+        return await self._run_prompt(prompt, prompt_tokens)
+
+    async def _run_prompt(self, prompt, prompt_tokens):
+        if self.cache is None:
+            return self.parser.parse(await self._generate(prompt, prompt_tokens))
+
+        key = self.cache_key(prompt)
+        text = self.cache.get(key)
+        if text is not None:
+            self.metrics.record_cached(self.chain_name)
+            return self.parser.parse(text)
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.metrics.record_cached(self.chain_name)
+            return self.parser.parse(await asyncio.shield(inflight))
+
+        # 模型调用放在独立的任务中，所有请求（包括发起者）都通过 shield 等待：
+        # 某个客户端断开导致其请求被取消时，不会取消其他请求正在等待的同一个调用
+        task = asyncio.ensure_future(self._generate_and_cache(key, prompt, prompt_tokens))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish_inflight(key, done))
+        return self.parser.parse(await asyncio.shield(task))
+
+    async def _generate_and_cache(self, key, prompt, prompt_tokens):
+        text = await self._generate(prompt, prompt_tokens)
+        # 只缓存能被正确解析的输出
+        self.parser.parse(text)
+        self.cache.set(key, text)
+        return text
+
+    def _finish_inflight(self, key, task):
+        self._inflight.pop(key, None)
+        if not task.cancelled():
+            task.exception()  # 避免所有等待者都已取消时出现 "exception was never retrieved"
+
+    def _budget_error(self, prompt_tokens):
+        return PromptBudgetError(
+            f"{self.chain_name}: prompt has {prompt_tokens} tokens, exceeding the budget of {self.max_prompt_tokens} tokens."
+        )
+
+    async def _run_over_budget(self, inputs, prompt_tokens):
+        self.metrics.record_over_budget(self.chain_name)
+        value = inputs.get(self.budget_field) if self.budget_field else None
+        if self.budget_policy not in ("truncate", "split") or not value or not isinstance(value, (str, list, tuple)):
+            raise self._budget_error(prompt_tokens)
+
+        # prompt 中 budget_field 以外部分的 token 数
+        available = self.max_prompt_tokens - (prompt_tokens - count_tokens(value)) - _BUDGET_MARGIN
+        if available <= 0:
+            raise self._budget_error(prompt_tokens)
+
+        index_maps = None
+        if isinstance(value, str):
+            parts = split_tokens(value, available)
+        else:
+            chunks = pack_by_token_budget([count_tokens(item) + 2 for item in value], available)
+            parts = [[value[index] for index in chunk] for chunk in chunks]
+
+        print(f"{self.chain_name}: prompt has {prompt_tokens} tokens (budget {self.max_prompt_tokens}), applying '{self.budget_policy}' to '{self.budget_field}' ({len(parts)} part(s)).")
+        if self.budget_policy == "truncate":
+            return await self._run_part(inputs, parts[0])
+        if not isinstance(value, str):
+            # 每一份重新编号，模型只会看到并返回份内的局部索引
+            index_maps = [[_item_id(value[index], index) for index in chunk] for chunk in chunks]
+            parts = [[_renumber(item, local) for local, item in enumerate(part)] for part in parts]
+        return self.merge_results(await asyncio.gather(*[self._run_part(inputs, part) for part in parts]), index_maps)
+
+    async def _run_part(self, inputs, part):
+        prompt = self.prompt_template.format_prompt(**{**inputs, self.budget_field: part})
+        prompt_tokens = self.count_prompt_tokens(prompt)
+        if prompt_tokens > self.max_prompt_tokens:
+            # 单个元素本身就超出预算
+            raise self._budget_error(prompt_tokens)
+        return await self._run_prompt(prompt, prompt_tokens)
+
+    async def stream_text(self, inputs: dict):
+        """
+        逐段产出模型输出的文本（通过 model.astream）。命中缓存时一次性产出完整文本；
+        完整输出能被 parser 正确解析时写入缓存。流式调用无法拆分，超出预算时直接抛出 PromptBudgetError。
+        """
+        prompt = self.prompt_template.format_prompt(**inputs)
+        prompt_tokens = self.count_prompt_tokens(prompt)
+        if self.max_prompt_tokens and prompt_tokens > self.max_prompt_tokens:
+            self.metrics.record_over_budget(self.chain_name)
+            raise self._budget_error(prompt_tokens)
+
+        key = None
+        if self.cache is not None:
+            key = self.cache_key(prompt)
+            text = self.cache.get(key)
+            if text is not None:
+                self.metrics.record_cached(self.chain_name)
+                yield text
+                return
+
+        start = time.perf_counter()
+        chunks = []
+        async for chunk in self.model.astream(prompt):
+            if chunk.content:
+                chunks.append(chunk.content)
+                yield chunk.content
+
+        text = "".join(chunks)
+        self.metrics.record_call(self.chain_name, prompt_tokens, count_tokens(text), time.perf_counter() - start)
+        if key is not None:
+            try:
+                self.parser.parse(text)
+            except Exception:
+                return
+            self.cache.set(key, text)
+
+    async def _generate(self, prompt, prompt_tokens=0) -> str:
+        start = time.perf_counter()
+        if self.blocking:
+            message = self.model.invoke(prompt)
+        else:
+            message = await self.model.ainvoke(prompt)
+        # 优先使用模型服务返回的用量，没有时使用本地统计
+        usage = getattr(message, "usage_metadata", None) or {}
+        self.metrics.record_call(
+            self.chain_name,
+            usage.get("input_tokens") or prompt_tokens,
+            usage.get("output_tokens") or count_tokens(message.content),
+            time.perf_counter() - start,
+        )
+        return message.content
@@ -0,0 +1,34 @@
+import json
+
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel
+
+try:
+    import orjson
+except ImportError:  # orjson 未安装时退回标准库 json
+    orjson = None
+
+
+def _default(value):
+    """orjson 不认识的类型：嵌套的 Pydantic 模型直接导出为 JSON 兼容的 dict"""
+    if isinstance(value, BaseModel):
+        return value.model_dump(mode="json")
+    if hasattr(value, "tolist"):
+        return value.tolist()
+    raise TypeError(f"Type is not JSON serializable: {type(value).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """
+    大响应（意图树、RAG 结果）的快速序列化：
+    - Pydantic 模型通过 model_dump_json() 直接序列化，不经过中间 dict；
+    - 其他内容用 orjson 一次性编码，跳过 FastAPI 的 jsonable_encoder；
+    - 未安装 orjson 时使用标准库 json。
+    """
+
+    def render(self, content) -> bytes:
+        if isinstance(content, BaseModel):
+            return content.model_dump_json().encode("utf-8")
+        if orjson is not None:
+            return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
+        return json.dumps(content, default=_default, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
@@ -0,0 +1,106 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+
+class GroupCentroids:
+    """
+    一组分组（一个 scenario 或会话）的质心缓存：
+    - 每条记录的单位向量按 id 缓存（内容变化时视为缺失），只有新记录需要重新嵌入；
+    - 每个分组缓存成员集合与向量和，成员变化时只对增减的记录做加减，不重新累加整个分组。
+    """
+
+    def __init__(self):
+        self._vectors = {}
+        self._groups = {}
+
+    def missing(self, records) -> list:
+        """records 为 [(id, content)]，返回没有缓存向量（或内容已变化）的记录"""
+        return [(record_id, content) for record_id, content in records if self._vectors.get(record_id, (None,))[0] != content]
+
+    def add_vectors(self, records, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if len(vectors) == 0:
+            return
+        vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8)
+        for (record_id, content), vector in zip(records, vectors):
+            previous = self._vectors.get(record_id)
+            self._vectors[record_id] = (content, vector)
+            if previous is not None:
+                # 内容变化的记录：已缓存的向量和全部失效
+                for key in [key for key, (members, _) in self._groups.items() if record_id in members]:
+                    del self._groups[key]
+
+    def vector(self, record_id):
+        return self._vectors[record_id][1]
+
+    def centroid(self, key, members):
+        """
+        返回分组 key（成员为 members）的单位质心向量；与上次相比只按成员差异增量更新向量和。
+        """
+        members = set(members)
+        cached_members, total = self._groups.get(key, (set(), None))
+        if total is None:
+            cached_members, total = set(), np.zeros_like(self.vector(next(iter(members))))
+        else:
+            total = total.copy()
+        for record_id in members - cached_members:
+            total += self.vector(record_id)
+        for record_id in cached_members - members:
+            total -= self.vector(record_id)
+        self._groups[key] = (members, total)
+        return total / (np.linalg.norm(total) + 1e-8)
+
+    def nearest(self, record_id, groups):
+        """
+        :param groups: [(key, members)]，空分组会被跳过
+        :return: (与记录余弦相似度最高的分组在 groups 中的下标, 相似度)；没有分组时为 (None, 0.0)
+        """
+        indices = [index for index, (_, members) in enumerate(groups) if members]
+        if not indices:
+            return None, 0.0
+        centroids = np.stack([self.centroid(*groups[index]) for index in indices])
+        similarities = centroids @ self.vector(record_id)
+        best = int(np.argmax(similarities))
+        return indices[best], float(similarities[best])
+
+    def retain(self, keys):
+        """丢弃 keys 以外的分组缓存"""
+        keys = set(keys)
+        for key in [key for key in self._groups if key not in keys]:
+            del self._groups[key]
+
+    def __len__(self):
+        return len(self._vectors)
+
+
+class CentroidCache:
+    """按 scenario / session id 保存 GroupCentroids，超过容量时淘汰最久未使用的"""
+
+    def __init__(self, max_entries: int = 64):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key) -> GroupCentroids:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = GroupCentroids()
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            return entry
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "vectors": sum(len(entry) for entry in self._entries.values()),
+            }
@@ -0,0 +1,161 @@
+from .intentTreeBuilder import flatten_records
+
+
+class IndexedIntentTree:
+    """
+    意图树的索引视图。构造时只遍历一次，建立：
+    - nodes: id -> 节点
+    - parents: id -> 父节点（根节点为 None）
+    - levels: 深度（根为 1）-> 该层节点列表，depths: id -> 深度
+    - names: id -> 顶层节点在 item 中的名称
+    之后的 id 查找、父节点查找都是 O(1)，子树的叶记录列表在第一次查询后缓存。
+
+    节点就是原树中的 dict 对象（不复制）；通过 add() 修改树时索引同步更新。
+    支持 /extract/ 返回的 {"item": {name: node}} 格式，也支持 {"child": [node]} 格式。
+    """
+
+    def __init__(self, tree):
+        tree = tree or {}
+        self.tree = tree
+        self.item = tree.get("item") if isinstance(tree.get("item"), dict) else None
+        self.nodes = {}
+        self.parents = {}
+        self.levels = {}
+        self.depths = {}
+        self.names = {}
+        # 先序遍历顺序：(节点, 父节点, 缺省 level)，缺省 level 用于没有 level 字段的节点
+        self._order = []
+        self._leaf_records = {}
+
+        if self.item is not None:
+            roots = list(self.item.items())
+        else:
+            roots = [(None, node) for node in tree.get("child") or []]
+        for name, node in roots:
+            self._index(node, None, 1, "1")
+            if name is not None:
+                self.names[node.get("id")] = name
+
+    def _index(self, node, parent, depth, default_level):
+        stack = [(node, parent, depth, default_level)]
+        while stack:
+            node, parent, depth, default_level = stack.pop()
+            self._order.append((node, parent, default_level))
+            if "intent" in node:
+                self.nodes[node.get("id")] = node
+                self.parents[node.get("id")] = parent
+                self.levels.setdefault(depth, []).append(node)
+                self.depths[node.get("id")] = depth
+
+            children = node.get("child")
+            if isinstance(children, list) and children:
+                level = node.get("level", default_level)
+                next_level = str(int(level) + 1) if str(level).isdigit() else default_level
+                # 逆序入栈以保持先序遍历顺序
+                stack.extend((child, node, depth + 1, next_level) for child in reversed(children))
+
+    def get(self, node_id):
+        return self.nodes.get(node_id)
+
+    def parent(self, node_id):
+        return self.parents.get(node_id)
+
+    def roots(self):
+        return self.levels.get(1, [])
+
+    def leaf_records(self, node_id) -> list:
+        """节点子树中所有 group 记录（先序、展开嵌套列表），结果会被缓存"""
+        if node_id not in self._leaf_records:
+            records = []
+            stack = [self.nodes[node_id]]
+            while stack:
+                node = stack.pop()
+                records.extend(flatten_records(node.get("group") or []))
+                stack.extend(reversed(node.get("child") or []))
+            self._leaf_records[node_id] = records
+        return self._leaf_records[node_id]
+
+    def confirmed_intents(self) -> list:
+        """所有 immutable 或 confirmed 的意图节点，转换为 Chain4ExtractIntent 使用的格式"""
+        return [
+            {
+                "intent_id": node.get("id"),
+                "intent_name": node.get("intent"),
+                "intent_description": node.get("description", ""),
+                "level": node.get("level", default_level),
+                "parent": node.get("parent", parent.get("id") if parent is not None else None),
+            }
+            for node, parent, default_level in self._order
+            if "intent" in node and (node.get("immutable") or node.get("confirmed"))
+        ]
+
+    def intents_by_level(self, level_control="all", with_id=False) -> list:
+        """
+        与 getIntentsByLevel 相同：
+        - first: 所有顶层意图
+        - second: 每个顶层意图的子意图，没有子意图时使用顶层意图本身
+        - 其他: 顶层意图及其子意图
+
+        :param with_id: 为 True 时每个意图额外带上节点的 "id"
+        """
+        def entry(node, name):
+            intent = {"intent": name, "description": node["description"]}
+            if with_id:
+                intent["id"] = node.get("id")
+            return intent
+
+        intentsDict = []
+        for node in self.roots():
+            name = self.names.get(node.get("id"), node.get("intent"))
+            children = [child for child in node.get("child") or [] if "intent" in child]
+            if level_control != "second" or not children:
+                intentsDict.append(entry(node, name))
+            if level_control != "first":
+                intentsDict.extend(entry(child, child["intent"]) for child in children)
+        return intentsDict
+
+    def next_id(self) -> int:
+        """比树中所有整数 id 都大的下一个 id"""
+        return max((node_id for node_id in self.nodes if isinstance(node_id, int)), default=0) + 1
+
+    def add(self, node, parent_id=None, name=None):
+        """
+        添加一个新节点：parent_id 为 None 时以 name 为键加入顶层 item，否则挂到父节点的 child 中。
+        与 /recommend/ 原来的行为一致，父节点只在顶层节点中查找。
+        节点 id 与树中已有节点重复时改用 next_id()，避免覆盖已有节点的索引。
+        新节点排在 confirmed_intents() 等遍历结果的末尾。
+
+        :return: 父节点；添加的是顶层节点或父节点不存在（此时不做任何修改）时返回 None
+        """
+        if parent_id is not None and self.depths.get(parent_id) != 1:
+            return None
+        if node.get("id") in self.nodes:
+            node["id"] = self.next_id()
+
+        if parent_id is None:
+            if self.item is None:
+                self.tree.setdefault("child", []).append(node)
+            else:
+                self.item[name] = node
+                self.names[node.get("id")] = name
+            self._index(node, None, 1, "1")
+            return None
+
+        parent = self.nodes[parent_id]
+        parent.setdefault("child", []).append(node)
+        level = parent.get("level", "1")
+        self._index(node, parent, 2, str(int(level) + 1) if str(level).isdigit() else "1")
+        self._invalidate(parent)
+        return parent
+
+    def add_record(self, node_id, record):
+        """把记录（或记录 id）加入节点的 group"""
+        node = self.nodes[node_id]
+        node.setdefault("group", []).append(record)
+        self._invalidate(node)
+
+    def _invalidate(self, node):
+        # 节点及其祖先的叶记录缓存失效
+        while node is not None:
+            self._leaf_records.pop(node.get("id"), None)
+            node = self.parents.get(node.get("id"))
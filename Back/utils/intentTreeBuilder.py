@@ -0,0 +1,103 @@
+def flatten_records(records):
+    """处理嵌套的记录数组"""
+    flattened = []
+    for record in records:
+        if isinstance(record, list):
+            flattened.extend(flatten_records(record))
+        else:
+            flattened.append(record)
+    return flattened
+
+
+class IntentTreeBuilder:
+    """
+    把 Chain4ExtractIntent 输出的 IntentNode 列表逐个组装成嵌套的 intentTree。
+
+    每个 add() 立即完成父子链接：父节点已出现时直接挂到父节点的 child 中，
+    否则先记录在 pending 中，等父节点出现时再按原顺序挂上。build() 的结果与一次性构建完全相同。
+
+    传入 store (RecordStore) 时，节点的 records 可以是记录 id，输出的 group 中再展开为记录 dict。
+    """
+
+    def __init__(self, scenario, store=None):
+        self.scenario = scenario
+        self.store = store
+        self.nodes_map = {}
+        self.root_nodes = []
+        self.pending = {}
+
+    def add(self, item: dict) -> dict:
+        """
+        加入一个意图节点（需已带有 records），返回该节点在树中的视图（不含子节点）。
+        """
+        intent_id = item.get("intent_id")
+        parent_id = item.get("parent")
+        node = {
+            "name": item.get("intent_name", f"Intent_{item.get('intent_id', 'unknown')}"),
+            "id": intent_id,
+            "intent": item.get("intent_name", ""),
+            "description": item.get("intent_description", ""),
+            "priority": 5,  # 默认优先级
+            "child_num": 0,
+            "group": flatten_records(item.get("records", [])),
+            "level": item.get("level", "1"),
+            "parent": parent_id,
+            "immutable": True,  # 默认是不可变的
+            "child": [],  # 子节点 id 列表
+        }
+        self.nodes_map[intent_id] = node
+        # 先挂上之前已经到达、等待这个父节点的子节点
+        node["child"].extend(self.pending.pop(intent_id, []))
+
+        if parent_id is None:
+            # 这是根节点
+            self.root_nodes.append(intent_id)
+        elif parent_id in self.nodes_map:
+            # 这是子节点，添加到父节点的child中
+            self.nodes_map[parent_id]["child"].append(intent_id)
+        else:
+            self.pending.setdefault(parent_id, []).append(intent_id)
+
+        return self._node_view(node)
+
+    def build(self) -> dict:
+        # 转换为嵌套的 intentTree 格式
+        intentTree = {
+            "scenario": self.scenario,
+            "item": {}
+        }
+        # 将根节点添加到intentTree中
+        for root_id in self.root_nodes:
+            node_data = self.nodes_map[root_id]
+            intentTree["item"][node_data["name"]] = self._node_view(node_data)
+            # 添加子节点到根节点
+            self._add_children(intentTree["item"][node_data["name"]], node_data["child"])
+        return intentTree
+
+    def _add_children(self, parent_node, child_ids):
+        # 递归添加子节点
+        for child_id in child_ids:
+            if child_id in self.nodes_map:
+                child_data = self.nodes_map[child_id]
+                child_node = self._node_view(child_data)
+                parent_node["child"].append(child_node)
+                parent_node["child_num"] += 1
+                parent_node["group"] = []  # 父节点有子节点时，清空group
+
+                # 递归添加子节点的子节点
+                if child_data["child"]:
+                    self._add_children(child_node, child_data["child"])
+
+    def _node_view(self, node_data):
+        return {
+            "id": node_data["id"],
+            "intent": node_data["intent"],
+            "description": node_data["description"],
+            "priority": node_data["priority"],
+            "child_num": node_data["child_num"],
+            "group": self.store.expand(node_data["group"]) if self.store is not None else node_data["group"],
+            "level": node_data["level"],
+            "parent": node_data["parent"],
+            "immutable": node_data["immutable"],
+            "child": []
+        }
@@ -0,0 +1,138 @@
+import re
+from collections import Counter
+
+from .tokenCounter import DEFAULT_MODEL, count_tokens, truncate_tokens
+
+_sentence_pattern = re.compile(r"[^。！？!?.\n]+[。！？!?.\n]*")
+_term_pattern = re.compile(r"[\u4e00-\u9fff]|\w+")
+
+
+def extractive_summary(text: str, max_tokens: int, model_name: str = DEFAULT_MODEL) -> str:
+    """
+    抽取式摘要：按词频给每个句子打分，在 max_tokens 以内保留得分最高的句子（保持原文顺序）。
+    只有一个句子或任何句子都放不下时退回到截断。
+    """
+    sentences = [sentence.strip() for sentence in _sentence_pattern.findall(text) if sentence.strip()]
+    if len(sentences) <= 1:
+        return truncate_tokens(text, max_tokens, model_name)
+
+    frequencies = Counter(term.lower() for term in _term_pattern.findall(text))
+    scored = []
+    for index, sentence in enumerate(sentences):
+        terms = [term.lower() for term in _term_pattern.findall(sentence)]
+        score = sum(frequencies[term] for term in terms) / len(terms) if terms else 0
+        scored.append((score, index))
+
+    selected, used = [], 0
+    for score, index in sorted(scored, key=lambda item: (-item[0], item[1])):
+        tokens = count_tokens(sentences[index], model_name)
+        if used + tokens <= max_tokens:
+            selected.append(index)
+            used += tokens
+    if not selected:
+        return truncate_tokens(sentences[0], max_tokens, model_name)
+    return " ".join(sentences[index] for index in sorted(selected))
+
+
+class PromptCompactor:
+    """
+    在记录进入 prompt 之前压缩它们，不改变记录的 id 与分组结构（输出的索引映射保持不变）：
+    - content / comment 超过 max_record_tokens、context 超过 max_context_tokens 时截断，
+      或在 summarize=True 时替换为抽取式摘要；
+    - 同一个 prompt 中重复出现的 context 只保留第一次，之后替换为 "same as record <id>"。
+
+    每次压缩返回节省的 token 数，stats() 返回累计值。enabled=False 时原样返回输入。
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        max_record_tokens: int | None = 200,
+        max_context_tokens: int | None = 300,
+        summarize: bool = False,
+        model_name: str = DEFAULT_MODEL,
+    ):
+        self.enabled = enabled
+        self.max_record_tokens = max_record_tokens
+        self.max_context_tokens = max_context_tokens
+        self.summarize = summarize
+        self.model_name = model_name
+        self._compactions = 0
+        self._tokens_before = 0
+        self._tokens_after = 0
+
+    def compact_text(self, text, max_tokens):
+        if not isinstance(text, str) or not max_tokens or count_tokens(text, self.model_name) <= max_tokens:
+            return text
+        if self.summarize:
+            return extractive_summary(text, max_tokens, self.model_name)
+        return truncate_tokens(text, max_tokens, self.model_name) + "…"
+
+    def compact_record(self, record, seen_contexts):
+        compacted = dict(record)
+        for key in ("content", "comment"):
+            if key in compacted:
+                compacted[key] = self.compact_text(compacted[key], self.max_record_tokens)
+        context = compacted.get("context")
+        if isinstance(context, str) and context:
+            if context in seen_contexts and seen_contexts[context] != compacted.get("id"):
+                compacted["context"] = f"same as record {seen_contexts[context]}"
+            else:
+                seen_contexts.setdefault(context, compacted.get("id"))
+                compacted["context"] = self.compact_text(context, self.max_context_tokens)
+        return compacted
+
+    def compact_records(self, records, seen_contexts=None):
+        """压缩记录列表（支持嵌套列表），seen_contexts 在同一个 prompt 内共享"""
+        if seen_contexts is None:
+            seen_contexts = {}
+        return [
+            self.compact_records(record, seen_contexts) if isinstance(record, list)
+            else self.compact_record(record, seen_contexts) if isinstance(record, dict)
+            else record
+            for record in records
+        ]
+
+    def compact_groups(self, groupsOfNodes):
+        """
+        压缩 Chain4ExtractIntent 的 groupsOfNodes。
+
+        :return: (压缩后的 groupsOfNodes, 节省的 token 数)
+        """
+        if not self.enabled:
+            return groupsOfNodes, 0
+        seen_contexts = {}
+        compacted = [
+            {**group, "records": self.compact_records(group.get("records", []), seen_contexts)} if isinstance(group, dict) else group
+            for group in groupsOfNodes
+        ]
+        return compacted, self._record(groupsOfNodes, compacted)
+
+    def compact_contents(self, contents):
+        """
+        压缩 Chain4Grouping 的 [{"id", "content"}] 列表。
+
+        :return: (压缩后的列表, 节省的 token 数)
+        """
+        if not self.enabled:
+            return contents, 0
+        compacted = [{**item, "content": self.compact_text(item["content"], self.max_record_tokens)} for item in contents]
+        return compacted, self._record(contents, compacted)
+
+    def _record(self, original, compacted):
+        # 与 PromptTemplate 渲染列表时一样使用 str()
+        before = count_tokens(original, self.model_name)
+        after = before if compacted == original else count_tokens(compacted, self.model_name)
+        self._compactions += 1
+        self._tokens_before += before
+        self._tokens_after += after
+        return before - after
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "compactions": self._compactions,
+            "tokens_before": self._tokens_before,
+            "tokens_after": self._tokens_after,
+            "tokens_saved": self._tokens_before - self._tokens_after,
+        }
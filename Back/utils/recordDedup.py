@@ -0,0 +1,185 @@
+import threading
+import zlib
+
+import numpy as np
+
+# MinHash 使用的素数（2^31 - 1），a * h + b 不会超出 uint64
+_PRIME = (1 << 31) - 1
+
+
+def normalize_text(text) -> str:
+    """小写并合并空白，用于精确去重与 shingling"""
+    return " ".join(str(text or "").lower().split())
+
+
+def shingles(text: str, size: int) -> set:
+    """字符级 shingle（对中文同样适用），短于 size 的文本整体作为一个 shingle"""
+    if len(text) <= size:
+        return {text}
+    return {text[start:start + size] for start in range(len(text) - size + 1)}
+
+
+class RecordDeduplicator:
+    """
+    在记录进入 prompt 之前合并完全相同和近似重复的记录：
+
+    - 完全相同：规范化（小写、合并空白）后的内容相同；
+    - 近似重复：字符 shingle 的 MinHash 签名经 LSH 分桶找到候选，再以签名估计的 Jaccard 相似度
+      >= threshold 判定。每条记录只与各簇的代表（最先出现的记录）比较，不会沿着相似链条越并越大。
+
+    每个簇的代表进入 prompt，模型输出中的代表再展开回簇内所有记录。stats() 返回累计的压缩比。
+    """
+
+    def __init__(
+        self,
+        enabled: bool = True,
+        threshold: float = 0.8,
+        num_perm: int = 64,
+        bands: int = 16,
+        shingle_size: int = 5,
+        seed: int = 1,
+    ):
+        assert num_perm % bands == 0, "num_perm must be divisible by bands."
+        self.enabled = enabled
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(seed)
+        self._a = rng.randint(1, _PRIME, size=(num_perm, 1)).astype(np.uint64)
+        self._b = rng.randint(0, _PRIME, size=(num_perm, 1)).astype(np.uint64)
+        self._lock = threading.Lock()
+        self._calls = 0
+        self._records_in = 0
+        self._records_out = 0
+
+    def signature(self, text: str) -> np.ndarray:
+        hashes = np.fromiter(
+            (zlib.crc32(shingle.encode("utf-8")) % _PRIME for shingle in shingles(text, self.shingle_size)),
+            dtype=np.uint64,
+        )
+        return ((self._a * hashes + self._b) % _PRIME).min(axis=1)
+
+    def clusters(self, texts, scopes=None) -> list:
+        """
+        :param texts: 文本列表
+        :param scopes: 可选，与 texts 等长；只有 scope 相同的文本才可能进入同一个簇
+        :return: 簇列表，每个簇为 texts 中的索引列表，第一个为代表；簇按代表出现的顺序排列
+        """
+        rows = self.num_perm // self.bands
+        clusters = []
+        exact = {}
+        buckets = {}
+        # 各簇代表的签名
+        signatures = []
+        for index, text in enumerate(texts):
+            scope = scopes[index] if scopes is not None else None
+            text = normalize_text(text)
+            if (scope, text) in exact:
+                clusters[exact[(scope, text)]].append(index)
+                continue
+
+            signature = self.signature(text)
+            keys = [(scope, band, signature[band * rows:(band + 1) * rows].tobytes()) for band in range(self.bands)]
+            target = None
+            for cluster_index in dict.fromkeys(cluster_index for key in keys for cluster_index in buckets.get(key, [])):
+                if np.mean(signatures[cluster_index] == signature) >= self.threshold:
+                    target = cluster_index
+                    break
+            if target is not None:
+                clusters[target].append(index)
+                exact[(scope, text)] = target
+                continue
+
+            # 新的簇：该记录成为代表
+            exact[(scope, text)] = len(clusters)
+            signatures.append(signature)
+            for key in keys:
+                buckets.setdefault(key, []).append(len(clusters))
+            clusters.append([index])
+        self._record(len(texts), len(clusters))
+        return clusters
+
+    def dedup_contents(self, contents):
+        """
+        合并 Chain4Grouping 的 [{"id", "content"}] 列表。
+
+        :return: (代表组成的列表（id 重新编号为 0..k-1）, 簇列表（contents 中的索引）)
+        """
+        if not self.enabled:
+            return contents, [[index] for index in range(len(contents))]
+        clusters = self.clusters([item["content"] for item in contents])
+        return [{**contents[cluster[0]], "id": idx} for idx, cluster in enumerate(clusters)], clusters
+
+    def dedup_groups(self, groupsOfNodes):
+        """
+        合并 Chain4ExtractIntent 的 groupsOfNodes：同一个（子）分组中属于同一簇的记录只保留第一条。
+        prompt 中同时包含 comment 与 context，只有二者（规范化后）都相同的记录才会按内容合并，
+        用户的批注不会因为内容相近而丢失。
+        Chain4ExtractIntent 的输出按分组顺序映射回原始记录，因此不需要展开。
+
+        :return: (合并后的 groupsOfNodes, 原始记录数, 合并后的记录数)
+        """
+        records = {}
+
+        def collect(items):
+            for item in items:
+                if isinstance(item, list):
+                    collect(item)
+                elif isinstance(item, dict):
+                    records.setdefault(item.get("id"), item)
+
+        for group in groupsOfNodes:
+            if isinstance(group, dict):
+                collect(group.get("records", []))
+        if not self.enabled or not records:
+            return groupsOfNodes, len(records), len(records)
+
+        ids = list(records)
+        clusters = self.clusters(
+            [records[record_id].get("content") for record_id in ids],
+            [(normalize_text(records[record_id].get("comment")), normalize_text(records[record_id].get("context"))) for record_id in ids],
+        )
+        representative = {ids[index]: cluster_index for cluster_index, cluster in enumerate(clusters) for index in cluster}
+
+        def dedup(items):
+            kept, seen = [], set()
+            for item in items:
+                if isinstance(item, list):
+                    kept.append(dedup(item))
+                elif isinstance(item, dict):
+                    cluster_index = representative[item.get("id")]
+                    if cluster_index not in seen:
+                        seen.add(cluster_index)
+                        kept.append(item)
+                else:
+                    kept.append(item)
+            return kept
+
+        deduped = [
+            {**group, "records": dedup(group.get("records", []))} if isinstance(group, dict) else group
+            for group in groupsOfNodes
+        ]
+        return deduped, len(ids), len(clusters)
+
+    def _record(self, records_in, records_out):
+        with self._lock:
+            self._calls += 1
+            self._records_in += records_in
+            self._records_out += records_out
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "calls": self._calls,
+                "records_in": self._records_in,
+                "records_out": self._records_out,
+                "compression_ratio": self._records_in / self._records_out if self._records_out else 1.0,
+            }
+
+
+def expand_clusters(indices, clusters) -> list:
+    """代表的索引 -> 簇内所有成员的索引（忽略越界的索引）"""
+    return [member for index in indices if 0 <= index < len(clusters) for member in clusters[index]]
@@ -0,0 +1,121 @@
+class CompactRecord:
+    """
+    一条记录的紧凑表示：固定字段用 __slots__ 保存，其余字段放在 extra 中，
+    keys 记录原始字段顺序，保证 to_dict() 与输入的 dict / Record.model_dump() 完全一致。
+    """
+
+    __slots__ = ("id", "content", "context", "comment", "isLeafNode", "extra", "keys")
+
+    FIELDS = ("id", "content", "context", "comment", "isLeafNode")
+
+    def __init__(self, keys, values):
+        self.keys = keys
+        self.extra = None
+        for key, value in zip(keys, values):
+            if key in self.FIELDS:
+                setattr(self, key, value)
+            else:
+                if self.extra is None:
+                    self.extra = {}
+                self.extra[key] = value
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            return getattr(self, key, default)
+        return (self.extra or {}).get(key, default)
+
+    def to_dict(self) -> dict:
+        return {key: self.get(key) for key in self.keys}
+
+
+class RecordStore:
+    """
+    按 id 索引的记录表。分组和意图树节点中只保存记录 id，只在序列化时展开为 dict，
+    因此同一条记录无论被多少个分组或节点引用，内存中都只有一份。
+
+    字符串字段在表内去重（同一网页的多条记录通常共享相同的 context），
+    使用表内的字典而不是 sys.intern，表被释放时字符串也随之释放。
+    """
+
+    def __init__(self, records=None):
+        self._records = {}
+        self._strings = {}
+        self._keys = {}
+        self._expanded = {}
+        for record in records or []:
+            self.add(record)
+
+    def __len__(self):
+        return len(self._records)
+
+    def __contains__(self, record_id):
+        return record_id in self._records
+
+    def __iter__(self):
+        return iter(self._records)
+
+    def _intern(self, value):
+        if isinstance(value, str):
+            return self._strings.setdefault(value, value)
+        return value
+
+    def add(self, record):
+        """
+        加入一条记录（dict 或 Pydantic 模型），已存在相同 id 时覆盖，返回记录 id。
+        """
+        if isinstance(record, dict):
+            keys, values = tuple(record), record.values()
+        else:
+            # 直接读取模型字段，不经过 model_dump() 生成中间 dict
+            keys = tuple(type(record).model_fields)
+            values = [getattr(record, key) for key in keys]
+        keys = self._keys.setdefault(keys, keys)
+        compact = CompactRecord(keys, [self._intern(value) for value in values])
+        self._records[compact.id] = compact
+        self._expanded.pop(compact.id, None)
+        return compact.id
+
+    def ref(self, record):
+        """
+        记录 -> id：已经是 id 时原样返回。同一条记录可以被多次引用；
+        id 已存在但内容不同时抛出 ValueError，不静默丢弃任何一条。
+        """
+        if isinstance(record, list):
+            return [self.ref(item) for item in record]
+        if isinstance(record, dict) or hasattr(record, "model_dump"):
+            record_id = record["id"] if isinstance(record, dict) else record.id
+            if record_id not in self._records:
+                self.add(record)
+            elif self.as_dict(record_id) != (record if isinstance(record, dict) else record.model_dump()):
+                raise ValueError(f"Different records share the id {record_id!r}.")
+            return record_id
+        return record
+
+    def get(self, record_id) -> CompactRecord:
+        return self._records[record_id]
+
+    def remove(self, record_id):
+        self._records.pop(record_id, None)
+        self._expanded.pop(record_id, None)
+
+    def as_dict(self, record_id) -> dict:
+        """展开为 dict；同一条记录只展开一次，多个引用共享同一个 dict"""
+        expanded = self._expanded.get(record_id)
+        if expanded is None:
+            expanded = self._expanded[record_id] = self._records[record_id].to_dict()
+        return expanded
+
+    def expand(self, refs) -> list:
+        """记录 id 列表（可嵌套）-> 记录 dict 列表，未知的 id 抛出 KeyError"""
+        expanded = []
+        for ref in refs:
+            if isinstance(ref, list):
+                expanded.append(self.expand(ref))
+            elif isinstance(ref, dict):
+                expanded.append(ref)
+            elif ref in self._records:
+                expanded.append(self.as_dict(ref))
+            else:
+                # 引用了表中不存在的记录：直接报错，不静默丢弃
+                raise KeyError(f"Unknown record id: {ref!r}")
+        return expanded
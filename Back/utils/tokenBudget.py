@@ -0,0 +1,59 @@
+import threading
+from collections import deque
+
+
+class PromptBudgetError(ValueError):
+    """渲染后的 prompt 超出了 chain 的 token 预算，且无法通过截断或拆分处理"""
+
+
+class TokenMetrics:
+    """
+    按 chain 汇总每次模型调用的 prompt/completion token 数。
+
+    prompt_tokens 优先使用模型返回的 usage_metadata，没有时使用本地统计；
+    命中缓存的调用只计入 cached_calls。
+    """
+
+    def __init__(self, recent: int = 100):
+        self._lock = threading.Lock()
+        self._chains = {}
+        self._recent = deque(maxlen=recent)
+
+    def _chain(self, chain):
+        return self._chains.setdefault(chain, {
+            "calls": 0,
+            "cached_calls": 0,
+            "prompt_tokens": 0,
+            "completion_tokens": 0,
+            "max_prompt_tokens": 0,
+            "over_budget": 0,
+        })
+
+    def record_call(self, chain, prompt_tokens, completion_tokens, seconds):
+        with self._lock:
+            stats = self._chain(chain)
+            stats["calls"] += 1
+            stats["prompt_tokens"] += prompt_tokens
+            stats["completion_tokens"] += completion_tokens
+            stats["max_prompt_tokens"] = max(stats["max_prompt_tokens"], prompt_tokens)
+            self._recent.append({
+                "chain": chain,
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "seconds": round(seconds, 3),
+            })
+
+    def record_cached(self, chain):
+        with self._lock:
+            self._chain(chain)["cached_calls"] += 1
+
+    def record_over_budget(self, chain):
+        with self._lock:
+            self._chain(chain)["over_budget"] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "chains": {chain: dict(stats) for chain, stats in self._chains.items()},
+                "recent": list(self._recent),
+            }
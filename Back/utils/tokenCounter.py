@@ -0,0 +1,77 @@
+import re
+from functools import lru_cache
+
+import tiktoken
+
+DEFAULT_MODEL = "gpt-4o"
+
+
+class _ApproxEncoding:
+    """
+    tiktoken 的 BPE 文件无法下载（离线部署）时的近似分词：
+    每个汉字、标点各算一个 token，其余单词按每 4 个字符一个 token 计算。decode 可以无损还原。
+    """
+
+    _pattern = re.compile(r"\s*(?:[\u4e00-\u9fff]|\w{1,4}|[^\w\s])|\s+")
+
+    def encode(self, text, disallowed_special=()):
+        return self._pattern.findall(text)
+
+    def decode(self, tokens):
+        return "".join(tokens)
+
+
+@lru_cache(maxsize=8)
+def _get_encoding(model_name: str):
+    try:
+        try:
+            return tiktoken.encoding_for_model(model_name)
+        except KeyError:
+            return tiktoken.get_encoding("o200k_base")
+    except Exception as e:
+        print(f"Failed to load tiktoken encoding, falling back to approximate token counts: {str(e)[:200]}")
+        return _ApproxEncoding()
+
+
+def count_tokens(text, model_name: str = DEFAULT_MODEL) -> int:
+    """在本地统计文本的 token 数，非字符串会先转换为 str（与 PromptTemplate 渲染时一致）。"""
+    if not isinstance(text, str):
+        text = str(text)
+    return len(_get_encoding(model_name).encode(text, disallowed_special=()))
+
+
+def truncate_tokens(text: str, max_tokens: int, model_name: str = DEFAULT_MODEL) -> str:
+    """截断到最多 max_tokens 个 token"""
+    encoding = _get_encoding(model_name)
+    tokens = encoding.encode(text, disallowed_special=())
+    if len(tokens) <= max_tokens:
+        return text
+    return encoding.decode(tokens[:max_tokens])
+
+
+def pack_by_token_budget(token_counts: list, budget: int) -> list:
+    """
+    按顺序把条目装入若干个块，每块的 token 总数不超过 budget（单个条目超出 budget 时独占一块）。
+
+    :param token_counts: 每个条目的 token 数
+    :param budget: 每块的 token 上限
+    :return: 每块包含的条目索引列表
+    """
+    chunks = []
+    current, used = [], 0
+    for index, tokens in enumerate(token_counts):
+        if current and used + tokens > budget:
+            chunks.append(current)
+            current, used = [], 0
+        current.append(index)
+        used += tokens
+    if current:
+        chunks.append(current)
+    return chunks
+
+
+def split_tokens(text: str, max_tokens: int, model_name: str = DEFAULT_MODEL) -> list:
+    """按 token 把文本切成若干段，每段最多 max_tokens 个 token"""
+    encoding = _get_encoding(model_name)
+    tokens = encoding.encode(text, disallowed_special=())
+    return [encoding.decode(tokens[start:start + max_tokens]) for start in range(0, len(tokens), max_tokens)] or [text]
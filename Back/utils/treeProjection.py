@@ -0,0 +1,40 @@
+RECORD_FIELDS = ("group", "records")
+
+
+def project_node(node, record_fields=RECORD_FIELDS):
+    """
+    意图节点面向 LLM 的投影：记录字段替换为空列表，子节点递归投影，其余字段与原节点共享（不复制）。
+
+    只新建 dict/list 结构，不会复制任何记录正文，因此代价与意图节点数成正比，与记录数量和大小无关。
+    投影与原树共享字段值，调用方不能原地修改投影中的值。
+
+    :param node: 意图节点（含 child 列表）
+    :param record_fields: 需要清空的记录字段
+    :return: 键顺序与原节点相同的新 dict
+    """
+    projected = {}
+    for key, value in node.items():
+        if key in record_fields:
+            projected[key] = []
+        elif key == "child" and isinstance(value, list):
+            projected[key] = [project_node(child, record_fields) if isinstance(child, dict) else child for child in value]
+        else:
+            projected[key] = value
+    return projected
+
+
+def project_tree(tree, record_fields=RECORD_FIELDS):
+    """
+    整棵意图树（{"item": {name: node}} 或 {"child": [node]}）的投影，其余顶层字段原样共享。
+    """
+    projected = dict(tree)
+    if isinstance(tree.get("item"), dict):
+        projected["item"] = {name: project_node(node, record_fields) for name, node in tree["item"].items()}
+    if isinstance(tree.get("child"), list):
+        projected["child"] = [project_node(child, record_fields) if isinstance(child, dict) else child for child in tree["child"]]
+    if isinstance(tree.get("groupsOfNodes"), list):
+        projected["groupsOfNodes"] = [
+            {**group, "records": []} if isinstance(group, dict) and "records" in group else group
+            for group in tree["groupsOfNodes"]
+        ]
+    return projected
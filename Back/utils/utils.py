@@ -1,3 +1,5 @@
+import asyncio
+import json
 import re
 import numpy as np
 
@@ -69,6 +71,40 @@ def cosine_similarity(vec1, vec2):
     return dot_product / (norm_vec1 * norm_vec2 + 1e-8)  # 避免除以零
 
 
+def top_m_by_similarity(query_vectors, candidate_vectors, top_m, threshold=None):
+    """
+    计算 query×candidate 的余弦相似度矩阵（一次矩阵乘法），为每个 query 选出最相似的 top_m 个候选。
+
+    :param query_vectors: (q, d) 向量
+    :param candidate_vectors: (c, d) 向量
+    :param top_m: 每个 query 保留的候选数
+    :param threshold: 相似度下限，低于该值的候选不保留
+    :return: 每个 query 对应的候选索引列表（按相似度从高到低）
+    """
+    queries = np.asarray(query_vectors, dtype=np.float32)
+    candidates = np.asarray(candidate_vectors, dtype=np.float32)
+    if len(queries) == 0 or len(candidates) == 0:
+        return [[] for _ in range(len(queries))]
+
+    queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-8)
+    candidates = candidates / (np.linalg.norm(candidates, axis=1, keepdims=True) + 1e-8)
+    similarities = queries @ candidates.T
+
+    top_m = min(top_m, similarities.shape[1])
+    top_indices = np.argpartition(-similarities, top_m - 1, axis=1)[:, :top_m]
+    top_scores = np.take_along_axis(similarities, top_indices, axis=1)
+    order = np.argsort(-top_scores, axis=1)
+    top_indices = np.take_along_axis(top_indices, order, axis=1)
+    top_scores = np.take_along_axis(top_scores, order, axis=1)
+
+    result = []
+    for indices, scores in zip(top_indices, top_scores):
+        if threshold is not None:
+            indices = indices[scores >= threshold]
+        result.append(indices.tolist())
+    return result
+
+
 def get_intent_records(intentTree, intent):
     """
     获取指定 intent 的所有叶节点记录，递归遍历所有层级（除叶节点外）。
@@ -111,24 +147,71 @@ def get_intent_records(intentTree, intent):
     return traverse_and_match(intentTree)
 
 def merge_dicts(data):
+    """
+    合并多个块的 {"top_k": {intent: [...]}, "bottom_k": {intent: [...]}} 结果。
+    按块顺序、块内顺序保留首次出现的元素并去重，总耗时与元素总数成线性关系，结果确定。
+    元素可以是句子索引或句子文本。
+    """
     merged_dict = {"top_k": {}, "bottom_k": {}}
 
     for item in data:
-        # 合并 top_k
-        for key, value in item["top_k"].items():
-            if key not in merged_dict["top_k"]:
-                merged_dict["top_k"][key] = []
-            merged_dict["top_k"][key].extend(value)
-            merged_dict["top_k"][key] = list(set(merged_dict["top_k"][key]))
-
-        # 合并 bottom_k
-        for key, value in item["bottom_k"].items():
-            if key not in merged_dict["bottom_k"]:
-                merged_dict["bottom_k"][key] = []
-            merged_dict["bottom_k"][key].extend(value)
-            merged_dict["bottom_k"][key] = list(set(merged_dict["bottom_k"][key]))
-
-    return merged_dict
+        for field in ("top_k", "bottom_k"):
+            for key, value in item[field].items():
+                # dict 作为有序集合：键保持插入顺序，重复元素只保留第一次
+                merged_dict[field].setdefault(key, {}).update(dict.fromkeys(value))
+
+    return {
+        field: {key: list(values) for key, values in merged.items()}
+        for field, merged in merged_dict.items()
+    }
+
+
+def merge_grouped_indices(dicts):
+    """
+    合并多个 {分组名: [索引]} 字典：同名分组的索引按出现顺序拼接并去重。
+    用于把拆分后多次调用的分组/RAG 结果合并成一份。
+    """
+    merged = {}
+    for item in dicts:
+        for key, value in item.items():
+            merged.setdefault(key, {}).update(dict.fromkeys(value))
+    return {key: list(values) for key, values in merged.items()}
+
+
+def remap_indices(grouped, index_map):
+    """
+    把 {分组名: [局部索引]} 中的索引换算为 index_map[局部索引]，越界或不是整数的索引被忽略。
+    用于拆分后的调用：每一份以局部索引 0..k-1 提交给模型，合并前换算回原来的索引。
+    """
+    return {
+        key: [index_map[i] for i in value if isinstance(i, int) and not isinstance(i, bool) and 0 <= i < len(index_map)]
+        for key, value in grouped.items()
+    }
+
+
+async def gather_with_concurrency(limit, *aws):
+    """
+    与 asyncio.gather 相同，按输入顺序返回结果，但同一时刻最多只有 limit 个任务在执行。
+
+    :param limit: 最大并发数，<= 0 表示不限制
+    :param aws: 待执行的协程
+    :return: 与 aws 顺序一致的结果列表
+    """
+    if limit <= 0:
+        return await asyncio.gather(*aws)
+
+    semaphore = asyncio.Semaphore(limit)
+
+    async def run(aw):
+        async with semaphore:
+            return await aw
+
+    return await asyncio.gather(*[run(aw) for aw in aws])
+
+
+def sse_event(event, data):
+    """格式化一条 server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
 
 
 def getIntentsByLevel(intentTreeItem, level_control="all"):
@@ -0,0 +1,271 @@
+import bisect
+import hashlib
+import json
+import os
+import shutil
+import threading
+from collections import OrderedDict
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # 未安装 faiss 时用 numpy 做精确检索
+    faiss = None
+
+
+def text_hash(text) -> str:
+    return hashlib.sha1((text or "").encode("utf-8")).hexdigest()
+
+
+class VectorIndex:
+    """
+    一类对象（记录或意图）的向量索引。向量入库前归一化，检索按内积排序，分数即余弦相似度。
+
+    - 向量按行追加保存，删除只打标记，被删除的行多于存活行时再压缩；
+    - 每个 key 保存文本哈希，missing() 只返回新增或文本变化的条目，已入库的向量不会被重新嵌入；
+    - 安装了 faiss 时检索走 faiss.IndexFlatIP（与存储逐行对应，只增量加入新行），否则用 numpy 矩阵乘法；
+    - snapshot() 把向量保存为 vectors.npy、key 与哈希保存为 meta.json；
+      restore() 以内存映射方式打开 vectors.npy，不需要把整个索引读入内存。
+    """
+
+    def __init__(self, dim=None):
+        self.dim = dim
+        # 向量块：restore 后第一个块是内存映射，之后追加的向量合并为新的块
+        self._blocks = []
+        self._offsets = []
+        self._pending = []
+        # 行 -> key（已删除为 None），key -> 行，key -> 文本哈希
+        self._keys = []
+        self._rows = {}
+        self._hashes = {}
+        self._faiss = None
+        self._faiss_rows = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def missing(self, items) -> list:
+        """items 为 [(key, text)]，返回索引中没有或文本已变化的条目"""
+        with self._lock:
+            return [(key, text) for key, text in items if self._hashes.get(key) != text_hash(text)]
+
+    def add(self, items, vectors):
+        """加入或更新 [(key, text)] 及对应的向量"""
+        if not items:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(items), -1)
+        # 同一批中重复的 key 只保留最后一个
+        latest = {key: position for position, (key, _) in enumerate(items)}
+        positions = sorted(latest.values())
+        vectors = vectors[positions]
+        vectors = vectors / (np.linalg.norm(vectors, axis=1, keepdims=True) + 1e-8)
+        with self._lock:
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            self._remove(latest)
+            for position in positions:
+                key, text = items[position]
+                self._rows[key] = len(self._keys)
+                self._keys.append(key)
+                self._hashes[key] = text_hash(text)
+            self._pending.append(vectors)
+
+    def remove(self, keys):
+        with self._lock:
+            self._remove(keys)
+            if len(self._keys) - len(self._rows) > max(len(self._rows), 64):
+                self._compact()
+
+    def _remove(self, keys):
+        for key in keys:
+            row = self._rows.pop(key, None)
+            if row is not None:
+                self._keys[row] = None
+                self._hashes.pop(key, None)
+
+    def _flush(self):
+        """把待加入的向量合并为一个块；块太多时全部合并"""
+        if self._pending:
+            self._offsets.append(sum(len(block) for block in self._blocks))
+            self._blocks.append(np.vstack(self._pending))
+            self._pending = []
+            if len(self._blocks) > 8:
+                self._blocks, self._offsets = [np.vstack(self._blocks)], [0]
+        return self._blocks
+
+    def _row_vector(self, row):
+        index = bisect.bisect_right(self._offsets, row) - 1
+        return self._blocks[index][row - self._offsets[index]]
+
+    def vectors(self, keys) -> np.ndarray:
+        """key -> 单位向量，返回 (len(keys), dim) 的数组；不存在的 key 抛出 KeyError"""
+        with self._lock:
+            self._flush()
+            result = np.zeros((len(keys), self.dim or 0), dtype=np.float32)
+            for i, key in enumerate(keys):
+                result[i] = self._row_vector(self._rows[key])
+            return result
+
+    def search(self, queries, k: int = 5) -> list:
+        """
+        :param queries: (q, d) 查询向量
+        :return: 每个查询的 [(key, 相似度)]，按相似度从高到低，最多 k 个
+        """
+        queries = np.asarray(queries, dtype=np.float32).reshape(-1, self.dim or np.shape(queries)[-1])
+        queries = queries / (np.linalg.norm(queries, axis=1, keepdims=True) + 1e-8)
+        with self._lock:
+            if not self._rows or k <= 0:
+                return [[] for _ in range(len(queries))]
+            blocks = self._flush()
+            # 多取被删除的行数，过滤后仍能凑够 k 个
+            fetch = min(len(self._keys), k + len(self._keys) - len(self._rows))
+            if faiss is not None:
+                scores, rows = self._faiss_index().search(np.ascontiguousarray(queries), fetch)
+            else:
+                similarities = np.hstack([queries @ block.T for block in blocks])
+                rows = np.argpartition(-similarities, fetch - 1, axis=1)[:, :fetch]
+                scores = np.take_along_axis(similarities, rows, axis=1)
+                order = np.argsort(-scores, axis=1)
+                rows = np.take_along_axis(rows, order, axis=1)
+                scores = np.take_along_axis(scores, order, axis=1)
+
+            results = []
+            for row_list, score_list in zip(rows, scores):
+                hits = []
+                for row, score in zip(row_list, score_list):
+                    key = self._keys[row] if row >= 0 else None
+                    if key is not None:
+                        hits.append((key, float(score)))
+                        if len(hits) == k:
+                            break
+                results.append(hits)
+            return results
+
+    def _faiss_index(self):
+        if self._faiss is None:
+            self._faiss, self._faiss_rows = faiss.IndexFlatIP(self.dim), 0
+        # 只把上次之后追加的行加入 faiss
+        for offset, block in zip(self._offsets, self._blocks):
+            if offset + len(block) > self._faiss_rows:
+                self._faiss.add(np.ascontiguousarray(block[self._faiss_rows - offset:], dtype=np.float32))
+                self._faiss_rows = offset + len(block)
+        return self._faiss
+
+    def _compact(self):
+        """丢弃被删除的行"""
+        keys = list(self._rows)
+        vectors = self.vectors(keys)
+        self._blocks, self._offsets, self._pending = ([vectors], [0], []) if keys else ([], [], [])
+        self._keys = keys
+        self._rows = {key: row for row, key in enumerate(keys)}
+        self._faiss, self._faiss_rows = None, 0
+
+    def snapshot(self, path):
+        """把存活的向量与元数据写入目录 path（先写临时文件再替换，不会留下写了一半的快照）"""
+        with self._lock:
+            os.makedirs(path, exist_ok=True)
+            keys = list(self._rows)
+            vectors = self.vectors(keys)
+            with open(os.path.join(path, "vectors.npy.tmp"), "wb") as f:
+                np.save(f, vectors)
+            with open(os.path.join(path, "meta.json.tmp"), "w", encoding="utf-8") as f:
+                json.dump({"dim": self.dim, "keys": keys, "hashes": [self._hashes[key] for key in keys]}, f, ensure_ascii=False)
+            os.replace(os.path.join(path, "vectors.npy.tmp"), os.path.join(path, "vectors.npy"))
+            os.replace(os.path.join(path, "meta.json.tmp"), os.path.join(path, "meta.json"))
+
+    @classmethod
+    def restore(cls, path) -> "VectorIndex":
+        """从 snapshot() 写入的目录恢复，向量以只读内存映射方式打开"""
+        with open(os.path.join(path, "meta.json"), encoding="utf-8") as f:
+            meta = json.load(f)
+        index = cls(meta["dim"])
+        if meta["keys"]:
+            index._blocks, index._offsets = [np.load(os.path.join(path, "vectors.npy"), mmap_mode="r")], [0]
+        index._keys = list(meta["keys"])
+        index._rows = {key: row for row, key in enumerate(index._keys)}
+        index._hashes = dict(zip(index._keys, meta["hashes"]))
+        return index
+
+
+class VectorIndexStore:
+    """
+    按 (scenario, kind) 保存 VectorIndex，超过容量时淘汰最久未使用的索引。
+    设置 directory 时第一次访问会从磁盘恢复快照，淘汰前先保存快照。
+    """
+
+    def __init__(self, directory: str | None = None, max_indexes: int = 256):
+        self.directory = directory
+        self.max_indexes = max_indexes
+        self._indexes = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _path(self, scenario, kind):
+        return os.path.join(self.directory, hashlib.sha1(scenario.encode("utf-8")).hexdigest()[:16], kind)
+
+    def get(self, scenario, kind) -> VectorIndex:
+        key = (scenario, kind)
+        with self._lock:
+            index = self._indexes.get(key)
+            if index is None:
+                index = self._load(scenario, kind)
+                self._indexes[key] = index
+            self._indexes.move_to_end(key)
+            while len(self._indexes) > self.max_indexes:
+                (evicted_scenario, evicted_kind), evicted = self._indexes.popitem(last=False)
+                self._save(evicted_scenario, evicted_kind, evicted)
+            return index
+
+    def find(self, scenario, kind) -> VectorIndex | None:
+        """与 get 相同，但内存中没有、磁盘上也没有快照时返回 None，不新建空索引"""
+        with self._lock:
+            if (scenario, kind) not in self._indexes and not self._has_snapshot(scenario, kind):
+                return None
+        return self.get(scenario, kind)
+
+    def _has_snapshot(self, scenario, kind):
+        return bool(self.directory) and os.path.exists(os.path.join(self._path(scenario, kind), "meta.json"))
+
+    def _load(self, scenario, kind):
+        if self._has_snapshot(scenario, kind):
+            try:
+                return VectorIndex.restore(self._path(scenario, kind))
+            except Exception as e:
+                print(f"Failed to restore vector index for {scenario}/{kind}: {str(e)}")
+        return VectorIndex()
+
+    def _save(self, scenario, kind, index):
+        if self.directory:
+            index.snapshot(self._path(scenario, kind))
+
+    def snapshot(self, scenario: str | None = None) -> int:
+        """保存 scenario（未指定时为全部）的索引快照，返回保存的索引数"""
+        if not self.directory:
+            return 0
+        with self._lock:
+            items = [(key, index) for key, index in self._indexes.items() if scenario is None or key[0] == scenario]
+        for (index_scenario, kind), index in items:
+            self._save(index_scenario, kind, index)
+        return len(items)
+
+    def delete(self, scenario):
+        """删除 scenario 的所有索引及其快照"""
+        with self._lock:
+            for key in [key for key in self._indexes if key[0] == scenario]:
+                del self._indexes[key]
+        if self.directory:
+            shutil.rmtree(os.path.dirname(self._path(scenario, "")), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "backend": "faiss" if faiss is not None else "numpy",
+                "directory": self.directory,
+                "indexes": len(self._indexes),
+                "max_indexes": self.max_indexes,
+                "vectors": sum(len(index) for index in self._indexes.values()),
+            }